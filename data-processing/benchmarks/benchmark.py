@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Benchmark Suite for NASA SAR Data Processing
+Measures wall time, throughput (Mpix/s) and peak RSS of the processing
+stages on synthetic scenes of several sizes, stores the results as JSON and
+flags regressions against a stored baseline.
+
+Synthetic scenes (SAR with sea clutter, bright ships and dark slicks, plus
+red/NIR/green bands with a coastline) are generated once per size and seed
+and reused. Every run of a stage happens in a fresh process: imports and
+setup (e.g. loading the array a stage works on) are excluded from the
+timing, and the process's peak RSS is reset just before the stage starts
+(Linux), so each peak belongs to that stage alone. Stage sizes that would
+not fit in the available memory are skipped and reported as such.
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import nullcontext, redirect_stderr, redirect_stdout
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIR.parent / "scripts"))
+
+import warnings
+from data_converter import available_memory, estimate_conversion_memory
+from raster_stats import sidecar_path
+warnings.filterwarnings('ignore')
+
+DEFAULT_SIZES = (1024, 2048, 4096)
+FULL_SIZES = (1024, 2048, 4096, 8192, 16384, 20000)
+BANDS = ("sar", "red", "nir", "green")
+# Regression thresholds: relative, plus an absolute slack for tiny timings / footprints
+TIME_TOLERANCE = 0.15
+MEMORY_TOLERANCE = 0.10
+MIN_TIME_DELTA = 0.05
+MIN_MEMORY_DELTA_MB = 16
+# Stages may use this fraction of the currently available memory
+MEMORY_HEADROOM = 0.8
+TIMEOUT = 1800
+MB = 1024 * 1024
+
+
+def _index_calculator(scene, work_dir, options, windowed):
+    from index_calculator import IndexCalculator
+    calculator = IndexCalculator(work_dir, work_dir / "indices", windowed=windowed, workers=options['workers'])
+    return lambda: calculator.calculate_all_indices(scene['sar'], scene['red'], scene['nir'], scene['green'])
+
+
+def _setup_tiff_to_csv(scene, work_dir, options):
+    from data_converter import DataConverter
+    converter = DataConverter(work_dir, work_dir / "tables", "csv")
+    return lambda: converter.tiff_to_csv(scene['sar'], work_dir / "tables" / "sar_pixels.csv", options['sample_rate'])
+
+
+def _load_sar(scene):
+    with rasterio.open(scene['sar']) as src:
+        return src.read(1).ravel()
+
+
+def _setup_extract_sar_features(scene, work_dir, options):
+    from oil_spill_detector import OilSpillDetector
+    detector = OilSpillDetector(work_dir, work_dir / "models")
+    sar = _load_sar(scene)
+    return lambda: detector.extract_sar_features(sar)
+
+
+def _setup_detect_ships(scene, work_dir, options):
+    from oil_spill_detector import OilSpillDetector
+    detector = OilSpillDetector(work_dir, work_dir / "models")
+    ship_params = detector.create_ship_detection_model()
+    sar = _load_sar(scene)
+    return lambda: detector.detect_ships(sar, ship_params)
+
+
+def _setup_process_sar_data(scene, work_dir, options):
+    from pipeline import DataProcessingPipeline
+    # Fresh base directory: raster and index caches start cold
+    pipeline = DataProcessingPipeline(work_dir, index_workers=options['workers'])
+
+    def run():
+        if pipeline.process_sar_data(scene['sar'], scene['red'], scene['nir'], scene['green'],
+                                     options['sample_rate']) is None:
+            raise RuntimeError("pipeline reported a failed step")
+    return run
+
+
+# setup(scene, work_dir, options) returns the callable that is timed;
+# memory(size, scene, options) estimates its peak bytes
+STAGES = {
+    'tiff_to_csv': {
+        'setup': _setup_tiff_to_csv,
+        'memory': lambda size, scene, options: estimate_conversion_memory(scene['sar']),
+    },
+    'calculate_all_indices': {
+        'setup': lambda scene, work_dir, options: _index_calculator(scene, work_dir, options, windowed=False),
+        # Four bands, three outputs and scratch buffers, float32
+        'memory': lambda size, scene, options: size * size * 40,
+    },
+    'calculate_all_indices_windowed': {
+        'setup': lambda scene, work_dir, options: _index_calculator(scene, work_dir, options, windowed=True),
+        'memory': lambda size, scene, options: 256 * MB,
+    },
+    'extract_sar_features': {
+        'setup': _setup_extract_sar_features,
+        # Band, diff/abs temporaries and the sort copies of median/percentile
+        'memory': lambda size, scene, options: size * size * 32,
+    },
+    'detect_ships': {
+        'setup': _setup_detect_ships,
+        # Band plus the candidate mask; the pixel loop keeps at most one region
+        'memory': lambda size, scene, options: size * size * 6,
+    },
+    'process_sar_data': {
+        'setup': _setup_process_sar_data,
+        'memory': lambda size, scene, options: size * size * 64 + estimate_conversion_memory(scene['sar']),
+    },
+}
+
+
+def scene_paths(data_dir, size, seed=0):
+    return {band: Path(data_dir) / f"scene_{size}_s{seed}_{band}.tif" for band in BANDS}
+
+
+def generate_scene(data_dir, size, seed=0):
+    """
+    Synthetic co-registered SAR + optical scene of size × size pixels (reused if present)
+
+    Written strip by strip as tiled float32 GeoTIFFs, so memory stays
+    bounded even at 20k². SAR is linear backscatter in about 0-1: gamma
+    sea clutter, dark elliptical slicks and bright rectangular ships. The
+    optical bands show water west of a wavy coastline and vegetation east.
+    """
+    paths = scene_paths(data_dir, size, seed)
+    if all(path.exists() for path in paths.values()):
+        return paths
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    print(f"🧪 Generating synthetic {size}×{size} scene...")
+
+    rng = np.random.default_rng([seed, size])
+    ships = size * size // 250_000 + 1
+    ship_rows = rng.integers(0, size - 8, ships)
+    ship_cols = rng.integers(0, size // 2 - 24, ships)
+    ship_shapes = rng.integers((3, 10), (8, 24), (ships, 2))
+    slicks = 3 + size // 4096
+    slick_centers = rng.uniform(0, size, (slicks, 2)) * [1, 0.5]
+    slick_axes = rng.uniform(0.02, 0.08, (slicks, 2)) * size
+
+    profile = {
+        'driver': 'GTiff', 'width': size, 'height': size, 'count': 1, 'dtype': 'float32',
+        'crs': 'EPSG:4326', 'transform': from_origin(-76.6, 39.4, 1e-4, 1e-4),
+        'tiled': True, 'blockxsize': 512, 'blockysize': 512, 'BIGTIFF': 'IF_SAFER',
+    }
+    tmp_paths = {band: path.with_suffix('.tmp.tif') for band, path in paths.items()}
+    writers = {band: rasterio.open(tmp_paths[band], 'w', **profile) for band in BANDS}
+    try:
+        strip = 512
+        cols = np.arange(size, dtype=np.float32)
+        for row_off in range(0, size, strip):
+            rows = min(strip, size - row_off)
+            strip_rng = np.random.default_rng([seed, size, row_off])
+            y = np.arange(row_off, row_off + rows, dtype=np.float32)[:, None]
+
+            sar = strip_rng.gamma(4.0, 0.03, (rows, size)).astype(np.float32)
+            for (cy, cx), (ay, ax) in zip(slick_centers, slick_axes):
+                inside = ((y - cy) / ay) ** 2 + ((cols - cx) / ax) ** 2 < 1
+                sar[inside] *= 0.3
+            for r, c, (h, w) in zip(ship_rows, ship_cols, ship_shapes):
+                top, bottom = max(r, row_off), min(r + h, row_off + rows)
+                if top < bottom:
+                    sar[top - row_off:bottom - row_off, c:c + w] = strip_rng.uniform(0.6, 1.0)
+
+            coast = size * (0.5 + 0.05 * np.sin(y / size * 12.0))
+            land = (cols >= coast).astype(np.float32)
+            noise = strip_rng.normal(0, 0.01, (3, rows, size)).astype(np.float32)
+            window = Window(0, row_off, size, rows)
+            writers['sar'].write(sar, 1, window=window)
+            writers['red'].write(np.maximum(0.04 + 0.04 * land + noise[0], 0), 1, window=window)
+            writers['nir'].write(np.maximum(0.03 + 0.30 * land + noise[1], 0), 1, window=window)
+            writers['green'].write(np.maximum(0.06 + 0.02 * land + noise[2], 0), 1, window=window)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    for band in BANDS:
+        os.replace(tmp_paths[band], paths[band])
+    return paths
+
+
+def reset_peak_rss():
+    """Reset the process's peak RSS (VmHWM); False where not supported"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _proc_status(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes"""
+    peak = _proc_status('VmHWM')
+    if peak is None:
+        # ru_maxrss is in KB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == 'darwin' else 1024
+    return peak
+
+
+def _stage_worker(stage, scene, work_dir, options, conn):
+    """Run one stage once in this (fresh) process and send its measurements"""
+    try:
+        with open(os.devnull, 'w') as devnull, \
+                nullcontext() if options['verbose'] else redirect_stdout(devnull), \
+                nullcontext() if options['verbose'] else redirect_stderr(devnull):
+            run = STAGES[stage]['setup'](scene, Path(work_dir), options)
+            gc.collect()
+            isolated = reset_peak_rss()
+            start_rss = _proc_status('VmRSS') or peak_rss()
+            start_cpu, start = time.process_time(), time.perf_counter()
+            run()
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - start_cpu
+        conn.send({'wall_s': wall, 'cpu_s': cpu, 'peak_rss_mb': peak_rss() / MB,
+                   'start_rss_mb': start_rss / MB, 'rss_isolated': isolated})
+    except BaseException as e:
+        conn.send({'error': f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_once(stage, scene, data_dir, options, timeout=TIMEOUT):
+    """Measurements of one run of a stage in a fresh process, or {'error': ...}"""
+    # Statistics sidecars left by a previous run would let it skip a pass
+    for path in scene.values():
+        sidecar_path(path).unlink(missing_ok=True)
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    work_dir = tempfile.mkdtemp(dir=data_dir, prefix=f".{stage}.")
+    process = context.Process(target=_stage_worker, args=(stage, scene, work_dir, options, sender))
+    try:
+        process.start()
+        sender.close()
+        if receiver.poll(timeout):
+            try:
+                result = receiver.recv()
+            except EOFError:
+                result = None
+        else:
+            process.terminate()
+            result = {'error': f"timed out after {timeout} s"}
+        process.join()
+        if result is None:
+            result = {'error': f"worker exited with code {process.exitcode} (out of memory?)"}
+        return result
+    finally:
+        if process.is_alive():
+            process.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def skip_reason(stage, size, scene, options):
+    """Why a stage/size combination is not run, or None"""
+    needed = STAGES[stage]['memory'](size, scene, options)
+    available = available_memory()
+    if available is not None and needed > available * MEMORY_HEADROOM:
+        return f"needs ~{needed / 1024 ** 3:.1f} GB, {available / 1024 ** 3:.1f} GB available"
+    return None
+
+
+def host_info():
+    cpu = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            cpu = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')), cpu)
+    except OSError:
+        pass
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'platform': platform.platform(),
+        'cpu': cpu,
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'rasterio': rasterio.__version__,
+        'gdal': rasterio.__gdal_version__,
+        'commit': commit,
+    }
+
+
+def run_benchmarks(stages, sizes, data_dir, options, repeat=3, timeout=TIMEOUT):
+    """
+    Run every stage at every size
+
+    Returns:
+        {"<stage>@<size>": result}; a result has status ok, skipped or
+        error and, when ok, the best wall time over the repeats (also the
+        median and every run), throughput, CPU time and peak RSS
+    """
+    results = {}
+    for size in sizes:
+        scene = {band: str(path) for band, path in generate_scene(data_dir, size, options['seed']).items()}
+        pixels = size * size
+        for stage in stages:
+            key = f"{stage}@{size}"
+            result = {'stage': stage, 'size': size, 'pixels': pixels}
+            reason = skip_reason(stage, size, scene, options)
+            if reason:
+                print(f"⏭️  {key}: skipped ({reason})")
+                results[key] = dict(result, status='skipped', reason=reason)
+                continue
+
+            runs = []
+            for _ in range(repeat):
+                measured = run_once(stage, scene, data_dir, options, timeout)
+                if 'error' in measured:
+                    break
+                runs.append(measured)
+            if len(runs) < repeat:
+                print(f"❌ {key}: {measured['error']}")
+                results[key] = dict(result, status='error', error=measured['error'])
+                continue
+
+            walls = sorted(run['wall_s'] for run in runs)
+            best = min(runs, key=lambda run: run['wall_s'])
+            result.update(
+                status='ok',
+                wall_s=walls[0],
+                wall_median_s=float(np.median(walls)),
+                wall_runs_s=[run['wall_s'] for run in runs],
+                cpu_s=best['cpu_s'],
+                mpix_per_s=pixels / walls[0] / 1e6,
+                peak_rss_mb=max(run['peak_rss_mb'] for run in runs),
+                start_rss_mb=best['start_rss_mb'],
+                rss_isolated=all(run['rss_isolated'] for run in runs),
+            )
+            results[key] = result
+            print(f"⏱️  {key}: {result['wall_s']:.3f} s, {result['mpix_per_s']:.2f} Mpix/s, "
+                  f"peak {result['peak_rss_mb']:.0f} MB")
+    return results
+
+
+def compare(results, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """
+    Compare results with a baseline
+
+    A stage regresses when its best wall time exceeds the baseline's by more
+    than time_tolerance (relative) and MIN_TIME_DELTA seconds, or its peak
+    RSS by more than memory_tolerance and MIN_MEMORY_DELTA_MB.
+
+    Returns:
+        {key: {'time_ratio', 'memory_ratio', 'regressions': [...], 'improvements': [...]}}
+        for the stages measured in both
+    """
+    comparison = {}
+    for key, result in results.items():
+        base = baseline.get('results', {}).get(key)
+        if result.get('status') != 'ok' or not base or base.get('status') != 'ok':
+            continue
+        entry = {
+            'time_ratio': result['wall_s'] / base['wall_s'],
+            'memory_ratio': result['peak_rss_mb'] / base['peak_rss_mb'],
+            'regressions': [],
+            'improvements': [],
+        }
+        time_delta = result['wall_s'] - base['wall_s']
+        if time_delta > max(base['wall_s'] * time_tolerance, MIN_TIME_DELTA):
+            entry['regressions'].append('time')
+        elif -time_delta > max(base['wall_s'] * time_tolerance, MIN_TIME_DELTA):
+            entry['improvements'].append('time')
+        memory_delta = result['peak_rss_mb'] - base['peak_rss_mb']
+        if memory_delta > max(base['peak_rss_mb'] * memory_tolerance, MIN_MEMORY_DELTA_MB):
+            entry['regressions'].append('memory')
+        elif -memory_delta > max(base['peak_rss_mb'] * memory_tolerance, MIN_MEMORY_DELTA_MB):
+            entry['improvements'].append('memory')
+        comparison[key] = entry
+    return comparison
+
+
+def print_report(results, comparison=None):
+    print("\n📊 Benchmark results")
+    print("=" * 86)
+    print(f"{'stage':<32}{'size':>7}{'wall s':>10}{'Mpix/s':>10}{'peak MB':>10}  vs baseline")
+    for key, result in results.items():
+        stage, size = result['stage'], result['size']
+        if result['status'] != 'ok':
+            print(f"{stage:<32}{size:>7}  {result['status']}: {result.get('reason') or result.get('error')}")
+            continue
+        note = ""
+        if comparison and key in comparison:
+            entry = comparison[key]
+            note = f"time ×{entry['time_ratio']:.2f}, memory ×{entry['memory_ratio']:.2f}"
+            if entry['regressions']:
+                note += f"  ❌ {' & '.join(entry['regressions'])} regression"
+            elif entry['improvements']:
+                note += f"  ✅ {' & '.join(entry['improvements'])} improved"
+        print(f"{stage:<32}{size:>7}{result['wall_s']:>10.3f}{result['mpix_per_s']:>10.2f}"
+              f"{result['peak_rss_mb']:>10.0f}  {note}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data-processing stages on synthetic scenes")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="Stages to run")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Scene sides in pixels")
+    parser.add_argument("--full", action="store_true", help=f"Run sizes {', '.join(map(str, FULL_SIZES))} (1k² to 20k²)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage and size (the best is reported)")
+    parser.add_argument("--sample-rate", type=float, default=0.1, help="Pixel table sampling rate of tiff_to_csv / process_sar_data")
+    parser.add_argument("--workers", type=int, default=1, help="Index calculation threads")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic scenes")
+    parser.add_argument("--data-dir", default=str(BENCHMARK_DIR / ".data"), help="Directory for synthetic scenes and scratch outputs")
+    parser.add_argument("--output", help="Results JSON (default: benchmarks/results/benchmark_<time>.json)")
+    parser.add_argument("--baseline", default=str(BENCHMARK_DIR / "baselines" / "baseline.json"), help="Baseline JSON to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="Merge these results into the baseline")
+    parser.add_argument("--tolerance", type=float, default=TIME_TOLERANCE, help="Allowed relative wall-time increase")
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE, help="Allowed relative peak RSS increase")
+    parser.add_argument("--timeout", type=int, default=TIMEOUT, help="Seconds before a run is aborted")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the stages")
+    args = parser.parse_args()
+
+    sizes = list(FULL_SIZES) if args.full else args.sizes
+    options = {'sample_rate': args.sample_rate, 'workers': args.workers, 'seed': args.seed,
+               'verbose': args.verbose}
+    print("🏁 NASA SAR Data Processing Benchmarks")
+    print(f"   Stages: {', '.join(args.stages)}; sizes: {', '.join(map(str, sizes))}; {args.repeat} run(s) each")
+
+    results = run_benchmarks(args.stages, sizes, args.data_dir, options, args.repeat, args.timeout)
+    record = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'host': host_info(),
+        'options': {key: value for key, value in options.items() if key != 'verbose'},
+        'results': results,
+    }
+
+    baseline_path = Path(args.baseline)
+    baseline = None
+    if baseline_path.exists():
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+        record['comparison'] = compare(results, baseline, args.tolerance, args.memory_tolerance)
+        if (baseline['host']['cpu'], baseline['host']['cpus']) != (record['host']['cpu'], record['host']['cpus']):
+            print(f"⚠️  Baseline was measured on another machine ({baseline['host']['cpu']}, "
+                  f"{baseline['host']['cpus']} CPUs); ratios are not meaningful")
+    print_report(results, record.get('comparison'))
+
+    output = Path(args.output) if args.output else BENCHMARK_DIR / "results" / f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(record, f, indent=2)
+    print(f"\n✅ Results saved to {output}")
+
+    if args.update_baseline:
+        merged = dict(record, results=dict((baseline or {}).get('results', {}), **results))
+        merged.pop('comparison', None)
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(merged, f, indent=2)
+        print(f"✅ Baseline updated: {baseline_path}")
+    elif baseline is None:
+        print(f"ℹ️  No baseline at {baseline_path}; create one with --update-baseline")
+
+    regressions = {key: entry['regressions'] for key, entry in record.get('comparison', {}).items()
+                   if entry['regressions']}
+    if regressions and not args.update_baseline:
+        listed = ", ".join(f"{key} ({'/'.join(kinds)})" for key, kinds in regressions.items())
+        print(f"❌ {len(regressions)} regression(s) beyond tolerance: {listed}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
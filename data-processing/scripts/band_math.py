@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Band-Math Expression Compiler for NASA SAR App
+Defines indices as arithmetic expressions over named bands, e.g.
+
+    "ndwi": "clip((green - nir) / (green + nir), -1, 1)"
+
+All requested expressions are parsed once into a single graph. Identical
+subexpressions, across indices as well, are merged (common-subexpression
+elimination), and expressions may refer to other registered indices by name,
+so "nd" reuses the dB bands computed for "vv_db" and "vh_db". The graph is
+evaluated block by block in float32 with numpy ufuncs writing into reused
+buffers. Every intermediate is computed once per block and released after
+its last use.
+
+Supported syntax: + - * / ** unary minus, numbers, band or index names and
+the functions log10, log, exp, sqrt, abs, min, max and clip(x, low, high).
+Division yields 0 where the denominator is 0, like the hand-written indices.
+"""
+
+import ast
+
+import numpy as np
+
+# Registered indices; adding one is a single entry here
+INDEX_EXPRESSIONS = {
+    # Optical (same definitions as the IndexCalculator methods)
+    'ndvi': "clip((nir - red) / (nir + red), -1, 1)",
+    'ndci': "clip((red - green) / (red + green), -1, 1)",
+    'ndwi': "clip((green - nir) / (green + nir), -1, 1)",
+    # Sentinel-1, as in earth_engine_scripts/sentinel1_chesapeake_bay.js
+    'vv_db': "10 * log10(vv)",
+    'vh_db': "10 * log10(vh)",
+    'vv_vh_ratio': "vv_db / vh_db",
+    'vh_vv_ratio': "vh_db / vv_db",
+    'nd': "(vv_db - vh_db) / (vv_db + vh_db)",
+}
+
+_BINARY = {ast.Add: 'add', ast.Sub: 'sub', ast.Mult: 'mul', ast.Div: 'div', ast.Pow: 'pow'}
+_FUNCTIONS = {'log10': 1, 'log': 1, 'exp': 1, 'sqrt': 1, 'abs': 1, 'min': 2, 'max': 2, 'clip': 3}
+# Operands of these are sorted so a + b and b + a share one node
+_COMMUTATIVE = {'add', 'mul', 'min', 'max'}
+
+def _safe_divide(a, b, out):
+    """a / b into out, 0 where b == 0, without temporaries for the masked lanes"""
+    mask = np.not_equal(b, 0)
+    np.divide(a, b, out=out, where=mask, dtype=np.float32)
+    np.copyto(out, 0, where=~mask)
+    return out
+
+
+_KERNELS = {
+    'add': lambda a, b, out: np.add(a, b, out=out, dtype=np.float32),
+    'sub': lambda a, b, out: np.subtract(a, b, out=out, dtype=np.float32),
+    'mul': lambda a, b, out: np.multiply(a, b, out=out, dtype=np.float32),
+    'div': _safe_divide,
+    'pow': lambda a, b, out: np.power(a, b, out=out, dtype=np.float32),
+    'neg': lambda a, out: np.negative(a, out=out, dtype=np.float32),
+    'abs': lambda a, out: np.absolute(a, out=out, dtype=np.float32),
+    'log10': lambda a, out: np.log10(a, out=out, dtype=np.float32),
+    'log': lambda a, out: np.log(a, out=out, dtype=np.float32),
+    'exp': lambda a, out: np.exp(a, out=out, dtype=np.float32),
+    'sqrt': lambda a, out: np.sqrt(a, out=out, dtype=np.float32),
+    'min': lambda a, b, out: np.minimum(a, b, out=out, dtype=np.float32),
+    'max': lambda a, b, out: np.maximum(a, b, out=out, dtype=np.float32),
+    'clip': lambda x, low, high, out: np.clip(x, low, high, out=out, dtype=np.float32),
+}
+
+
+class BandMathError(ValueError):
+    """Invalid or unsupported band-math expression"""
+
+
+class BandMathProgram:
+    """
+    Compiled graph of one or more band-math expressions
+
+    Nodes are (op, args) tuples in topological order. A band node holds the
+    band name, a const node its value, and any other node the indices of its
+    operands.
+    """
+
+    def __init__(self, expressions, registry=None):
+        """
+        Args:
+            expressions: {output name: expression}, or a list of names from
+                the registry
+            registry: Named expressions usable as outputs and inside other
+                expressions (default: INDEX_EXPRESSIONS)
+        """
+        self.registry = dict(INDEX_EXPRESSIONS if registry is None else registry)
+        if not isinstance(expressions, dict):
+            unknown = [name for name in expressions if name not in self.registry]
+            if unknown:
+                raise BandMathError(f"Unknown indices: {', '.join(unknown)} "
+                                    f"(registered: {', '.join(sorted(self.registry))})")
+            expressions = {name: self.registry[name] for name in expressions}
+        self.registry.update(expressions)
+
+        self.nodes = []
+        self._ids = {}
+        self._resolving = []
+        self.outputs = {name: self._compile(name, expression) for name, expression in expressions.items()}
+        self.bands = sorted({args for op, args in self.nodes if op == 'band'})
+
+        # Last node reading each node's value; outputs stay alive to the end
+        self._last_use = {}
+        for index, (op, args) in enumerate(self.nodes):
+            if op not in ('band', 'const'):
+                for arg in args:
+                    self._last_use[arg] = index
+        for node in self.outputs.values():
+            self._last_use[node] = len(self.nodes)
+
+    def __repr__(self):
+        return f"BandMathProgram({', '.join(self.outputs)}; {len(self.nodes)} nodes over {', '.join(self.bands)})"
+
+    def _node(self, op, args):
+        """Index of the node (op, args), created only if no identical node exists"""
+        if op in _COMMUTATIVE:
+            args = tuple(sorted(args))
+        # Constant folding with the block kernels, so folded constants match
+        # what the blocks would compute (float32, inf/NaN instead of errors)
+        if op not in ('band', 'const') and all(self.nodes[arg][0] == 'const' for arg in args):
+            operands = [np.float32(self.nodes[arg][1]) for arg in args]
+            with np.errstate(all='ignore'):
+                value = float(_KERNELS[op](*operands, out=np.empty((), dtype=np.float32)))
+            return self._node('const', value)
+        key = (op, args)
+        if key not in self._ids:
+            self._ids[key] = len(self.nodes)
+            self.nodes.append(key)
+        return self._ids[key]
+
+    def _compile(self, name, expression):
+        if name in self._resolving:
+            raise BandMathError(f"Circular index definition: {' -> '.join(self._resolving + [name])}")
+        self._resolving.append(name)
+        try:
+            tree = ast.parse(expression, mode='eval')
+        except SyntaxError as e:
+            raise BandMathError(f"Invalid expression for {name}: {expression!r} ({e.msg})") from None
+        try:
+            return self._visit(tree.body, name)
+        finally:
+            self._resolving.pop()
+
+    def _visit(self, node, name):
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            return self._node(_BINARY[type(node.op)], (self._visit(node.left, name), self._visit(node.right, name)))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = self._visit(node.operand, name)
+            return self._node('neg', (operand,)) if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+            return self._node('const', float(node.value))
+        if isinstance(node, ast.Name):
+            if node.id in self.registry:
+                return self._compile(node.id, self.registry[node.id])
+            return self._node('band', node.id)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS:
+            function = node.func.id
+            if node.keywords or len(node.args) != _FUNCTIONS[function]:
+                raise BandMathError(f"{function}() takes {_FUNCTIONS[function]} positional argument(s) (in {name})")
+            return self._node(function, tuple(self._visit(arg, name) for arg in node.args))
+        raise BandMathError(f"Unsupported syntax in {name}: {ast.unparse(node)!r}")
+
+    def evaluate(self, blocks):
+        """
+        Evaluate all outputs on one block
+
+        Args:
+            blocks: {band name: array}, all of the same shape
+
+        Returns:
+            {output name: float32 array of the block's shape}
+        """
+        missing = [band for band in self.bands if band not in blocks]
+        if missing:
+            raise BandMathError(f"Missing input bands: {', '.join(missing)}")
+        shape = np.shape(blocks[self.bands[0]]) if self.bands else ()
+
+        values, owned, free = {}, set(), []
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for index, (op, args) in enumerate(self.nodes):
+                if op == 'band':
+                    values[index] = blocks[args]
+                elif op == 'const':
+                    values[index] = np.float32(args)
+                else:
+                    out = free.pop() if free else np.empty(shape, dtype=np.float32)
+                    _KERNELS[op](*(values[arg] for arg in args), out=out)
+                    values[index] = out
+                    owned.add(index)
+                    # Buffers of operands read for the last time are reused
+                    for arg in set(args):
+                        if arg in owned and self._last_use[arg] == index:
+                            free.append(values.pop(arg))
+                            owned.discard(arg)
+
+        results = {}
+        for name, node in self.outputs.items():
+            value = values[node]
+            if node not in owned:
+                # Plain band or constant outputs
+                value = np.broadcast_to(np.asarray(value, dtype=np.float32), shape).copy()
+            results[name] = value
+        return results
+
+
+def compile_expressions(expressions, registry=None):
+    """Compile {name: expression} or a list of registered index names (see BandMathProgram)"""
+    return BandMathProgram(expressions, registry)
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Scene Catalog for NASA SAR App
+Local, STAC-like catalog of the rasters in the data directory, stored in
+SQLite with an R-tree over the WGS84 footprints.
+
+Entries are built from raster headers only (no pixels are read):
+    footprint    raster bounds reprojected to EPSG:4326
+    datetime     GeoTIFF/Earth Engine metadata tags, else the filename
+    platform, instrument mode, product type, polarisations, absolute and
+    relative orbit
+                 tags, band descriptions and the Sentinel-1 naming
+                 convention (S1A_IW_GRDH_1SDV_20240115T225959_..._049000_...)
+    orbit state  tags only (ASCENDING/DESCENDING); unknown otherwise
+
+Queries such as "VV+VH IW scenes over this bbox between these dates,
+ascending orbit" combine the R-tree with an index on acquisition time and run
+in milliseconds. Re-indexing only re-reads files whose size or mtime changed.
+"""
+
+import argparse
+import json
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import rasterio
+from rasterio.warp import transform_bounds
+
+CATALOG_NAME = "catalog.sqlite"
+POLARISATIONS = ("VV", "VH", "HH", "HV")
+MODES = ("IW", "EW", "SM", "WV")
+ORBIT_STATES = ("ascending", "descending")
+
+# S1A_IW_GRDH_1SDV_20240115T225959_20240115T230024_052000_0648A1_1A2B
+S1_NAME = re.compile(
+    r'(?P<platform>S1[A-D])_(?P<mode>IW|EW|WV|S[1-6])_(?P<product>GRD[FHM]?|SLC|RAW|OCN)_?'
+    r'(?P<level>\d)(?P<cls>[SA])(?P<pol>SH|SV|DH|DV|HH|VV|HV|VH)_'
+    r'(?P<start>\d{8}T\d{6})_(?P<stop>\d{8}T\d{6})_(?P<orbit>\d{6})'
+)
+DATETIME_PATTERN = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})(?:[T ](\d{2}):?(\d{2}):?(\d{2}))?')
+POLARISATION_SUFFIX = re.compile(r'(?:^|[_\-.])(VV|VH|HH|HV)(?=$|[_\-.])', re.IGNORECASE)
+PRODUCT_POLARISATIONS = {
+    'SH': ('HH',), 'SV': ('VV',), 'DH': ('HH', 'HV'), 'DV': ('VV', 'VH'),
+    'HH': ('HH',), 'VV': ('VV',), 'HV': ('HV',), 'VH': ('VH',),
+}
+# Absolute orbit of each platform's first pass over relative orbit 1
+RELATIVE_ORBIT_OFFSETS = {'S1A': 73, 'S1B': 27, 'S1C': 172}
+
+# Metadata tag names written by SNAP, GDAL and Earth Engine exports
+DATETIME_TAGS = ('ACQUISITION_START_TIME', 'first_line_time', 'PRODUCT_FIRST_LINE_UTC_TIME',
+                 'segmentStartTime', 'TIFFTAG_DATETIME', 'DATETIME')
+MODE_TAGS = ('instrumentMode', 'ACQUISITION_MODE', 'MODE')
+ORBIT_STATE_TAGS = ('orbitProperties_pass', 'PASS', 'ORBIT_DIRECTION', 'ORBIT_PASS')
+POLARISATION_TAGS = ('transmitterReceiverPolarisation', 'POLARISATIONS', 'POLARISATION')
+PLATFORM_TAGS = ('platform_number', 'MISSION', 'PLATFORM')
+RELATIVE_ORBIT_TAGS = ('relativeOrbitNumber_start', 'REL_ORBIT', 'RELATIVE_ORBIT')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    datetime TEXT,
+    platform TEXT,
+    mode TEXT,
+    product_type TEXT,
+    polarisations TEXT,
+    orbit_state TEXT,
+    absolute_orbit INTEGER,
+    relative_orbit INTEGER,
+    crs TEXT,
+    width INTEGER,
+    height INTEGER,
+    band_count INTEGER,
+    dtype TEXT,
+    resolution REAL,
+    west REAL, south REAL, east REAL, north REAL
+);
+CREATE INDEX IF NOT EXISTS scenes_datetime ON scenes (datetime);
+CREATE INDEX IF NOT EXISTS scenes_mode_orbit ON scenes (mode, orbit_state);
+CREATE VIRTUAL TABLE IF NOT EXISTS scene_footprints USING rtree (id, west, east, south, north);
+"""
+
+
+def _tag(tags, names):
+    """First non-empty value among tag names (case-insensitive)"""
+    lowered = {key.lower(): value for key, value in tags.items()}
+    for name in names:
+        value = lowered.get(name.lower())
+        if value not in (None, ''):
+            return str(value)
+    return None
+
+
+def _parse_datetime(value):
+    """ISO 'YYYY-MM-DDTHH:MM:SS' (UTC) from a tag value or filename fragment"""
+    if value is None:
+        return None
+    if re.fullmatch(r'\d{12,13}', value):
+        # Earth Engine system:time_start (milliseconds since epoch)
+        return datetime.fromtimestamp(int(value) / 1000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    match = DATETIME_PATTERN.search(value.replace(':', '-', 2) if re.match(r'\d{4}:\d{2}:\d{2}', value) else value)
+    if not match:
+        return None
+    year, month, day, hour, minute, second = (int(g) if g else 0 for g in match.groups())
+    try:
+        return datetime(year, month, day, hour, minute, second).strftime('%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+
+
+def _query_time(value, end=False):
+    """Query bound: date-only end bounds include the whole day"""
+    parsed = _parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid date: {value} (use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)")
+    if end and len(value.strip()) <= 10:
+        return (datetime.fromisoformat(parsed) + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S'), '<'
+    return parsed, '<=' if end else '>='
+
+
+def read_scene_metadata(path):
+    """Catalog entry for one raster, from its header, tags and filename"""
+    path = Path(path)
+    stat = path.stat()
+    with rasterio.open(path) as src:
+        tags = dict(src.tags())
+        descriptions = [d for d in src.descriptions if d]
+        crs = src.crs
+        bounds = src.bounds
+        entry = {
+            'crs': crs.to_string() if crs else None,
+            'width': src.width,
+            'height': src.height,
+            'band_count': src.count,
+            'dtype': src.dtypes[0],
+            'resolution': abs(src.transform.a),
+        }
+    if crs is not None:
+        west, south, east, north = transform_bounds(crs, 'EPSG:4326', *bounds, densify_pts=21)
+    else:
+        # No CRS: only usable if the grid already is in degrees
+        west, south, east, north = bounds.left, bounds.bottom, bounds.right, bounds.top
+        if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+            raise ValueError("no CRS and bounds are not geographic")
+
+    name = S1_NAME.search(path.name)
+    platform = _tag(tags, PLATFORM_TAGS)
+    if platform and len(platform) == 1:
+        platform = f"S1{platform}"
+    if platform is None and name:
+        platform = name.group('platform')
+
+    mode = _tag(tags, MODE_TAGS) or (name.group('mode') if name else None)
+
+    polarisations = set()
+    pol_tag = _tag(tags, POLARISATION_TAGS)
+    if pol_tag:
+        polarisations.update(p for p in re.split(r'[^A-Za-z]+', pol_tag.upper()) if p in POLARISATIONS)
+    polarisations.update(d.upper() for d in descriptions if d.upper() in POLARISATIONS)
+    if not polarisations:
+        # Single-polarisation exports are usually suffixed _VV/_VH; else the product code
+        suffix = POLARISATION_SUFFIX.findall(path.stem[name.end():] if name else path.stem)
+        if suffix:
+            polarisations.update(s.upper() for s in suffix)
+        elif name:
+            polarisations.update(PRODUCT_POLARISATIONS[name.group('pol')])
+
+    orbit_state = _tag(tags, ORBIT_STATE_TAGS)
+    if orbit_state:
+        orbit_state = orbit_state.lower()
+        orbit_state = orbit_state if orbit_state in ORBIT_STATES else None
+
+    absolute_orbit = int(name.group('orbit')) if name else None
+    relative_orbit = _tag(tags, RELATIVE_ORBIT_TAGS)
+    if relative_orbit is not None:
+        relative_orbit = int(float(relative_orbit))
+    elif absolute_orbit is not None and platform in RELATIVE_ORBIT_OFFSETS:
+        relative_orbit = (absolute_orbit - RELATIVE_ORBIT_OFFSETS[platform]) % 175 + 1
+
+    acquired = _parse_datetime(_tag(tags, DATETIME_TAGS) or tags.get('system:time_start'))
+    if acquired is None:
+        acquired = _parse_datetime(name.group('start') if name else path.stem)
+
+    entry.update({
+        'path': str(path.resolve()),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'datetime': acquired,
+        'platform': platform,
+        'mode': mode.upper() if mode else None,
+        'product_type': name.group('product') if name else None,
+        # Delimited so a polarisation can be matched with instr()
+        'polarisations': f",{','.join(sorted(polarisations))}," if polarisations else None,
+        'orbit_state': orbit_state,
+        'absolute_orbit': absolute_orbit,
+        'relative_orbit': relative_orbit,
+        'west': west, 'south': south, 'east': east, 'north': north,
+    })
+    return entry
+
+
+class SceneCatalog:
+    def __init__(self, db_path=f"data/{CATALOG_NAME}"):
+        """
+        Args:
+            db_path: SQLite database file (created if missing)
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM scenes").fetchone()[0]
+
+    def add(self, path):
+        """(Re)index one raster; returns its entry"""
+        entry = read_scene_metadata(path)
+        columns = list(entry)
+        with self.connection:
+            self._delete(entry['path'])
+            cursor = self.connection.execute(
+                f"INSERT INTO scenes ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [entry[c] for c in columns]
+            )
+            self.connection.execute(
+                "INSERT INTO scene_footprints (id, west, east, south, north) VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid, entry['west'], entry['east'], entry['south'], entry['north'])
+            )
+        return entry
+
+    def _delete(self, path):
+        row = self.connection.execute("SELECT id FROM scenes WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            self.connection.execute("DELETE FROM scene_footprints WHERE id = ?", (row['id'],))
+            self.connection.execute("DELETE FROM scenes WHERE id = ?", (row['id'],))
+
+    def index(self, directory, pattern="*.tif", recursive=True):
+        """
+        Bring the catalog up to date with the rasters in a directory
+
+        Unchanged files (same size and mtime) are skipped, changed ones are
+        re-read and entries of deleted files under the directory are removed.
+
+        Returns:
+            Dict with counts of added, updated, unchanged, removed and failed files
+        """
+        directory = Path(directory).resolve()
+        files = sorted(directory.rglob(pattern) if recursive else directory.glob(pattern))
+        known = {
+            row['path']: (row['size'], row['mtime_ns'])
+            for row in self.connection.execute("SELECT path, size, mtime_ns FROM scenes")
+        }
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        seen = set()
+        for path in files:
+            path = path.resolve()
+            seen.add(str(path))
+            stat = path.stat()
+            previous = known.get(str(path))
+            if previous == (stat.st_size, stat.st_mtime_ns):
+                counts['unchanged'] += 1
+                continue
+            try:
+                self.add(path)
+                counts['updated' if previous else 'added'] += 1
+            except (rasterio.errors.RasterioError, ValueError, TypeError, KeyError, AttributeError) as e:
+                # Unreadable file, missing CRS or unparseable tag: skip just this scene
+                print(f"   ⚠️  Skipping unreadable raster {path.name}: {e}")
+                counts['failed'] += 1
+
+        prefix = str(directory).rstrip('/') + '/'
+        with self.connection:
+            for path in known:
+                if path.startswith(prefix) and path not in seen and (recursive or '/' not in path[len(prefix):]):
+                    self._delete(path)
+                    counts['removed'] += 1
+        return counts
+
+    def search(self, bbox=None, start=None, end=None, polarisations=None, mode=None,
+               orbit_state=None, platform=None, product_type=None, relative_orbit=None, limit=None):
+        """
+        Find scenes matching all given criteria, oldest first
+
+        Args:
+            bbox: (west, south, east, north) in degrees; footprints must intersect it
+            start, end: Acquisition time bounds (YYYY-MM-DD or ISO datetime);
+                a date-only end includes that whole day
+            polarisations: Required polarisations, e.g. ["VV", "VH"] (all must be present)
+            mode: Instrument mode (IW, EW, SM, WV)
+            orbit_state: "ascending" or "descending"
+            platform: e.g. "S1A"
+            product_type: e.g. "GRDH"
+            relative_orbit: Relative orbit number
+            limit: Maximum number of scenes
+
+        Returns:
+            List of STAC-like item dicts
+        """
+        clauses, params = [], []
+        source = "scenes"
+        if bbox is not None:
+            west, south, east, north = bbox
+            source = "scenes JOIN scene_footprints f ON f.id = scenes.id"
+            clauses += ["f.east >= ?", "f.west <= ?", "f.north >= ?", "f.south <= ?"]
+            params += [west, east, south, north]
+        if start:
+            value, op = _query_time(start)
+            clauses.append(f"scenes.datetime {op} ?")
+            params.append(value)
+        if end:
+            value, op = _query_time(end, end=True)
+            clauses.append(f"scenes.datetime {op} ?")
+            params.append(value)
+        for polarisation in polarisations or []:
+            clauses.append("instr(scenes.polarisations, ?) > 0")
+            params.append(f",{polarisation.upper()},")
+        for column, value in (('mode', mode), ('platform', platform), ('product_type', product_type)):
+            if value:
+                clauses.append(f"scenes.{column} = ?")
+                params.append(value.upper())
+        if orbit_state:
+            clauses.append("scenes.orbit_state = ?")
+            params.append(orbit_state.lower())
+        if relative_orbit is not None:
+            clauses.append("scenes.relative_orbit = ?")
+            params.append(int(relative_orbit))
+
+        sql = f"SELECT scenes.* FROM {source}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY scenes.datetime, scenes.path"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [self._item(row) for row in self.connection.execute(sql, params)]
+
+    def search_paths(self, **query):
+        """Paths of the scenes matching search(**query), oldest first"""
+        return [Path(item['assets']['data']['href']) for item in self.search(**query)]
+
+    def _item(self, row):
+        """STAC-like Item for a catalog row"""
+        bbox = [row['west'], row['south'], row['east'], row['north']]
+        west, south, east, north = bbox
+        polarisations = row['polarisations'].strip(',').split(',') if row['polarisations'] else []
+        return {
+            'type': 'Feature',
+            'stac_version': '1.0.0',
+            'id': Path(row['path']).stem,
+            'bbox': bbox,
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[[west, south], [east, south], [east, north], [west, north], [west, south]]],
+            },
+            'properties': {
+                'datetime': f"{row['datetime']}Z" if row['datetime'] else None,
+                'platform': row['platform'],
+                'sar:instrument_mode': row['mode'],
+                'sar:product_type': row['product_type'],
+                'sar:polarizations': polarisations,
+                'sat:orbit_state': row['orbit_state'],
+                'sat:absolute_orbit': row['absolute_orbit'],
+                'sat:relative_orbit': row['relative_orbit'],
+                'proj:code': row['crs'],
+                'proj:shape': [row['height'], row['width']],
+                'gsd': row['resolution'],
+            },
+            'assets': {
+                'data': {'href': row['path'], 'type': 'image/tiff; application=geotiff',
+                         'bands': row['band_count'], 'data_type': row['dtype']},
+            },
+        }
+
+
+def add_query_arguments(parser):
+    """Add scene catalog query options to an entry point's argument parser"""
+    group = parser.add_argument_group("scene catalog query (instead of file arguments)")
+    group.add_argument("--catalog", help=f"Scene catalog database (default: <data dir>/{CATALOG_NAME}, refreshed before querying)")
+    group.add_argument("--bbox", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"), help="Footprint must intersect this box (degrees)")
+    group.add_argument("--start", help="Earliest acquisition (YYYY-MM-DD or ISO datetime)")
+    group.add_argument("--end", help="Latest acquisition (a date includes the whole day)")
+    group.add_argument("--polarisation", nargs="+", type=str.upper, choices=POLARISATIONS, help="Required polarisations (e.g. VV VH)")
+    group.add_argument("--mode", type=str.upper, choices=MODES, help="Instrument mode")
+    group.add_argument("--orbit", type=str.lower, choices=ORBIT_STATES, help="Orbit direction")
+    group.add_argument("--platform", type=str.upper, help="Platform (e.g. S1A)")
+    return group
+
+
+def query_from_args(args):
+    """search() keyword arguments from parsed query options (empty if none were given)"""
+    query = {
+        'bbox': args.bbox,
+        'start': args.start,
+        'end': args.end,
+        'polarisations': args.polarisation,
+        'mode': args.mode,
+        'orbit_state': args.orbit,
+        'platform': args.platform,
+    }
+    return {key: value for key, value in query.items() if value}
+
+
+def find_scenes(args, data_dir, single_date=False):
+    """
+    Run the catalog query given on the command line
+
+    The catalog is refreshed from data_dir first (headers of new or changed
+    files only). Returns a list of paths, or None if no query was given.
+
+    Args:
+        single_date: The caller merges the matches into one mosaic, so refuse
+            matches from more than one acquisition date unless args.mosaic is set
+
+    Raises:
+        ValueError: single_date is set and the matches span several dates
+    """
+    query = query_from_args(args)
+    if not query:
+        return None
+    with SceneCatalog(args.catalog or Path(data_dir) / CATALOG_NAME) as catalog:
+        catalog.index(data_dir)
+        items = catalog.search(**query)
+    print(f"🗂️  Catalog query matched {len(items)} scenes")
+    dates = sorted({(item['properties']['datetime'] or 'unknown')[:10] for item in items})
+    if single_date and len(dates) > 1 and not getattr(args, 'mosaic', False):
+        raise ValueError(
+            f"Matches span {len(dates)} acquisition dates ({', '.join(dates)}); narrow "
+            "--start/--end to one date, or pass --mosaic to merge them into one mosaic"
+        )
+    return [Path(item['assets']['data']['href']) for item in items]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and query local SAR scenes")
+    parser.add_argument("--data-dir", default="data", help="Directory of rasters to index")
+    parser.add_argument("--pattern", default="*.tif", help="File pattern to index")
+    parser.add_argument("--index", action="store_true", help="Refresh the catalog from the data directory")
+    parser.add_argument("--limit", type=int, help="Maximum number of scenes to return")
+    parser.add_argument("--json", action="store_true", help="Print matching scenes as STAC-like items")
+    add_query_arguments(parser)
+
+    args = parser.parse_args()
+
+    with SceneCatalog(args.catalog or Path(args.data_dir) / CATALOG_NAME) as catalog:
+        if args.index:
+            started = time.perf_counter()
+            counts = catalog.index(args.data_dir, args.pattern)
+            print(f"🗂️  Indexed {args.data_dir} in {time.perf_counter() - started:.2f}s: "
+                  + ", ".join(f"{count} {status}" for status, count in counts.items()))
+
+        query = query_from_args(args)
+        if query or not args.index:
+            started = time.perf_counter()
+            items = catalog.search(limit=args.limit, **query)
+            elapsed = (time.perf_counter() - started) * 1000
+            if args.json:
+                print(json.dumps({'type': 'FeatureCollection', 'features': items}, indent=2))
+                return
+            print(f"🔍 {len(items)} of {len(catalog)} scenes match ({elapsed:.1f} ms)")
+            for item in items:
+                props = item['properties']
+                print(f"   {props['datetime'] or '?':<21} {props['platform'] or '?':<4} {props['sar:instrument_mode'] or '?':<3} "
+                      f"{'+'.join(props['sar:polarizations']) or '?':<6} {props['sat:orbit_state'] or '?':<10} "
+                      f"{item['assets']['data']['href']}")
+
+
+if __name__ == "__main__":
+    main()
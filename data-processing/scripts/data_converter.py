@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Data Converter for NASA SAR App
-Converts TIFF rasters to CSV format and extracts pixel values with coordinates
+Converts TIFF rasters to pixel tables (CSV, Parquet, Feather or NPZ) with coordinates
 """
 
 import rasterio
@@ -11,81 +11,148 @@ import geopandas as gpd
 from pathlib import Path
 import argparse
 import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
 import warnings
+from table_io import TableWriter, EXTENSIONS, FORMATS, PARQUET_ROW_GROUP_SIZE, write_table
+from manifest import ConversionManifest, MANIFEST_NAME
+from topojson_export import TopoJSONExporter, DEFAULT_ZOOMS
+from raster_cache import RasterCache
+from reprojection import PixelProjector, reproject_geometries
+from mosaic import OVERLAP_METHODS, VirtualMosaic, as_raster_source, open_raster
+from catalog import add_query_arguments, find_scenes
 warnings.filterwarnings('ignore')
 
+# Rough peak bytes per pixel of tiff_to_csv beyond the band data itself:
+# row/col and lon/lat arrays plus DataFrame copies
+IN_MEMORY_BYTES_PER_PIXEL = 96
+STREAMING_OVERHEAD_BYTES = 64 * 1024 * 1024
+MB = 1024 * 1024
+
+
+def available_memory():
+    """Bytes of memory currently available, or None if it cannot be determined"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_conversion_memory(tiff_path, streaming=False):
+    """Estimate peak memory (bytes) of converting one raster (0 if unreadable)"""
+    try:
+        src = rasterio.open(tiff_path)
+    except rasterio.errors.RasterioIOError:
+        # Let the conversion itself fail and report the error for this file
+        return 0
+    with src:
+        band_bytes = sum(np.dtype(dtype).itemsize for dtype in src.dtypes)
+        if streaming:
+            block_height, block_width = src.block_shapes[0]
+            return block_height * block_width * (band_bytes + IN_MEMORY_BYTES_PER_PIXEL) + STREAMING_OVERHEAD_BYTES
+        return src.width * src.height * (band_bytes + IN_MEMORY_BYTES_PER_PIXEL)
+
+
+def _convert_in_worker(input_dir, output_dir, output_format, cache_dir, tiff_file, sample_rate, streaming):
+    """Process-pool entry point: convert one file with a fresh converter"""
+    cache = RasterCache(cache_dir) if cache_dir else None
+    converter = DataConverter(input_dir, output_dir, output_format, cache)
+    return converter.convert_file(tiff_file, sample_rate, streaming)
+
+
 class DataConverter:
-    def __init__(self, input_dir="data", output_dir="output"):
+    def __init__(self, input_dir="data", output_dir="output", output_format="csv", cache=None):
+        """
+        Args:
+            input_dir: Directory with input rasters/shapefiles
+            output_dir: Directory for converted outputs
+            output_format: Pixel table format: csv, parquet, feather or npz
+            cache: Optional RasterCache; bands are then decoded once and read as memmaps
+        """
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown output format: {output_format} (choose from {', '.join(FORMATS)})")
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
+        self.output_format = output_format
+        self.cache = cache
+
+    def table_path(self, stem):
+        """Output path for a pixel table in the configured format"""
+        return self.output_dir / f"{stem}{EXTENSIONS[self.output_format]}"
         
     def tiff_to_csv(self, tiff_path, output_csv=None, sample_rate=1.0):
         """
-        Convert TIFF raster to CSV format with pixel values and coordinates
+        Convert TIFF raster to a pixel table with values and coordinates
+
+        Written as CSV or, with a columnar output_format, as a compressed
+        float32/int32 Parquet, Feather or NPZ table. Coordinates are pixel
+        centers in EPSG:4326, interpolated from a coarse grid of exactly
+        reprojected nodes when the raster is in a projected CRS.
         
         Args:
-            tiff_path: Path to input TIFF file
-            output_csv: Output CSV path (optional)
+            tiff_path: Path to input TIFF file, list of scene paths or
+                VirtualMosaic (several scenes are read as one mosaic)
+            output_csv: Output table path (optional)
             sample_rate: Fraction of pixels to sample (0.1 = 10% of pixels)
         """
-        tiff_path = Path(tiff_path)
-        if not tiff_path.exists():
+        tiff_path = as_raster_source(tiff_path, self.cache)
+        if not isinstance(tiff_path, VirtualMosaic) and not tiff_path.exists():
             raise FileNotFoundError(f"TIFF file not found: {tiff_path}")
         
-        print(f"🔄 Converting {tiff_path.name} to CSV...")
+        print(f"🔄 Converting {tiff_path.name} to {self.output_format.upper()}...")
         
-        with rasterio.open(tiff_path) as src:
+        with open_raster(tiff_path, self.cache) as src:
             # Get raster metadata
             transform = src.transform
             crs = src.crs
             bands = src.count
             
             print(f"   📊 Raster info: {src.width}x{src.height}, {bands} bands, CRS: {crs}")
+            if crs is None:
+                print("   ⚠️  Raster has no CRS; coordinates are written in pixel space units")
             
-            # Read all bands
-            data = src.read()
-            
-            # Create coordinate arrays
-            rows, cols = np.meshgrid(
-                np.arange(src.height), 
-                np.arange(src.width), 
-                indexing='ij'
-            )
-            
-            # Convert pixel coordinates to geographic coordinates
-            x_coords, y_coords = rasterio.transform.xy(transform, rows, cols)
+            # Read all bands (memmapped from the working cache if configured)
+            if self.cache is not None and not isinstance(tiff_path, VirtualMosaic):
+                data = self.cache.read_all(tiff_path)
+            else:
+                data = src.read()
             
             # Sample data if sample_rate < 1.0
+            total_pixels = src.width * src.height
             if sample_rate < 1.0:
-                total_pixels = src.width * src.height
                 sample_size = int(total_pixels * sample_rate)
                 indices = np.random.choice(total_pixels, sample_size, replace=False)
                 
-                # Flatten arrays and sample
-                flat_rows = rows.flatten()[indices]
-                flat_cols = cols.flatten()[indices]
-                flat_x = np.array(x_coords).flatten()[indices]
-                flat_y = np.array(y_coords).flatten()[indices]
-                
                 # Sample band data
                 sampled_data = {}
                 for band_idx in range(bands):
-                    band_data = data[band_idx].flatten()[indices]
+                    band_data = data[band_idx].ravel()[indices]
                     sampled_data[f'band_{band_idx + 1}'] = band_data
             else:
                 # Use all pixels
-                flat_rows = rows.flatten()
-                flat_cols = cols.flatten()
-                flat_x = np.array(x_coords).flatten()
-                flat_y = np.array(y_coords).flatten()
+                indices = np.arange(total_pixels)
                 
                 sampled_data = {}
                 for band_idx in range(bands):
-                    band_data = data[band_idx].flatten()
+                    band_data = data[band_idx].ravel()
                     sampled_data[f'band_{band_idx + 1}'] = band_data
             
+            # Pixel indices of the selected pixels and their lon/lat
+            flat_rows, flat_cols = np.divmod(indices, src.width)
+            projector = PixelProjector(transform, crs, src.height, src.width)
+            flat_x, flat_y = projector.lonlat(flat_rows, flat_cols)
+            
             # Create DataFrame
             df_data = {
                 'row': flat_rows,
@@ -97,24 +164,131 @@ class DataConverter:
             
             df = pd.DataFrame(df_data)
             
-            # Remove NoData values
-            df = df.replace(src.nodata, np.nan)
+            # Remove NoData values (band columns only; row/col may equal nodata)
+            band_columns = list(sampled_data)
+            if src.nodata is not None:
+                df[band_columns] = df[band_columns].replace(src.nodata, np.nan)
             df = df.dropna()
             
             # Generate output filename if not provided
             if output_csv is None:
-                output_csv = self.output_dir / f"{tiff_path.stem}_pixels.csv"
+                output_csv = self.table_path(f"{tiff_path.stem}_pixels")
             else:
                 output_csv = Path(output_csv)
             
-            # Save to CSV
-            df.to_csv(output_csv, index=False)
+            # Save pixel table
+            write_table(df, output_csv, self.output_format)
             
             print(f"   ✅ Saved {len(df)} pixels to {output_csv}")
             print(f"   📈 Data shape: {df.shape}")
             
             return df, output_csv
     
+    def stream_tiff_to_csv(self, tiff_path, output_csv=None, sample_rate=1.0, seed=None):
+        """
+        Convert TIFF raster to a pixel table one native block window at a time
+
+        Peak memory is bounded by a single block plus one flush of
+        PARQUET_ROW_GROUP_SIZE kept pixels regardless of scene size, so
+        full-resolution Sentinel-1 GRD scenes can be converted. Kept pixels
+        are accumulated across blocks, so small native blocks (e.g. 1-row
+        strips) still become a few large table chunks. Coordinates are
+        EPSG:4326 pixel centers, computed per window like tiff_to_csv. Sampling
+        is Bernoulli per pixel, so the number of sampled pixels is
+        approximately, not exactly, sample_rate.
+
+        Args:
+            tiff_path: Path to input TIFF file, list of scene paths or
+                VirtualMosaic (read window by window across scenes)
+            output_csv: Output table path (optional)
+            sample_rate: Fraction of pixels to sample (0.1 = 10% of pixels)
+            seed: Random seed for reproducible sampling
+
+        Returns:
+            (summary dict with pixel_count, bands and blocks, output CSV path)
+        """
+        tiff_path = as_raster_source(tiff_path, self.cache)
+        if not isinstance(tiff_path, VirtualMosaic) and not tiff_path.exists():
+            raise FileNotFoundError(f"TIFF file not found: {tiff_path}")
+
+        print(f"🔄 Streaming {tiff_path.name} to {self.output_format.upper()}...")
+
+        if output_csv is None:
+            output_csv = self.table_path(f"{tiff_path.stem}_pixels")
+        else:
+            output_csv = Path(output_csv)
+
+        rng = np.random.default_rng(seed)
+        pixel_count = 0
+        blocks = 0
+
+        with open_raster(tiff_path, self.cache) as src:
+            projector = PixelProjector(src.transform, src.crs, src.height, src.width)
+            bands = src.count
+            nodata = src.nodata
+            band_columns = [f'band_{band_idx + 1}' for band_idx in range(bands)]
+
+            print(f"   📊 Raster info: {src.width}x{src.height}, {bands} bands, CRS: {src.crs}")
+
+            with TableWriter(output_csv, self.output_format) as out:
+                # Empty first chunk fixes the header/schema even if no pixel survives
+                out.write(pd.DataFrame({
+                    'row': np.empty(0, dtype=np.int64),
+                    'col': np.empty(0, dtype=np.int64),
+                    'longitude': np.empty(0, dtype=np.float64),
+                    'latitude': np.empty(0, dtype=np.float64),
+                    **{name: np.empty(0, dtype=src.dtypes[band_idx]) for band_idx, name in enumerate(band_columns)}
+                }))
+
+                # Kept pixels of the blocks read since the last flush
+                pending = {name: [] for name in ['row', 'col', 'longitude', 'latitude'] + band_columns}
+                pending_rows = 0
+
+                def flush():
+                    out.write(pd.DataFrame({name: np.concatenate(parts) for name, parts in pending.items()}))
+                    for parts in pending.values():
+                        parts.clear()
+
+                for _, window in tqdm(list(src.block_windows(1)), desc="Blocks", leave=False):
+                    data = src.read(window=window)
+                    blocks += 1
+
+                    # Drop pixels where any band is NoData/NaN, same as the in-memory path
+                    if np.issubdtype(data.dtype, np.floating):
+                        keep = ~np.isnan(data).any(axis=0)
+                    else:
+                        keep = np.ones(data.shape[1:], dtype=bool)
+                    if nodata is not None:
+                        keep &= ~(data == nodata).any(axis=0)
+                    if sample_rate < 1.0:
+                        keep &= rng.random(keep.shape) < sample_rate
+
+                    local_rows, local_cols = np.nonzero(keep)
+                    if local_rows.size == 0:
+                        continue
+
+                    rows = local_rows + window.row_off
+                    cols = local_cols + window.col_off
+                    longitude, latitude = projector.lonlat(rows, cols)
+                    for name, values in (('row', rows), ('col', cols), ('longitude', longitude),
+                                         ('latitude', latitude)):
+                        pending[name].append(values)
+                    for band_idx, name in enumerate(band_columns):
+                        pending[name].append(data[band_idx][keep])
+                    pending_rows += rows.size
+                    pixel_count += rows.size
+                    if pending_rows >= PARQUET_ROW_GROUP_SIZE:
+                        flush()
+                        pending_rows = 0
+
+                if pending_rows:
+                    flush()
+
+        print(f"   ✅ Streamed {pixel_count} pixels from {blocks} blocks to {output_csv}")
+
+        summary = {'pixel_count': pixel_count, 'bands': bands, 'blocks': blocks}
+        return summary, output_csv
+
     def shapefile_to_geojson(self, shapefile_path, output_geojson=None):
         """
         Convert shapefile to GeoJSON format for Flutter compatibility
@@ -137,7 +311,7 @@ class DataConverter:
         # Convert to WGS84 if needed
         if gdf.crs != 'EPSG:4326':
             print(f"   🔄 Converting CRS from {gdf.crs} to EPSG:4326")
-            gdf = gdf.to_crs('EPSG:4326')
+            gdf = reproject_geometries(gdf, 'EPSG:4326')
         
         # Generate output filename if not provided
         if output_geojson is None:
@@ -151,65 +325,273 @@ class DataConverter:
         print(f"   ✅ Saved {len(gdf)} features to {output_geojson}")
         
         return gdf, output_geojson
+
+    def shapefile_to_topojson(self, shapefile_path, output_dir=None, zooms=DEFAULT_ZOOMS):
+        """
+        Convert shapefile to multi-resolution, quantized TopoJSON for the mobile map
+
+        Writes one `<name>_z<zoom>.topojson` per zoom tier plus
+        `<name>_topojson_manifest.json` mapping zoom ranges to files.
+
+        Args:
+            shapefile_path: Path to input shapefile
+            output_dir: Output directory (optional, default: output_dir/topojson)
+            zooms: Zoom levels at which a new, more detailed tier starts
+        """
+        shapefile_path = Path(shapefile_path)
+        if not shapefile_path.exists():
+            raise FileNotFoundError(f"Shapefile not found: {shapefile_path}")
+        
+        print(f"🔄 Converting {shapefile_path.name} to TopoJSON tiers {list(zooms)}...")
+        
+        gdf = gpd.read_file(shapefile_path)
+        
+        print(f"   📊 Shapefile info: {len(gdf)} features, CRS: {gdf.crs}")
+        
+        if gdf.crs != 'EPSG:4326':
+            print(f"   🔄 Converting CRS from {gdf.crs} to EPSG:4326")
+            gdf = reproject_geometries(gdf, 'EPSG:4326')
+        
+        output_dir = Path(output_dir) if output_dir else self.output_dir / "topojson"
+        manifest, manifest_path = TopoJSONExporter(zooms).export(gdf, output_dir, shapefile_path.stem)
+        
+        print(f"   ✅ Saved {len(manifest['tiers'])} TopoJSON tiers, manifest: {manifest_path}")
+        
+        return manifest, manifest_path
     
-    def batch_convert_tiffs(self, pattern="*.tif", sample_rate=0.1):
-        """Convert multiple TIFF files to CSV"""
-        tiff_files = list(self.input_dir.glob(pattern))
+    def convert_file(self, tiff_file, sample_rate=0.1, streaming=False):
+        """
+        Convert one TIFF and return its conversion summary entry
+
+        Returns:
+            Dict with input/output files, pixel count, bands, timing and
+            throughput, or with an 'error' message if the conversion failed
+        """
+        start = time.perf_counter()
+        input_mb = os.path.getsize(tiff_file) / MB
+        try:
+            if streaming:
+                summary, output_path = self.stream_tiff_to_csv(tiff_file, sample_rate=sample_rate)
+                pixel_count, bands = summary['pixel_count'], summary['bands']
+            else:
+                df, output_path = self.tiff_to_csv(tiff_file, sample_rate=sample_rate)
+                pixel_count = len(df)
+                bands = len([col for col in df.columns if col.startswith('band_')])
+        except Exception as e:
+            print(f"❌ Error converting {tiff_file}: {e}")
+            return {
+                'input_file': str(tiff_file),
+                'error': str(e),
+                'seconds': round(time.perf_counter() - start, 3)
+            }
+
+        seconds = time.perf_counter() - start
+        return {
+            'input_file': str(tiff_file),
+            'output_file': str(output_path),
+            'pixel_count': pixel_count,
+            'bands': bands,
+            'input_mb': round(input_mb, 3),
+            'seconds': round(seconds, 3),
+            'pixels_per_second': round(pixel_count / seconds, 1) if seconds > 0 else None,
+            'mb_per_second': round(input_mb / seconds, 3) if seconds > 0 else None
+        }
+
+    def batch_convert_tiffs(self, pattern="*.tif", sample_rate=0.1, streaming=False,
+                            workers=1, memory_budget_mb=None, incremental=True):
+        """
+        Convert multiple TIFF files to pixel tables (block-windowed if streaming)
+
+        With workers > 1 files are converted in a process pool. A file is only
+        started when its estimated peak memory fits in the budget next to the
+        files already running, so several large scenes are never converted at
+        the same time. A file larger than the whole budget runs on its own.
+
+        Incremental runs keep a manifest (output_dir/conversion_manifest.json)
+        of input sizes, mtimes, hashes, parameters and outputs: unchanged files
+        are skipped and outputs of deleted inputs are removed.
+
+        Args:
+            pattern: Glob pattern in input_dir, or a list of raster paths
+                (e.g. the result of a scene catalog query)
+            sample_rate: Fraction of pixels to sample
+            streaming: Use block-windowed conversion
+            workers: Number of worker processes (0 = one per CPU)
+            memory_budget_mb: Memory budget for concurrent conversions
+                (default: 75% of currently available memory)
+            incremental: Skip inputs that are unchanged since the last run
+        """
+        manifest = ConversionManifest(self.output_dir / MANIFEST_NAME) if incremental else None
+        if manifest is not None:
+            removed = manifest.collect_garbage()
+            if removed:
+                print(f"🗑️  Removed outputs of {len(removed)} deleted inputs")
+
+        if isinstance(pattern, (list, tuple)):
+            tiff_files = sorted(Path(p) for p in pattern)
+        else:
+            tiff_files = sorted(self.input_dir.glob(pattern))
         
         if not tiff_files:
             print(f"❌ No TIFF files found matching pattern: {pattern}")
+            if manifest is not None:
+                manifest.save()
             return
         
-        print(f"🔄 Converting {len(tiff_files)} TIFF files...")
-        
+        # Parameters that change the outputs; the glob pattern only selects inputs
+        params = {'sample_rate': sample_rate, 'output_format': self.output_format, 'streaming': streaming}
         results = []
-        for tiff_file in tqdm(tiff_files, desc="Converting TIFFs"):
-            try:
-                df, output_path = self.tiff_to_csv(tiff_file, sample_rate=sample_rate)
-                results.append({
-                    'input_file': str(tiff_file),
-                    'output_file': str(output_path),
-                    'pixel_count': len(df),
-                    'bands': len([col for col in df.columns if col.startswith('band_')])
-                })
-            except Exception as e:
-                print(f"❌ Error converting {tiff_file}: {e}")
+        to_convert = tiff_files
+        if manifest is not None:
+            to_convert = [f for f in tiff_files if manifest.needs_update(f, params)]
+            pending = set(to_convert)
+            for tiff_file in tiff_files:
+                if tiff_file not in pending:
+                    results.append(dict(manifest.result(tiff_file), status='up_to_date'))
+            if results:
+                print(f"⏭️  Skipping {len(results)} unchanged files")
+
+        started = time.perf_counter()
+        if to_convert:
+            workers = min(workers or os.cpu_count() or 1, len(to_convert))
+            print(f"🔄 Converting {len(to_convert)} TIFF files with {workers} worker(s)...")
+
+            if workers == 1:
+                converted = [
+                    self.convert_file(tiff_file, sample_rate, streaming)
+                    for tiff_file in tqdm(to_convert, desc="Converting TIFFs")
+                ]
+            else:
+                converted = self._convert_parallel(to_convert, sample_rate, streaming, workers, memory_budget_mb)
+
+            for result in converted:
+                if manifest is not None and 'error' not in result:
+                    manifest.record(result['input_file'], params, [result['output_file']], result)
+                results.append(dict(result, status='error' if 'error' in result else 'converted'))
+        elapsed = time.perf_counter() - started
+
+        if manifest is not None:
+            manifest.save()
+
+        # Deterministic order regardless of completion order
+        results.sort(key=lambda r: r['input_file'])
         
         # Save conversion summary
         summary_path = self.output_dir / "conversion_summary.json"
         with open(summary_path, 'w') as f:
             json.dump(results, f, indent=2)
         
+        counts = {status: sum(1 for r in results if r['status'] == status)
+                  for status in ('converted', 'up_to_date', 'error')}
+        total_mb = sum(r.get('input_mb', 0) for r in results if r['status'] == 'converted')
+        print(f"   ⏱️  {counts['converted']} converted, {counts['up_to_date']} up to date, "
+              f"{counts['error']} failed in {elapsed:.1f}s "
+              f"({total_mb / elapsed if elapsed > 0 else 0:.1f} MB/s)")
         print(f"✅ Conversion complete! Summary saved to {summary_path}")
         return results
 
+    def _convert_parallel(self, tiff_files, sample_rate, streaming, workers, memory_budget_mb):
+        """Run conversions in a process pool with memory-aware admission"""
+        if memory_budget_mb is not None:
+            budget = memory_budget_mb * MB
+        else:
+            available = available_memory()
+            budget = int(available * 0.75) if available else None
+        if budget:
+            print(f"   🧠 Memory budget: {budget / MB:.0f} MB")
+
+        estimates = {f: estimate_conversion_memory(f, streaming) for f in tiff_files}
+        # Largest first: big scenes start early and small ones fill in around them
+        queue = deque(sorted(tiff_files, key=lambda f: (-estimates[f], str(f))))
+        running = {}
+        in_use = 0
+        results = []
+
+        with ProcessPoolExecutor(max_workers=workers) as pool, \
+                tqdm(total=len(tiff_files), desc="Converting TIFFs") as progress:
+            while queue or running:
+                while queue and len(running) < workers:
+                    tiff_file = queue[0]
+                    need = estimates[tiff_file]
+                    if running and budget and in_use + need > budget:
+                        break
+                    if budget and need > budget:
+                        print(f"   ⚠️  {tiff_file.name} needs ~{need / MB:.0f} MB, over budget; "
+                              f"running it alone (consider --streaming)")
+                    queue.popleft()
+                    future = pool.submit(
+                        _convert_in_worker, self.input_dir, self.output_dir, self.output_format,
+                        self.cache.cache_dir if self.cache is not None else None,
+                        tiff_file, sample_rate, streaming
+                    )
+                    running[future] = (tiff_file, need)
+                    in_use += need
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tiff_file, need = running.pop(future)
+                    in_use -= need
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        # Worker died (e.g. killed for memory); isolate to this file
+                        print(f"❌ Error converting {tiff_file}: {e}")
+                        results.append({'input_file': str(tiff_file), 'error': str(e)})
+                    progress.update(1)
+
+        return results
+
 def main():
     parser = argparse.ArgumentParser(description="Convert SAR data formats for NASA SAR App")
     parser.add_argument("--input-dir", default="data", help="Input directory")
     parser.add_argument("--output-dir", default="output", help="Output directory")
-    parser.add_argument("--tiff", help="Convert specific TIFF file to CSV")
+    parser.add_argument("--tiff", nargs="+", help="Convert specific TIFF file to a pixel table (several files are read as one mosaic)")
+    parser.add_argument("--overlap", default="first", choices=OVERLAP_METHODS, help="How overlapping scenes of a mosaic are resolved")
     parser.add_argument("--shapefile", help="Convert specific shapefile to GeoJSON")
+    parser.add_argument("--topojson", action="store_true", help="Write the shapefile as simplified, quantized TopoJSON tiers instead")
+    parser.add_argument("--zooms", type=int, nargs="+", default=list(DEFAULT_ZOOMS), help="Zoom levels starting each TopoJSON tier")
     parser.add_argument("--batch-tiff", action="store_true", help="Convert all TIFF files in input directory")
     parser.add_argument("--sample-rate", type=float, default=0.1, help="Sampling rate for TIFF conversion (0.1 = 10%)")
     parser.add_argument("--pattern", default="*.tif", help="File pattern for batch conversion")
+    parser.add_argument("--format", default="csv", choices=FORMATS, help="Pixel table format (parquet/feather/npz are float32 and compressed)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for batch conversion (0 = one per CPU)")
+    parser.add_argument("--memory-budget", type=int, help="Memory budget in MB for concurrent conversions (default: 75%% of available)")
+    parser.add_argument("--force", action="store_true", help="Reconvert all files, ignoring the conversion manifest")
+    parser.add_argument("--streaming", action="store_true", help="Convert block by block with bounded memory (for full-size scenes)")
+    add_query_arguments(parser)
     
     args = parser.parse_args()
     
-    converter = DataConverter(args.input_dir, args.output_dir)
+    converter = DataConverter(args.input_dir, args.output_dir, args.format)
+    tiff = as_raster_source(args.tiff, overlap=args.overlap) if args.tiff else None
+    scenes = None if tiff else find_scenes(args, args.input_dir)
     
-    if args.tiff:
-        converter.tiff_to_csv(args.tiff, sample_rate=args.sample_rate)
+    if tiff and args.streaming:
+        converter.stream_tiff_to_csv(tiff, sample_rate=args.sample_rate)
+    elif tiff:
+        converter.tiff_to_csv(tiff, sample_rate=args.sample_rate)
+    elif args.shapefile and args.topojson:
+        converter.shapefile_to_topojson(args.shapefile, zooms=args.zooms)
     elif args.shapefile:
         converter.shapefile_to_geojson(args.shapefile)
-    elif args.batch_tiff:
-        converter.batch_convert_tiffs(args.pattern, args.sample_rate)
+    elif args.batch_tiff or scenes is not None:
+        converter.batch_convert_tiffs(
+            args.pattern if scenes is None else scenes, args.sample_rate, args.streaming, args.workers, args.memory_budget,
+            incremental=not args.force
+        )
     else:
         print("🌍 NASA SAR Data Converter")
         print("=" * 40)
         print("Usage examples:")
         print("  python data_converter.py --tiff data/sar_image.tif")
         print("  python data_converter.py --shapefile data/chesapeake_bay.shp")
+        print("  python data_converter.py --shapefile data/chesapeake_bay.shp --topojson --zooms 4 7 10")
         print("  python data_converter.py --batch-tiff --sample-rate 0.05")
+        print("  python data_converter.py --tiff data/S1A_full_scene.tif --streaming")
+        print("  python data_converter.py --tiff data/S1A_frame1.tif data/S1A_frame2.tif --streaming")
+        print("  python data_converter.py --batch-tiff --format parquet")
+        print("  python data_converter.py --batch-tiff --workers 8 --memory-budget 16000")
+        print("  python data_converter.py --mode IW --polarisation VV VH --orbit ascending --start 2024-01-01 --end 2024-06-30")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Quantized Grid Export for NASA SAR App
+Writes raster layers (SAR, NDVI, NDCI, WQI) for the Flutter app as compact
+quantized grids instead of per-pixel CSV rows.
+
+File layout (little-endian):
+    4 bytes   magic b"SARG"
+    4 bytes   uint32 header length N
+    N bytes   UTF-8 JSON header
+    rest      compressed payload (zstd or deflate)
+
+The payload decompresses to the row-major grid (uint8 or uint16, height x
+width) followed, if header["mask"] is true, by a NoData bitmask packed 8
+pixels per byte, MSB first, 1 = valid. With header["predictor"] == 2 each
+row stores differences to the previous pixel (wrapping modulo 2^bits, like
+the TIFF horizontal predictor); a running sum per row restores it. Values
+decode as
+    value = q * scale + offset
+and pixel (row, col) has its center at
+    lng = c + (col + 0.5) * a + (row + 0.5) * b
+    lat = f + (col + 0.5) * d + (row + 0.5) * e
+with transform = [a, b, c, d, e, f] (GDAL/rasterio affine order).
+"""
+
+import json
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+MAGIC = b"SARG"
+GRID_VERSION = 1
+GRID_EXTENSION = ".sargrid"
+DTYPES = {"uint8": np.uint8, "uint16": np.uint16}
+CODECS = ("zstd", "deflate")
+
+
+def _compress(payload, codec, level):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level or 19).compress(payload)
+    return zlib.compress(payload, level or 9)
+
+
+def _decompress(payload, codec):
+    if codec == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise ImportError("zstandard is required to read zstd grids. Install with: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+def export_grid(data, profile, output_path, layer, dtype="uint16", codec="zstd",
+                value_range=None, level=None, predictor=2):
+    """
+    Quantize a single-band raster and write it as a compressed grid
+
+    Args:
+        data: 2D array of values
+        profile: Rasterio profile of the source (transform, crs, nodata)
+        output_path: Output .sargrid path
+        layer: Layer name stored in the header (e.g. "sar", "ndvi")
+        dtype: "uint8" (256 levels) or "uint16" (65536 levels)
+        codec: "zstd" (falls back to deflate if zstandard is missing) or "deflate"
+        value_range: (min, max) to quantize over, e.g. (-1, 1) for NDVI;
+            default: range of the valid data
+        level: Compression level (default: zstd 19, deflate 9)
+        predictor: 2 = horizontal differencing before compression, 1 = none
+
+    Returns:
+        Header dict (with sizes)
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown grid dtype: {dtype} (choose from {', '.join(DTYPES)})")
+    if codec not in CODECS:
+        raise ValueError(f"Unknown grid codec: {codec} (choose from {', '.join(CODECS)})")
+    if codec == "zstd" and not ZSTD_AVAILABLE:
+        print("   ⚠️  zstandard not installed, using deflate. Install with: pip install zstandard")
+        codec = "deflate"
+
+    data = np.asarray(data, dtype=np.float64)
+    valid = np.isfinite(data)
+    nodata = profile.get('nodata')
+    if nodata is not None and not np.isnan(nodata):
+        valid &= data != nodata
+
+    if value_range is None:
+        value_range = (float(data[valid].min()), float(data[valid].max())) if valid.any() else (0.0, 0.0)
+    low, high = value_range
+    levels = np.iinfo(DTYPES[dtype]).max
+    scale = (high - low) / levels if high > low else 1.0
+
+    quantized = np.zeros(data.shape, dtype=DTYPES[dtype])
+    quantized[valid] = np.clip(np.round((data[valid] - low) / scale), 0, levels)
+
+    has_mask = not valid.all()
+    stored = quantized
+    if predictor == 2:
+        # Unsigned wraparound keeps differences in the same dtype
+        stored = quantized.copy()
+        stored[:, 1:] = np.diff(quantized, axis=1)
+    payload = stored.astype(stored.dtype.newbyteorder('<'), copy=False).tobytes()
+    if has_mask:
+        payload += np.packbits(valid, axis=None).tobytes()
+
+    transform = profile['transform']
+    header = {
+        'version': GRID_VERSION,
+        'layer': layer,
+        'width': int(data.shape[1]),
+        'height': int(data.shape[0]),
+        'dtype': dtype,
+        'scale': scale,
+        'offset': low,
+        'transform': [float(v) for v in list(transform)[:6]],
+        'crs': profile['crs'].to_string() if profile.get('crs') else None,
+        'mask': has_mask,
+        'predictor': predictor,
+        'codec': codec,
+        'valid_pixels': int(valid.sum()),
+    }
+
+    compressed = _compress(payload, codec, level)
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    output_path = Path(output_path)
+    with open(output_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(compressed)
+
+    header['bytes'] = output_path.stat().st_size
+    return header
+
+
+def read_grid(path):
+    """
+    Decode a grid file (reference implementation of the app-side reader)
+
+    Returns:
+        (float32 array with NaN for NoData, header dict)
+    """
+    with open(path, 'rb') as f:
+        if f.read(4) != MAGIC:
+            raise ValueError(f"Not a SAR grid file: {path}")
+        header_length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        payload = _decompress(f.read(), header['codec'])
+
+    height, width = header['height'], header['width']
+    dtype = np.dtype(DTYPES[header['dtype']]).newbyteorder('<')
+    grid_bytes = height * width * dtype.itemsize
+    quantized = np.frombuffer(payload[:grid_bytes], dtype=dtype).reshape(height, width)
+    if header.get('predictor', 1) == 2:
+        quantized = np.cumsum(quantized, axis=1, dtype=quantized.dtype)
+    values = (quantized * header['scale'] + header['offset']).astype(np.float32)
+    if header['mask']:
+        valid = np.unpackbits(np.frombuffer(payload[grid_bytes:], dtype=np.uint8),
+                              count=height * width).reshape(height, width).astype(bool)
+        values[~valid] = np.nan
+    return values, header
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Index Result Cache for NASA SAR App
+Keeps computed index rasters (NDVI, NDCI, WQI) keyed by the content of the
+input bands, the index parameters and the version of the index code, so a
+rerun over the same inputs links the previous results into place instead of
+recomputing them.
+
+Hits are served by hard link (copy only across file systems), so they cost
+no I/O and no extra disk space. Writers must unlink an output path before
+rewriting it, otherwise the rewrite would go through the link into the
+cached file; IndexCalculator does this for every output it writes.
+
+Layout:
+    <cache_dir>/<key>/result.json   index names, statistics, SAR statistics
+    <cache_dir>/<key>/<name>.tif    cached output rasters
+    <cache_dir>/<key>/<name>.stats.json
+                                    their statistics sidecars (see
+                                    raster_stats.py), linked along
+    <cache_dir>/sources/            content hashes of input rasters
+                                    (see RasterCache.key)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from raster_cache import RasterCache
+from raster_stats import SIDECAR_SUFFIX, sidecar_path
+from mosaic import VirtualMosaic, as_raster_source
+
+# Default size bound; least recently used results are evicted beyond it
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+RESULT_NAME = "result.json"
+
+
+def link_or_copy(src, dst):
+    """Hard link src to dst, replacing dst; copies when linking is not possible"""
+    dst = Path(dst)
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class IndexCache:
+    def __init__(self, cache_dir="output/.index_cache", max_bytes=DEFAULT_MAX_BYTES, raster_cache=None):
+        """
+        Args:
+            cache_dir: Cache directory
+            max_bytes: Size limit (None = unbounded); least recently used
+                results are evicted after every store
+            raster_cache: Optional RasterCache whose content hashes of input
+                rasters are reused (otherwise they are kept under cache_dir)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hasher = raster_cache or RasterCache(self.cache_dir / "sources")
+
+    def source_key(self, source):
+        """Content key of a raster path or mosaic"""
+        source = as_raster_source(source)
+        if isinstance(source, VirtualMosaic):
+            return {
+                'scenes': [self.hasher.key(path) for path in source.paths],
+                'overlap': source.overlap,
+                'res': list(source.res),
+                'nodata': None if source.nodata is None else float(source.nodata),
+                'shape': [source.height, source.width],
+            }
+        return self.hasher.key(source)
+
+    def key(self, sources, parameters):
+        """
+        Cache key of one index computation
+
+        Args:
+            sources: {band: raster path or mosaic}, unused bands None
+            parameters: JSON-serializable parameters that affect the output,
+                including the code version
+        """
+        record = {
+            'sources': {band: self.source_key(source) for band, source in sorted(sources.items())
+                        if source is not None},
+            'parameters': parameters,
+        }
+        return hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key, output_paths):
+        """
+        Link a cached result into place
+
+        Args:
+            key: Cache key
+            output_paths: {index name: output path}; all must be cached
+
+        Returns:
+            The stored result record, or None on a miss
+        """
+        entry = self.cache_dir / key
+        result_path = entry / RESULT_NAME
+        if not result_path.exists():
+            return None
+        with open(result_path, 'r') as f:
+            record = json.load(f)
+        if not set(output_paths) <= set(record['indices']):
+            return None
+        for name, output_path in output_paths.items():
+            link_or_copy(entry / f"{name}.tif", output_path)
+            # Links keep the raster's mtime, so the sidecar stays valid
+            sidecar = entry / f"{name}{SIDECAR_SUFFIX}"
+            if sidecar.exists():
+                link_or_copy(sidecar, sidecar_path(output_path))
+            else:
+                sidecar_path(output_path).unlink(missing_ok=True)
+        # Directory mtime doubles as the LRU timestamp
+        os.utime(entry)
+        return record
+
+    def put(self, key, output_paths, record):
+        """
+        Store computed outputs (linked, not copied) with their result record
+
+        Args:
+            key: Cache key
+            output_paths: {index name: written output path}
+            record: JSON-serializable result details (statistics etc.)
+        """
+        entry = self.cache_dir / key
+        tmp_entry = Path(tempfile.mkdtemp(dir=self.cache_dir, suffix='.tmp'))
+        try:
+            for name, output_path in output_paths.items():
+                link_or_copy(output_path, tmp_entry / f"{name}.tif")
+                if sidecar_path(output_path).exists():
+                    link_or_copy(sidecar_path(output_path), tmp_entry / f"{name}{SIDECAR_SUFFIX}")
+            with open(tmp_entry / RESULT_NAME, 'w') as f:
+                json.dump(dict(record, indices=sorted(output_paths)), f, indent=2)
+            # Atomic publish: readers never see a partial entry
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp_entry, entry)
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.prune()
+
+    def _entries(self):
+        return [p for p in self.cache_dir.iterdir()
+                if p.is_dir() and p.name != "sources" and not p.name.endswith('.tmp')]
+
+    def size(self):
+        return sum(f.stat().st_size for entry in self._entries() for f in entry.glob("*.tif"))
+
+    def prune(self, max_bytes=None):
+        """Evict least recently used results until the cache fits in max_bytes"""
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        if max_bytes is None:
+            return []
+        entries = sorted(self._entries(), key=lambda p: p.stat().st_mtime)
+        total = self.size()
+        evicted = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            total -= sum(f.stat().st_size for f in entry.glob("*.tif"))
+            shutil.rmtree(entry, ignore_errors=True)
+            evicted.append(entry.name)
+        return evicted
@@ -2,6 +2,18 @@
 """
 Index Calculator for NASA SAR App
 Calculates NDVI, NDCI, and Water Quality Index from satellite imagery
+
+In windowed mode (--windowed) rasters are never loaded whole: a first
+streaming pass collects the global SAR statistics the WQI needs (quantiles
+for its robust 2-98 percentile normalization), and a second pass computes
+each index window by window straight into a tiled Cloud-Optimized GeoTIFF,
+so peak memory depends on the window size only. The first pass is skipped
+when the SAR raster already has statistics saved next to it
+(<name>.stats.json, see raster_stats.py).
+
+With workers > 1 windows (or row blocks of in-memory arrays) are processed
+on a thread pool: GDAL decompression and numpy ufuncs release the GIL, so
+reading and computing run on several cores at once.
 """
 
 import rasterio
@@ -11,55 +23,506 @@ import geopandas as gpd
 from pathlib import Path
 import argparse
 import json
+import hashlib
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from rasterio.windows import Window
 from tqdm import tqdm
 import warnings
+from raster_cache import RasterCache
+from index_cache import DEFAULT_MAX_BYTES, IndexCache
+from band_math import INDEX_EXPRESSIONS, compile_expressions
+from cog import COGWriter, DEFAULTS as COG_DEFAULTS, add_cog_arguments, configure_from_args
+from manifest import file_sha256
+from raster_stats import QUANTILES, RasterStatistics, load_statistics, save_statistics
+from mosaic import OVERLAP_METHODS, as_raster_source, describe_source, is_raster_source, open_raster, read_band
+from catalog import add_query_arguments, find_scenes
 warnings.filterwarnings('ignore')
 
+# Side of a processing window in windowed mode; a multiple of the COG tiles
+WINDOW_SIZE = 1024
+# SAR percentiles mapped to 0 and 1 in the WQI; robust to bright outliers such as ships
+SAR_PERCENTILES = (2, 98)
+# Any change to the index, band-math, mosaic or statistics code, or to the
+# raster reading and writing code, invalidates cached results
+CODE_VERSION = hashlib.sha256(''.join(
+    file_sha256(Path(__file__).with_name(name))
+    for name in ('index_calculator.py', 'band_math.py', 'mosaic.py', 'raster_stats.py',
+                 'cog.py', 'raster_cache.py')
+).encode()).hexdigest()[:16]
+
+
+def raster_windows(width, height, size=WINDOW_SIZE):
+    """Square windows of `size` pixels covering a raster, row by row"""
+    for row_off in range(0, height, size):
+        for col_off in range(0, width, size):
+            yield Window(col_off, row_off, min(size, width - col_off), min(size, height - row_off))
+
+
+def create_output(path, profile):
+    """
+    Open an output raster for writing, published as a Cloud-Optimized GeoTIFF on close
+
+    The file is replaced by a rename, so a file hard-linked from the result
+    cache is never overwritten in place.
+    """
+    return COGWriter(path, profile)
+
+
+def map_windows(sources, windows, process, cache=None, workers=1):
+    """
+    Apply process(readers, window, local) to every window, yielding the results in window order
+
+    With workers > 1 the windows run on a thread pool. Dataset handles are
+    not thread-safe, so every thread opens its own readers of `sources` and
+    gets its own `local` dict (e.g. for scratch buffers); process must lock
+    any shared writer. At most 2 × workers windows are in flight, so results
+    held for ordering stay bounded.
+
+    Args:
+        sources: {key: raster path or mosaic}; readers has the same keys
+        windows: Windows (or any work items) to process
+        process: Function of (readers, window, local)
+        cache: Optional RasterCache for mosaic sources
+        workers: Number of threads (0 = one per CPU)
+    """
+    sources = {key: as_raster_source(source, cache) for key, source in sources.items()}
+    workers = workers or os.cpu_count() or 1
+    thread_state = threading.local()
+    opened, lock = [], threading.Lock()
+
+    def run(window):
+        if not hasattr(thread_state, 'readers'):
+            thread_state.readers = {key: open_raster(source, cache) for key, source in sources.items()}
+            thread_state.local = {}
+            with lock:
+                opened.extend(thread_state.readers.values())
+        return process(thread_state.readers, window, thread_state.local)
+
+    try:
+        if workers == 1:
+            for window in windows:
+                yield run(window)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="index-window") as pool:
+            pending = deque()
+            try:
+                for window in windows:
+                    pending.append(pool.submit(run, window))
+                    if len(pending) >= 2 * workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        for reader in opened:
+            reader.close()
+
+
+def scan_statistics(source, band=1, cache=None, window_size=WINDOW_SIZE, quantiles=QUANTILES, workers=1):
+    """
+    Global statistics of one band of a raster, without a read if it has a
+    statistics sidecar; otherwise from a streaming pass
+
+    Windows are read on `workers` threads and accumulated in raster order,
+    so the result does not depend on the number of workers. The statistics
+    of a single-band raster file are saved next to it for later runs.
+
+    Returns:
+        Dict with min, max, mean, std, count and quantiles (see RasterStatistics.summary)
+    """
+    source = as_raster_source(source, cache)
+    if isinstance(source, Path):
+        statistics = load_statistics(source, band)
+        if statistics is not None:
+            return statistics.summary(quantiles)
+
+    with open_raster(source, cache) as src:
+        statistics = RasterStatistics(src.nodata)
+        windows = list(raster_windows(src.width, src.height, window_size))
+        single_band = src.count == 1
+
+    def read(readers, window, local):
+        return readers['source'].read(band, window=window)
+
+    for block in map_windows({'source': source}, windows, read, cache, workers):
+        statistics.update(block)
+    if isinstance(source, Path) and single_band:
+        try:
+            save_statistics(source, [statistics])
+        except OSError:
+            pass  # read-only input directory
+    return statistics.summary(quantiles)
+
+
+def row_blocks(height, width, window_size=WINDOW_SIZE):
+    """Row slices of an in-memory array holding about window_size² pixels each"""
+    rows = max(1, window_size * window_size // max(width, 1))
+    for start in range(0, height, rows):
+        yield slice(start, min(start + rows, height))
+
+
+def array_statistics(values, nodata=None, quantiles=QUANTILES):
+    """Same statistics as scan_statistics for an in-memory band"""
+    return RasterStatistics.from_array(values, nodata=nodata).summary(quantiles)
+
+
 class IndexCalculator:
-    def __init__(self, input_dir="data", output_dir="output"):
+    def __init__(self, input_dir="data", output_dir="output", cache=None, windowed=False,
+                 window_size=WINDOW_SIZE, sar_percentiles=SAR_PERCENTILES, workers=1, result_cache=None):
+        """
+        Args:
+            input_dir: Directory with input rasters
+            output_dir: Directory for index rasters
+            cache: Optional RasterCache; bands are then decoded once and
+                shared as memmaps across calls and pipeline steps
+            windowed: Compute indices window by window with bounded memory
+                (raster inputs only; outputs always go to a GeoTIFF)
+            window_size: Window side in pixels for windowed mode
+            sar_percentiles: (low, high) percentiles between which SAR is
+                normalized (and clipped) for the WQI; None normalizes over
+                the raw min/max, which single bright pixels can dominate
+            workers: Threads computing windows (windowed mode) or row blocks
+                (fused in-memory pass) concurrently; 0 = one per CPU
+            result_cache: Optional IndexCache; calculate_all_indices then
+                links previous results for the same inputs and parameters
+                into place instead of recomputing them
+        """
         self.input_dir = Path(input_dir)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
+        self.cache = cache
+        self.windowed = windowed
+        self.window_size = window_size
+        self.sar_percentiles = tuple(sar_percentiles) if sar_percentiles else None
+        self.workers = workers or os.cpu_count() or 1
+        self.result_cache = result_cache
+        self.sar_statistics = None
+
+    def _read_band(self, path, band=1):
+        """Read one band and the raster profile of a raster or mosaic, through the cache if configured"""
+        return read_band(path, band, self.cache)
+
+    def _use_windows(self, *inputs):
+        """Windowed mode applies when every given input is a raster on disk"""
+        return self.windowed and all(is_raster_source(x) for x in inputs if x is not None)
+
+    @staticmethod
+    def _normalized_difference(a, b):
+        """(a - b) / (a + b), 0 where a + b == 0, clipped to [-1, 1]"""
+        denominator = a + b
+        return np.clip(np.where(denominator != 0, (a - b) / denominator, 0), -1, 1)
+
+    def _quantiles(self):
+        """Quantiles to collect for SAR: the defaults plus any normalization percentiles"""
+        return sorted(set(QUANTILES) | set(self.sar_percentiles or ()))
+
+    def _sar_range(self, statistics):
+        """
+        (low, high) SAR values mapped to 0 and 1 in the WQI; min/max when the
+        percentile range collapses (most pixels share one value, e.g. a
+        zero-filled border without NoData)
+        """
+        if self.sar_percentiles:
+            low, high = self.sar_percentiles
+            low, high = statistics['quantiles'][f"p{low:g}"], statistics['quantiles'][f"p{high:g}"]
+            if high > low:
+                return low, high
+        return statistics['min'], statistics['max']
+
+    def _water_quality(self, sar_values, low, high, ndvi_values=None, ndci_values=None):
+        """WQI from SAR normalized over [low, high] and optional NDVI/NDCI"""
+        # A constant SAR band (high == low) contributes 0
+        sar_normalized = (sar_values - low) * (1.0 / (high - low) if high > low else 0.0)
+        if self.sar_percentiles:
+            sar_normalized = np.clip(sar_normalized, 0, 1)
+        wqi = sar_normalized
+        if ndvi_values is not None:
+            # NDVI contribution (higher NDVI = better water quality)
+            wqi = 0.6 * wqi + 0.4 * (ndvi_values + 1) / 2
+        if ndci_values is not None:
+            # NDCI contribution (higher NDCI = better water quality)
+            wqi = 0.7 * wqi + 0.3 * (ndci_values + 1) / 2
+        return np.clip(wqi, 0, 1)
+
+    def _stream_index(self, sources, compute, output_path, description):
+        """
+        Compute an index window by window into a tiled float32 GeoTIFF
+
+        Args:
+            sources: Raster paths or mosaics of equal size, read one window at a time
+            compute: Function of the source windows returning the index window
+            output_path: Output GeoTIFF path
+            description: Band description
+
+        Returns:
+            Statistics of the written index (see RasterStatistics.summary)
+        """
+        readers = [open_raster(source, self.cache) for source in sources]
+        try:
+            height, width = readers[0].height, readers[0].width
+            for reader in readers[1:]:
+                if (reader.height, reader.width) != (height, width):
+                    raise ValueError(f"Input rasters differ in size: {width}x{height} vs "
+                                     f"{reader.width}x{reader.height}")
+
+            profile = dict(readers[0].profile)
+            profile.update(dtype=rasterio.float32, count=1, nodata=-9999)
+
+            with create_output(output_path, profile) as dst:
+                write_lock = threading.Lock()
+
+                def process(window_readers, window, local):
+                    values = compute(*[window_readers[i].read(1, window=window) for i in range(len(sources))])
+                    with write_lock:
+                        dst.write(np.asarray(values, dtype=np.float32), 1, window=window)
+
+                windows = list(raster_windows(width, height, self.window_size))
+                results = map_windows(dict(enumerate(sources)), windows, process, self.cache, self.workers)
+                for _ in tqdm(results, total=len(windows), desc=description, leave=False):
+                    pass
+                dst.set_band_description(1, description)
+        finally:
+            for reader in readers:
+                reader.close()
+
+        return dst.statistics[0].summary()
         
+    def _fused_kernel(self, blocks, low, high, out):
+        """
+        NDVI, NDCI and WQI of one block in a single traversal
+
+        Everything is computed in float32 into the preallocated buffers of
+        `out` (ndvi, ndci, wqi, a float scratch and a bool mask, all of the
+        block's shape). Division only runs where the denominator is non-zero,
+        so no temporaries are allocated.
+        """
+        scratch, mask, wqi = out['scratch'], out['mask'], out['wqi']
+        sar = blocks['sar']
+
+        # SAR component: (sar - low) / (high - low)
+        np.subtract(sar, low, out=wqi, dtype=np.float32)
+        np.multiply(wqi, 1.0 / (high - low) if high > low else 0.0, out=wqi)
+        if self.sar_percentiles:
+            np.clip(wqi, 0, 1, out=wqi)
+
+        # (a - b) / (a + b), 0 where a + b == 0, then the WQI contribution
+        # 0.6 * wqi + 0.4 * (ndvi + 1) / 2 == 0.6 * wqi + 0.2 * ndvi + 0.2
+        for name, a, b, keep, weight in (('ndvi', 'nir', 'red', 0.6, 0.2), ('ndci', 'red', 'green', 0.7, 0.15)):
+            if name not in out:
+                continue
+            index = out[name]
+            np.add(blocks[a], blocks[b], out=scratch, dtype=np.float32)
+            np.subtract(blocks[a], blocks[b], out=index, dtype=np.float32)
+            np.not_equal(scratch, 0, out=mask)
+            np.divide(index, scratch, out=index, where=mask)
+            np.logical_not(mask, out=mask)
+            np.copyto(index, 0, where=mask)
+            np.clip(index, -1, 1, out=index)
+
+            np.multiply(wqi, keep, out=wqi)
+            np.multiply(index, weight, out=scratch)
+            np.add(wqi, scratch, out=wqi)
+            np.add(wqi, weight, out=wqi)
+
+        np.clip(wqi, 0, 1, out=wqi)
+
+    def _calculate_fused(self, sources, outputs):
+        """
+        Compute all indices reading every band once
+
+        Args:
+            sources: {'sar': ..., 'red': ..., 'nir': ..., 'green': ...} raster
+                sources (unused bands None)
+            outputs: {index: (profile source band, description, output path)}
+
+        Returns:
+            {index: {'path', 'data', 'statistics'}}; data is the full float32
+            array, or in windowed mode the output path
+        """
+        sources = {band: source for band, source in sources.items() if source is not None}
+        results = {}
+
+        if not self.windowed:
+            # Whole rasters as one block: each band is read exactly once
+            blocks, profiles = {}, {}
+            for band, source in sources.items():
+                blocks[band], profiles[band] = self._read_band(source)
+            shapes = {blocks[band].shape for band in blocks}
+            if len(shapes) > 1:
+                raise ValueError(f"Input rasters differ in size: {sorted(shapes)}")
+            shape = blocks['sar'].shape
+            self.sar_statistics = array_statistics(blocks['sar'], profiles['sar'].get('nodata'), self._quantiles())
+            low, high = self._sar_range(self.sar_statistics)
+
+            # Full-size outputs; scratch buffers (one set per thread) only
+            # span one block of rows, and blocks write disjoint output rows
+            out = {name: np.empty(shape, dtype=np.float32) for name in outputs}
+            chunk = next(row_blocks(*shape, self.window_size))
+            chunk_shape = (chunk.stop - chunk.start, shape[1])
+
+            def process(readers, rows, local):
+                if not local:
+                    local.update(scratch=np.empty(chunk_shape, dtype=np.float32),
+                                 mask=np.empty(chunk_shape, dtype=bool))
+                count = rows.stop - rows.start
+                block_out = {name: out[name][rows] for name in outputs}
+                block_out.update({name: buffer[:count] for name, buffer in local.items()})
+                self._fused_kernel({band: data[rows] for band, data in blocks.items()}, low, high, block_out)
+
+            for _ in map_windows({}, row_blocks(*shape, self.window_size), process, workers=self.workers):
+                pass
+
+            for name, (band, description, output_path) in outputs.items():
+                profile = dict(profiles[band])
+                profile.update(dtype=rasterio.float32, count=1, nodata=-9999)
+                with create_output(output_path, profile) as dst:
+                    dst.write(out[name], 1)
+                    dst.set_band_description(1, description)
+                results[name] = {'path': str(output_path), 'data': out[name],
+                                 'statistics': dst.statistics[0].summary()}
+            return results
+
+        # Pass 1: global SAR statistics
+        self.sar_statistics = scan_statistics(sources['sar'], cache=self.cache, window_size=self.window_size,
+                                              quantiles=self._quantiles(), workers=self.workers)
+        low, high = self._sar_range(self.sar_statistics)
+
+        # Pass 2: one read of every band and one kernel call per window, each
+        # output guarded by its own lock so writes to different files overlap
+        readers = {band: open_raster(source, self.cache) for band, source in sources.items()}
+        writers = {}
+        try:
+            height, width = readers['sar'].height, readers['sar'].width
+            for band, reader in readers.items():
+                if (reader.height, reader.width) != (height, width):
+                    raise ValueError(f"Input rasters differ in size: {width}x{height} vs "
+                                     f"{reader.width}x{reader.height} ({band})")
+
+            for name, (band, description, output_path) in outputs.items():
+                profile = dict(readers[band].profile)
+                profile.update(dtype=rasterio.float32, count=1, nodata=-9999)
+                writers[name] = create_output(output_path, profile)
+                writers[name].set_band_description(1, description)
+                results[name] = {'path': str(output_path), 'data': Path(output_path)}
+
+            size = min(self.window_size, height), min(self.window_size, width)
+            write_locks = {name: threading.Lock() for name in writers}
+
+            def process(window_readers, window, buffers):
+                if not buffers:
+                    buffers.update({name: np.empty(size, dtype=np.float32) for name in outputs})
+                    buffers.update(scratch=np.empty(size, dtype=np.float32), mask=np.empty(size, dtype=bool))
+                blocks = {band: reader.read(1, window=window) for band, reader in window_readers.items()}
+                rows, cols = int(window.height), int(window.width)
+                out = {name: buffer[:rows, :cols] for name, buffer in buffers.items()}
+                self._fused_kernel(blocks, low, high, out)
+                for name, writer in writers.items():
+                    with write_locks[name]:
+                        writer.write(out[name], 1, window=window)
+
+            windows = list(raster_windows(width, height, self.window_size))
+            for _ in tqdm(map_windows(sources, windows, process, self.cache, self.workers),
+                          total=len(windows), desc="Indices", leave=False):
+                pass
+        except BaseException:
+            for writer in writers.values():
+                writer.discard()
+            raise
+        finally:
+            for handle in list(readers.values()) + list(writers.values()):
+                handle.close()
+
+        for name, writer in writers.items():
+            results[name]['statistics'] = writer.statistics[0].summary()
+        return results
+
+    def _calculate_fused_cached(self, sources, outputs):
+        """_calculate_fused through the result cache: a hit links the cached rasters into place"""
+        parameters = {'indices': sorted(outputs), 'sar_percentiles': self.sar_percentiles}
+        if self.sar_percentiles:
+            # The quantile sketch follows the block layout
+            parameters.update(windowed=self.windowed, window_size=self.window_size)
+        output_paths = {name: output_path for name, (_, _, output_path) in outputs.items()}
+        return self._through_cache(sources, parameters, output_paths,
+                                   lambda: self._calculate_fused(sources, outputs), uses_sar_statistics=True)
+
+    def _through_cache(self, sources, parameters, output_paths, compute, uses_sar_statistics=False):
+        """
+        Results of compute() for these inputs and parameters, from the result cache if present
+
+        compute() must write output_paths and return {index: {'path', 'data',
+        'statistics'}}; on a hit the cached rasters are linked into place
+        (and self.sar_statistics restored if compute() sets it).
+        """
+        key = self.result_cache.key(sources, dict(parameters, code=CODE_VERSION, output=dict(COG_DEFAULTS)))
+        record = self.result_cache.get(key, output_paths)
+        if record is None:
+            results = compute()
+            self.result_cache.put(key, output_paths, {
+                'statistics': {name: result['statistics'] for name, result in results.items()},
+                'sar_statistics': self.sar_statistics if uses_sar_statistics else None,
+            })
+            return results
+
+        print(f"   ♻️  Reusing cached indices ({key[:12]})")
+        if uses_sar_statistics:
+            self.sar_statistics = record['sar_statistics']
+        results = {}
+        for name, output_path in output_paths.items():
+            if self.windowed:
+                data = Path(output_path)
+            else:
+                with rasterio.open(output_path) as src:
+                    data = src.read(1)
+            results[name] = {'path': str(output_path), 'data': data, 'statistics': record['statistics'][name]}
+        return results
+
     def calculate_ndvi(self, red_band, nir_band, output_path=None):
         """
         Calculate Normalized Difference Vegetation Index (NDVI)
         NDVI = (NIR - Red) / (NIR + Red)
         
         Args:
-            red_band: Red band data (numpy array or path to TIFF)
-            nir_band: Near-infrared band data (numpy array or path to TIFF)
+            red_band: Red band data (numpy array, path to TIFF or mosaic)
+            nir_band: Near-infrared band data (numpy array, path to TIFF or mosaic)
             output_path: Output path for NDVI raster
+
+        Returns:
+            NDVI array, or in windowed mode the path of the written raster
         """
         print("🌱 Calculating NDVI...")
+
+        if self._use_windows(red_band, nir_band):
+            output_path = Path(output_path or self.output_dir / "ndvi.tif")
+            stats = self._stream_index(
+                [red_band, nir_band], lambda red, nir: self._normalized_difference(nir, red), output_path, 'NDVI'
+            )
+            print(f"   📊 NDVI range: {stats['min']:.3f} to {stats['max']:.3f}")
+            print(f"   📈 Mean NDVI: {stats['mean']:.3f}")
+            print(f"   ✅ NDVI saved to {output_path}")
+            return output_path
         
         # Load data if paths provided
-        if isinstance(red_band, (str, Path)):
-            with rasterio.open(red_band) as src:
-                red_data = src.read(1)
-                profile = src.profile
-                transform = src.transform
-                crs = src.crs
+        if is_raster_source(red_band):
+            red_data, profile = self._read_band(red_band)
         else:
             red_data = red_band
             
-        if isinstance(nir_band, (str, Path)):
-            with rasterio.open(nir_band) as src:
-                nir_data = src.read(1)
-                if isinstance(red_band, (str, Path)):
-                    profile = src.profile
-                    transform = src.transform
-                    crs = src.crs
+        if is_raster_source(nir_band):
+            nir_data, nir_profile = self._read_band(nir_band)
+            if is_raster_source(red_band):
+                profile = nir_profile
         else:
             nir_data = nir_band
         
-        # Calculate NDVI
-        # Avoid division by zero
-        denominator = nir_data + red_data
-        ndvi = np.where(denominator != 0, (nir_data - red_data) / denominator, 0)
-        
-        # Clip values to valid range [-1, 1]
-        ndvi = np.clip(ndvi, -1, 1)
+        # Calculate NDVI, avoiding division by zero and clipped to [-1, 1]
+        ndvi = self._normalized_difference(nir_data, red_data)
         
         print(f"   📊 NDVI range: {ndvi.min():.3f} to {ndvi.max():.3f}")
         print(f"   📈 Mean NDVI: {ndvi.mean():.3f}")
@@ -69,7 +532,7 @@ class IndexCalculator:
             output_path = Path(output_path)
             profile.update(dtype=rasterio.float32, count=1, nodata=-9999)
             
-            with rasterio.open(output_path, 'w', **profile) as dst:
+            with create_output(output_path, profile) as dst:
                 dst.write(ndvi.astype(rasterio.float32), 1)
                 dst.set_band_description(1, 'NDVI')
             
@@ -83,38 +546,40 @@ class IndexCalculator:
         NDCI = (Red - Green) / (Red + Green)
         
         Args:
-            green_band: Green band data (numpy array or path to TIFF)
-            red_band: Red band data (numpy array or path to TIFF)
+            green_band: Green band data (numpy array, path to TIFF or mosaic)
+            red_band: Red band data (numpy array, path to TIFF or mosaic)
             output_path: Output path for NDCI raster
+
+        Returns:
+            NDCI array, or in windowed mode the path of the written raster
         """
         print("🌊 Calculating NDCI (Chlorophyll Index)...")
+
+        if self._use_windows(green_band, red_band):
+            output_path = Path(output_path or self.output_dir / "ndci.tif")
+            stats = self._stream_index(
+                [green_band, red_band], lambda green, red: self._normalized_difference(red, green), output_path, 'NDCI'
+            )
+            print(f"   📊 NDCI range: {stats['min']:.3f} to {stats['max']:.3f}")
+            print(f"   📈 Mean NDCI: {stats['mean']:.3f}")
+            print(f"   ✅ NDCI saved to {output_path}")
+            return output_path
         
         # Load data if paths provided
-        if isinstance(green_band, (str, Path)):
-            with rasterio.open(green_band) as src:
-                green_data = src.read(1)
-                profile = src.profile
-                transform = src.transform
-                crs = src.crs
+        if is_raster_source(green_band):
+            green_data, profile = self._read_band(green_band)
         else:
             green_data = green_band
             
-        if isinstance(red_band, (str, Path)):
-            with rasterio.open(red_band) as src:
-                red_data = src.read(1)
-                if isinstance(green_band, (str, Path)):
-                    profile = src.profile
-                    transform = src.transform
-                    crs = src.crs
+        if is_raster_source(red_band):
+            red_data, red_profile = self._read_band(red_band)
+            if is_raster_source(green_band):
+                profile = red_profile
         else:
             red_data = red_band
         
-        # Calculate NDCI
-        denominator = red_data + green_data
-        ndci = np.where(denominator != 0, (red_data - green_data) / denominator, 0)
-        
-        # Clip values to valid range [-1, 1]
-        ndci = np.clip(ndci, -1, 1)
+        # Calculate NDCI, avoiding division by zero and clipped to [-1, 1]
+        ndci = self._normalized_difference(red_data, green_data)
         
         print(f"   📊 NDCI range: {ndci.min():.3f} to {ndci.max():.3f}")
         print(f"   📈 Mean NDCI: {ndci.mean():.3f}")
@@ -124,7 +589,7 @@ class IndexCalculator:
             output_path = Path(output_path)
             profile.update(dtype=rasterio.float32, count=1, nodata=-9999)
             
-            with rasterio.open(output_path, 'w', **profile) as dst:
+            with create_output(output_path, profile) as dst:
                 dst.write(ndci.astype(rasterio.float32), 1)
                 dst.set_band_description(1, 'NDCI')
             
@@ -136,59 +601,82 @@ class IndexCalculator:
         """
         Calculate Water Quality Index based on SAR backscatter and vegetation indices
         
+        SAR is normalized to 0-1 (and clipped) between the sar_percentiles of
+        its valid (non-NaN, non-NoData) pixels, or over their min/max if
+        sar_percentiles is None.
+
         Args:
-            sar_data: SAR backscatter data (numpy array or path to TIFF)
+            sar_data: SAR backscatter data (numpy array, path to TIFF or mosaic)
             ndvi_data: NDVI data (optional)
             ndci_data: NDCI data (optional)
             output_path: Output path for WQI raster
+
+        Returns:
+            WQI array, or in windowed mode the path of the written raster
         """
         print("💧 Calculating Water Quality Index...")
         
+        if self._use_windows(sar_data, ndvi_data, ndci_data):
+            output_path = Path(output_path or self.output_dir / "water_quality_index.tif")
+
+            # Pass 1: global SAR statistics
+            self.sar_statistics = scan_statistics(sar_data, cache=self.cache, window_size=self.window_size,
+                                                  quantiles=self._quantiles(), workers=self.workers)
+            low, high = self._sar_range(self.sar_statistics)
+            print(f"   📊 SAR range for normalization: {low:.3f} to {high:.3f} "
+                  f"({self.sar_statistics['count']} valid pixels)")
+
+            # Pass 2: WQI window by window
+            sources = [sar_data] + [x for x in (ndvi_data, ndci_data) if x is not None]
+
+            def compute(sar_values, *components):
+                components = list(components)
+                ndvi_values = components.pop(0) if ndvi_data is not None else None
+                ndci_values = components.pop(0) if ndci_data is not None else None
+                return self._water_quality(sar_values, low, high, ndvi_values, ndci_values)
+
+            if ndvi_data is not None:
+                print(f"   📊 Added NDVI component to WQI")
+            if ndci_data is not None:
+                print(f"   📊 Added NDCI component to WQI")
+            stats = self._stream_index(sources, compute, output_path, 'Water Quality Index')
+            print(f"   📊 WQI range: {stats['min']:.3f} to {stats['max']:.3f}")
+            print(f"   📈 Mean WQI: {stats['mean']:.3f}")
+            print(f"   ✅ WQI saved to {output_path}")
+            return output_path
+
         # Load SAR data if path provided
-        if isinstance(sar_data, (str, Path)):
-            with rasterio.open(sar_data) as src:
-                sar_values = src.read(1)
-                profile = src.profile
-                transform = src.transform
-                crs = src.crs
+        nodata = None
+        if is_raster_source(sar_data):
+            sar_values, profile = self._read_band(sar_data)
+            nodata = profile.get('nodata')
         else:
             sar_values = sar_data
         
-        # Normalize SAR values to 0-1 range
-        sar_min, sar_max = sar_values.min(), sar_values.max()
-        sar_normalized = (sar_values - sar_min) / (sar_max - sar_min)
-        
-        # Initialize WQI with SAR component
-        wqi = sar_normalized.copy()
+        # Normalize SAR values to 0-1 range over the valid pixels
+        self.sar_statistics = array_statistics(sar_values, nodata, self._quantiles())
+        low, high = self._sar_range(self.sar_statistics)
         
         # Add NDVI component if available
+        ndvi_values = None
         if ndvi_data is not None:
-            if isinstance(ndvi_data, (str, Path)):
-                with rasterio.open(ndvi_data) as src:
-                    ndvi_values = src.read(1)
+            if is_raster_source(ndvi_data):
+                ndvi_values, _ = self._read_band(ndvi_data)
             else:
                 ndvi_values = ndvi_data
-            
-            # NDVI contribution (higher NDVI = better water quality)
-            ndvi_normalized = (ndvi_values + 1) / 2  # Convert [-1,1] to [0,1]
-            wqi = 0.6 * wqi + 0.4 * ndvi_normalized
             print(f"   📊 Added NDVI component to WQI")
         
         # Add NDCI component if available
+        ndci_values = None
         if ndci_data is not None:
-            if isinstance(ndci_data, (str, Path)):
-                with rasterio.open(ndci_data) as src:
-                    ndci_values = src.read(1)
+            if is_raster_source(ndci_data):
+                ndci_values, _ = self._read_band(ndci_data)
             else:
                 ndci_values = ndci_data
-            
-            # NDCI contribution (higher NDCI = better water quality)
-            ndci_normalized = (ndci_values + 1) / 2  # Convert [-1,1] to [0,1]
-            wqi = 0.7 * wqi + 0.3 * ndci_normalized
             print(f"   📊 Added NDCI component to WQI")
         
         # Ensure WQI is in valid range [0, 1]
-        wqi = np.clip(wqi, 0, 1)
+        wqi = self._water_quality(sar_values, low, high, ndvi_values, ndci_values)
         
         print(f"   📊 WQI range: {wqi.min():.3f} to {wqi.max():.3f}")
         print(f"   📈 Mean WQI: {wqi.mean():.3f}")
@@ -198,7 +686,7 @@ class IndexCalculator:
             output_path = Path(output_path)
             profile.update(dtype=rasterio.float32, count=1, nodata=-9999)
             
-            with rasterio.open(output_path, 'w', **profile) as dst:
+            with create_output(output_path, profile) as dst:
                 dst.write(wqi.astype(rasterio.float32), 1)
                 dst.set_band_description(1, 'Water Quality Index')
             
@@ -209,9 +697,14 @@ class IndexCalculator:
     def calculate_all_indices(self, sar_path, red_path=None, nir_path=None, green_path=None):
         """
         Calculate all indices from available data
+
+        Raster inputs go through a fused kernel: each band is read once and
+        NDVI, NDCI and WQI are computed together in float32, per window in
+        windowed mode (each result's 'data' is then the written raster path
+        instead of an array). Array inputs use the per-index methods.
         
         Args:
-            sar_path: Path to SAR data
+            sar_path: Path to SAR data, list of scene paths or VirtualMosaic
             red_path: Path to red band (optional)
             nir_path: Path to NIR band (optional)
             green_path: Path to green band (optional)
@@ -219,34 +712,63 @@ class IndexCalculator:
         print("🌍 Calculating all indices...")
         
         results = {}
-        
-        # Calculate NDVI if red and NIR bands available
+        outputs = {}
         if red_path and nir_path:
-            ndvi_path = self.output_dir / "ndvi.tif"
-            ndvi = self.calculate_ndvi(red_path, nir_path, ndvi_path)
-            results['ndvi'] = {'path': str(ndvi_path), 'data': ndvi}
-        
-        # Calculate NDCI if green and red bands available
+            outputs['ndvi'] = ('nir', 'NDVI', self.output_dir / "ndvi.tif")
         if green_path and red_path:
-            ndci_path = self.output_dir / "ndci.tif"
-            ndci = self.calculate_ndci(green_path, red_path, ndci_path)
-            results['ndci'] = {'path': str(ndci_path), 'data': ndci}
-        
-        # Calculate WQI
-        wqi_path = self.output_dir / "water_quality_index.tif"
-        wqi = self.calculate_water_quality_index(
-            sar_path, 
-            results.get('ndvi', {}).get('data'),
-            results.get('ndci', {}).get('data'),
-            wqi_path
-        )
-        results['wqi'] = {'path': str(wqi_path), 'data': wqi}
+            outputs['ndci'] = ('red', 'NDCI', self.output_dir / "ndci.tif")
+        outputs['wqi'] = ('sar', 'Water Quality Index', self.output_dir / "water_quality_index.tif")
+        fused = all(is_raster_source(x) for x in (sar_path, red_path, nir_path, green_path) if x is not None)
+
+        if fused:
+            # One read of each band and one float32 traversal for all indices
+            sources = {
+                'sar': sar_path,
+                'red': red_path if outputs.keys() & {'ndvi', 'ndci'} else None,
+                'nir': nir_path if 'ndvi' in outputs else None,
+                'green': green_path if 'ndci' in outputs else None,
+            }
+            print(f"   ⚡ Fused pass over {sum(1 for s in sources.values() if s is not None)} bands: "
+                  f"{', '.join(name.upper() for name in outputs)}")
+            if self.result_cache is not None:
+                results = self._calculate_fused_cached(sources, outputs)
+            else:
+                results = self._calculate_fused(sources, outputs)
+            for name, result in results.items():
+                stats = result['statistics']
+                print(f"   📊 {name.upper()} range: {stats['min']:.3f} to {stats['max']:.3f}, mean {stats['mean']:.3f} "
+                      f"→ {result['path']}")
+        else:
+            # Calculate NDVI if red and NIR bands available
+            if 'ndvi' in outputs:
+                ndvi_path = outputs['ndvi'][2]
+                ndvi = self.calculate_ndvi(red_path, nir_path, ndvi_path)
+                results['ndvi'] = {'path': str(ndvi_path), 'data': ndvi}
+
+            # Calculate NDCI if green and red bands available
+            if 'ndci' in outputs:
+                ndci_path = outputs['ndci'][2]
+                ndci = self.calculate_ndci(green_path, red_path, ndci_path)
+                results['ndci'] = {'path': str(ndci_path), 'data': ndci}
+
+            # Calculate WQI
+            wqi_path = outputs['wqi'][2]
+            wqi = self.calculate_water_quality_index(
+                sar_path,
+                results.get('ndvi', {}).get('data'),
+                results.get('ndci', {}).get('data'),
+                wqi_path
+            )
+            results['wqi'] = {'path': str(wqi_path), 'data': wqi}
         
         # Save summary
         summary = {
-            'sar_file': str(sar_path),
+            'sar_file': describe_source(sar_path),
             'indices_calculated': list(results.keys()),
-            'output_files': {k: v['path'] for k, v in results.items()}
+            'output_files': {k: v['path'] for k, v in results.items()},
+            'windowed': self._use_windows(sar_path, red_path, nir_path, green_path),
+            'fused': fused,
+            'sar_statistics': self.sar_statistics
         }
         
         summary_path = self.output_dir / "indices_summary.json"
@@ -256,36 +778,197 @@ class IndexCalculator:
         print(f"✅ All indices calculated! Summary saved to {summary_path}")
         return results
 
+    def calculate_expressions(self, indices, bands, expressions=None):
+        """
+        Calculate band-math indices (see band_math.py) in one pass over the inputs
+
+        All requested indices are compiled into one graph, so shared terms
+        (e.g. the dB bands of the SAR ratios) are computed once per block.
+
+        Args:
+            indices: Index names from INDEX_EXPRESSIONS or `expressions`
+            bands: {band name: raster path, mosaic or (path, band number)}
+            expressions: Extra {name: expression} definitions
+
+        Returns:
+            {index: {'path', 'data', 'statistics'}}; data is the float32
+            array, or in windowed mode the output path
+        """
+        registry = dict(INDEX_EXPRESSIONS, **(expressions or {}))
+        program = compile_expressions(list(indices), registry)
+        missing = [band for band in program.bands if band not in bands]
+        if missing:
+            raise ValueError(f"Missing input bands for {', '.join(indices)}: {', '.join(missing)}")
+
+        print(f"🧮 Band math: {', '.join(program.outputs)} from {', '.join(program.bands)} "
+              f"({len(program.nodes)} shared nodes)")
+        band_numbers = {band: 1 for band in program.bands}
+        sources = {}
+        for band in program.bands:
+            source = bands[band]
+            if isinstance(source, tuple):
+                source, band_numbers[band] = source
+            sources[band] = source
+        output_paths = {name: self.output_dir / f"{name}.tif" for name in program.outputs}
+
+        def compute():
+            return self._calculate_program(program, sources, band_numbers, output_paths)
+
+        if self.result_cache is not None:
+            # The compiled graph covers every sub-index an expression refers to
+            parameters = {'graph': program.nodes, 'outputs': program.outputs, 'band_numbers': band_numbers}
+            results = self._through_cache(sources, parameters, output_paths, compute)
+        else:
+            results = compute()
+        for name, result in results.items():
+            stats = result['statistics']
+            if stats['mean'] is None:
+                print(f"   ⚠️  {name}: no valid pixels → {result['path']}")
+            else:
+                print(f"   📊 {name} range: {stats['min']:.3f} to {stats['max']:.3f}, mean {stats['mean']:.3f} "
+                      f"→ {result['path']}")
+        return results
+
+    def _calculate_program(self, program, sources, band_numbers, output_paths):
+        """Evaluate a compiled band-math program blockwise and write one raster per output"""
+        readers = {band: open_raster(source, self.cache) for band, source in sources.items()}
+        try:
+            first = readers[program.bands[0]]
+            height, width, profile = first.height, first.width, dict(first.profile)
+            for band, reader in readers.items():
+                if (reader.height, reader.width) != (height, width):
+                    raise ValueError(f"Input rasters differ in size: {width}x{height} vs "
+                                     f"{reader.width}x{reader.height} ({band})")
+        finally:
+            for reader in readers.values():
+                reader.close()
+
+        profile.update(dtype=rasterio.float32, count=1, nodata=-9999)
+        results = {}
+
+        def finite(values):
+            # Non-finite results (e.g. log10 of 0) become NaN, left out of the statistics
+            np.copyto(values, np.nan, where=~np.isfinite(values))
+            return values
+
+        if self.windowed:
+            writers = {name: create_output(output_paths[name], profile) for name in program.outputs}
+            write_locks = {name: threading.Lock() for name in writers}
+
+            def process(window_readers, window, local):
+                blocks = {band: reader.read(band_numbers[band], window=window)
+                          for band, reader in window_readers.items()}
+                for name, values in program.evaluate(blocks).items():
+                    with write_locks[name]:
+                        writers[name].write(finite(values), 1, window=window)
+
+            try:
+                windows = list(raster_windows(width, height, self.window_size))
+                for _ in tqdm(map_windows(sources, windows, process, self.cache, self.workers),
+                              total=len(windows), desc="Band math", leave=False):
+                    pass
+                for name, writer in writers.items():
+                    writer.set_band_description(1, name)
+                    results[name] = {'path': str(output_paths[name]), 'data': Path(output_paths[name])}
+            except BaseException:
+                for writer in writers.values():
+                    writer.discard()
+                raise
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            for name, writer in writers.items():
+                results[name]['statistics'] = writer.statistics[0].summary()
+        else:
+            # Each band read once; the graph runs over blocks of rows into full-size outputs
+            arrays = {band: self._read_band(source, band_numbers[band])[0] for band, source in sources.items()}
+            out = {name: np.empty((height, width), dtype=np.float32) for name in program.outputs}
+
+            def process(readers, rows, local):
+                for name, block in program.evaluate({band: data[rows] for band, data in arrays.items()}).items():
+                    out[name][rows] = finite(block)
+
+            for _ in map_windows({}, row_blocks(height, width, self.window_size), process, workers=self.workers):
+                pass
+            for name, data in out.items():
+                with create_output(output_paths[name], profile) as dst:
+                    dst.write(data, 1)
+                    dst.set_band_description(1, name)
+                results[name] = {'path': str(output_paths[name]), 'data': data,
+                                 'statistics': dst.statistics[0].summary()}
+        return results
+
 def main():
     parser = argparse.ArgumentParser(description="Calculate vegetation and water quality indices")
     parser.add_argument("--input-dir", default="data", help="Input directory")
     parser.add_argument("--output-dir", default="output", help="Output directory")
-    parser.add_argument("--sar", required=True, help="SAR data file")
-    parser.add_argument("--red", help="Red band file for NDVI")
-    parser.add_argument("--nir", help="NIR band file for NDVI")
-    parser.add_argument("--green", help="Green band file for NDCI")
+    parser.add_argument("--sar", nargs="+", help="SAR data file (several files are read as one mosaic); or select scenes with a catalog query")
+    parser.add_argument("--red", nargs="+", help="Red band file for NDVI")
+    parser.add_argument("--nir", nargs="+", help="NIR band file for NDVI")
+    parser.add_argument("--green", nargs="+", help="Green band file for NDCI")
+    parser.add_argument("--overlap", default="first", choices=OVERLAP_METHODS, help="How overlapping scenes of a mosaic are resolved")
+    parser.add_argument("--mosaic", action="store_true", help="Merge catalog matches from different acquisition dates into one mosaic")
     parser.add_argument("--ndvi-only", action="store_true", help="Calculate only NDVI")
     parser.add_argument("--ndci-only", action="store_true", help="Calculate only NDCI")
     parser.add_argument("--wqi-only", action="store_true", help="Calculate only WQI")
+    parser.add_argument("--index", nargs="+", help=f"Band-math indices to calculate ({', '.join(INDEX_EXPRESSIONS)} or --expression names)")
+    parser.add_argument("--expression", action="append", default=[], metavar="NAME=EXPR", help="Define a band-math index, e.g. 'ratio=vv / vh' (repeatable)")
+    parser.add_argument("--band", action="append", default=[], metavar="NAME=PATH[:N]", help="Named input band for band math, optionally band N of the file, e.g. vv=data/s1.tif:1 (repeatable; --sar/--red/--nir/--green are available as sar/red/nir/green)")
+    parser.add_argument("--raster-cache", help="Directory of the memory-mapped raster working cache")
+    parser.add_argument("--index-cache", help="Directory of the index result cache (reruns on unchanged inputs reuse results)")
+    parser.add_argument("--index-cache-size", type=int, default=DEFAULT_MAX_BYTES // 2**20, help="Index result cache size limit in MB")
+    parser.add_argument("--windowed", action="store_true", help="Two-pass, window-by-window computation with bounded memory (for full scenes)")
+    parser.add_argument("--window-size", type=int, default=WINDOW_SIZE, help="Window side in pixels for --windowed")
+    parser.add_argument("--workers", type=int, default=1, help="Threads computing windows / row blocks concurrently (0 = one per CPU)")
+    parser.add_argument("--sar-percentiles", type=float, nargs=2, default=SAR_PERCENTILES, metavar=("LOW", "HIGH"), help="Percentiles between which SAR is normalized for the WQI")
+    parser.add_argument("--sar-minmax", action="store_true", help="Normalize SAR for the WQI over its raw min/max instead of percentiles")
+    add_query_arguments(parser)
+    add_cog_arguments(parser)
     
     args = parser.parse_args()
+    configure_from_args(args)
+
+    if not args.sar:
+        try:
+            args.sar = find_scenes(args, args.input_dir, single_date=True)
+        except ValueError as e:
+            parser.error(str(e))
+        if not args.sar and not args.index:
+            parser.error("--sar or a catalog query matching at least one scene is required")
     
-    calculator = IndexCalculator(args.input_dir, args.output_dir)
+    cache = RasterCache(args.raster_cache) if args.raster_cache else None
+    result_cache = IndexCache(args.index_cache, args.index_cache_size * 2**20, cache) if args.index_cache else None
+    calculator = IndexCalculator(args.input_dir, args.output_dir, cache, args.windowed,
+                                 args.window_size, None if args.sar_minmax else args.sar_percentiles,
+                                 args.workers, result_cache)
+    sar, red, nir, green = (
+        as_raster_source(paths, cache, args.overlap) if paths else None
+        for paths in (args.sar, args.red, args.nir, args.green)
+    )
     
-    if args.ndvi_only:
+    if args.index:
+        expressions = dict(definition.split("=", 1) for definition in args.expression)
+        bands = {name: source for name, source in (('sar', sar), ('red', red), ('nir', nir), ('green', green))
+                 if source is not None}
+        for definition in args.band:
+            name, path = definition.split("=", 1)
+            path, _, number = path.rpartition(":") if path.rpartition(":")[2].isdigit() else (path, "", "")
+            bands[name] = (as_raster_source(path, cache), int(number)) if number else as_raster_source(path, cache)
+        calculator.calculate_expressions(args.index, bands, expressions)
+    elif args.ndvi_only:
         if not args.red or not args.nir:
             print("❌ Red and NIR bands required for NDVI calculation")
             return
-        calculator.calculate_ndvi(args.red, args.nir)
+        calculator.calculate_ndvi(red, nir)
     elif args.ndci_only:
         if not args.green or not args.red:
             print("❌ Green and Red bands required for NDCI calculation")
             return
-        calculator.calculate_ndci(args.green, args.red)
+        calculator.calculate_ndci(green, red)
     elif args.wqi_only:
-        calculator.calculate_water_quality_index(args.sar)
+        calculator.calculate_water_quality_index(sar)
     else:
-        calculator.calculate_all_indices(args.sar, args.red, args.nir, args.green)
+        calculator.calculate_all_indices(sar, red, nir, green)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Conversion Manifest for NASA SAR App
+Records, for every converted input, its size, mtime and SHA-256 together with
+the conversion parameters and outputs, so batch runs only redo work for
+inputs that are new or changed and clean up outputs of deleted inputs.
+
+Unchanged size and mtime are trusted without hashing. When only the mtime
+changed (a copy or touch) the content hash decides, so re-synced but
+identical files are not reconverted.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_NAME = "conversion_manifest.json"
+MANIFEST_VERSION = 1
+
+# Files that make up one shapefile besides the .shp itself
+SHAPEFILE_PARTS = ('.shx', '.dbf', '.prj', '.cpg')
+
+
+def file_sha256(path, chunk_size=8 * 1024 * 1024):
+    """SHA-256 hex digest of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_files(path):
+    """All files a conversion reads: the input plus shapefile sidecars"""
+    path = Path(path)
+    files = [path]
+    if path.suffix.lower() == '.shp':
+        files += [p for p in (path.with_suffix(ext) for ext in SHAPEFILE_PARTS) if p.exists()]
+    return files
+
+
+class ConversionManifest:
+    def __init__(self, path):
+        """
+        Args:
+            path: Manifest JSON file (usually output/conversion_manifest.json)
+        """
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.entries = data.get('entries', {})
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def needs_update(self, input_path, params):
+        """
+        Check whether an input must be (re)converted
+
+        Args:
+            input_path: Input file
+            params: Dict of conversion parameters that affect the outputs
+
+        Returns:
+            True if the input is new, changed, converted with other parameters
+            or any recorded output is missing
+        """
+        entry = self.entries.get(str(input_path))
+        if entry is None or entry['params'] != params:
+            return True
+        if any(not Path(output).exists() for output in entry['outputs']):
+            return True
+
+        files = {str(p): p for p in input_files(input_path)}
+        if set(files) != set(entry['files']):
+            return True
+
+        for name, path in files.items():
+            recorded = entry['files'][name]
+            stat = path.stat()
+            if stat.st_size != recorded['size']:
+                return True
+            if stat.st_mtime_ns != recorded['mtime_ns']:
+                if file_sha256(path) != recorded['sha256']:
+                    return True
+                # Same content with a new mtime: remember it to skip hashing next time
+                recorded['mtime_ns'] = stat.st_mtime_ns
+        return False
+
+    def record(self, input_path, params, outputs, result=None):
+        """Record a successful conversion of an input"""
+        files = {}
+        for path in input_files(input_path):
+            stat = path.stat()
+            files[str(path)] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': file_sha256(path),
+            }
+        self.entries[str(input_path)] = {
+            'files': files,
+            'params': params,
+            'outputs': [str(output) for output in outputs],
+            'result': result,
+            'converted_at': datetime.now().isoformat(),
+        }
+
+    def result(self, input_path):
+        """Stored result of the last conversion of an input"""
+        entry = self.entries.get(str(input_path))
+        return entry['result'] if entry else None
+
+    def collect_garbage(self):
+        """
+        Delete outputs of inputs that no longer exist and drop their entries
+
+        Returns:
+            List of removed input paths
+        """
+        removed = []
+        live_outputs = {
+            output for input_path, entry in self.entries.items()
+            if Path(input_path).exists() for output in entry['outputs']
+        }
+        for input_path, entry in list(self.entries.items()):
+            if Path(input_path).exists():
+                continue
+            for output in entry['outputs']:
+                if output not in live_outputs and Path(output).is_file():
+                    Path(output).unlink()
+            del self.entries[input_path]
+            removed.append(input_path)
+        return removed
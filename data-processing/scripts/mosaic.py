@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Virtual Mosaic for NASA SAR App
+Presents several adjacent or overlapping scenes (e.g. the Sentinel-1 GRD
+frames of one pass over the bay) as a single raster, like a GDAL VRT: no
+pixels are copied or merged up front.
+
+A windowed read only touches the sources whose footprint intersects the
+window and reads just the intersecting part of each. Mosaic pixels take the
+value of the source pixel containing their center (nearest neighbour, exact
+for sources on the mosaic grid). Where sources overlap, `overlap` decides:
+
+    first  earliest source with a valid value wins (default)
+    last   latest source with a valid value wins
+    min    smallest valid value
+    max    largest valid value
+    mean   average of valid values
+
+A mosaic can be saved as a small `.mosaic.json` definition and passed
+anywhere a raster path is accepted.
+"""
+
+import copy
+import json
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+OVERLAP_METHODS = ("first", "last", "min", "max", "mean")
+MOSAIC_EXTENSION = ".mosaic.json"
+BLOCK_SIZE = 512
+
+
+class VirtualMosaic:
+    """Read-only raster view over several scenes sharing a CRS and band layout"""
+
+    def __init__(self, sources, overlap="first", resolution=None, nodata=None, cache=None, name=None):
+        """
+        Args:
+            sources: Raster paths in priority order (for first/last)
+            overlap: How overlapping valid pixels are resolved (see OVERLAP_METHODS)
+            resolution: Mosaic pixel size (x, y) or a single number
+                (default: the finest source resolution)
+            nodata: Mosaic NoData value (default: first source NoData, else
+                NaN for float data and 0 for integers)
+            cache: Optional RasterCache; sources on the mosaic grid are then
+                read as memmap slices instead of decoding GeoTIFF windows
+            name: Display name, also used for output file names
+        """
+        if overlap not in OVERLAP_METHODS:
+            raise ValueError(f"Unknown overlap method: {overlap} (choose from {', '.join(OVERLAP_METHODS)})")
+        self.paths = [Path(p) for p in sources]
+        if not self.paths:
+            raise ValueError("A mosaic needs at least one source raster")
+        missing = [p for p in self.paths if not p.exists()]
+        if missing:
+            raise FileNotFoundError(f"Mosaic sources not found: {', '.join(map(str, missing))}")
+
+        self.overlap = overlap
+        self.cache = cache
+        self.stem = name or f"{self.paths[0].stem}_mosaic"
+        self.name = self.stem
+        self._handles = {}
+
+        # Only headers are read here
+        self._sources = []
+        for path in self.paths:
+            with rasterio.open(path) as src:
+                if not src.transform.is_rectilinear:
+                    raise ValueError(f"Rotated rasters cannot be mosaicked: {path}")
+                self._sources.append({
+                    'path': path,
+                    'crs': src.crs,
+                    'count': src.count,
+                    'dtype': src.dtypes[0],
+                    'nodata': src.nodata,
+                    'width': src.width,
+                    'height': src.height,
+                    'res': (abs(src.transform.a), abs(src.transform.e)),
+                    'bounds': tuple(src.bounds),
+                })
+
+        first = self._sources[0]
+        for source in self._sources[1:]:
+            if source['crs'] != first['crs']:
+                raise ValueError(f"Mosaic sources must share a CRS ({first['path'].name}: {first['crs']}, "
+                                 f"{source['path'].name}: {source['crs']}); reproject them first")
+            if source['count'] != first['count']:
+                raise ValueError(f"Mosaic sources must have the same band count "
+                                 f"({first['path'].name}: {first['count']}, {source['path'].name}: {source['count']})")
+
+        self.crs = first['crs']
+        self.count = first['count']
+        dtype = np.result_type(*[s['dtype'] for s in self._sources])
+        if overlap == "mean" and not np.issubdtype(dtype, np.floating):
+            dtype = np.dtype(np.float32)
+        self.dtype = dtype
+        self.dtypes = (dtype.name,) * self.count
+
+        if resolution is None:
+            resolution = (min(s['res'][0] for s in self._sources), min(s['res'][1] for s in self._sources))
+        elif np.isscalar(resolution):
+            resolution = (resolution, resolution)
+        self.res = (float(resolution[0]), float(resolution[1]))
+
+        left = min(s['bounds'][0] for s in self._sources)
+        bottom = min(s['bounds'][1] for s in self._sources)
+        right = max(s['bounds'][2] for s in self._sources)
+        top = max(s['bounds'][3] for s in self._sources)
+        self.width = max(int(round((right - left) / self.res[0])), 1)
+        self.height = max(int(round((top - bottom) / self.res[1])), 1)
+        self.transform = rasterio.Affine(self.res[0], 0.0, left, 0.0, -self.res[1], top)
+        self.bounds = rasterio.coords.BoundingBox(left, top - self.height * self.res[1],
+                                                  left + self.width * self.res[0], top)
+
+        if nodata is None:
+            nodata = next((s['nodata'] for s in self._sources if s['nodata'] is not None), None)
+        if nodata is None:
+            nodata = float('nan') if np.issubdtype(dtype, np.floating) else 0
+        self.nodata = nodata
+        self.block_shapes = [(BLOCK_SIZE, BLOCK_SIZE)] * self.count
+
+    @classmethod
+    def load(cls, path, cache=None):
+        """Open a mosaic from a .mosaic.json definition (source paths relative to it)"""
+        path = Path(path)
+        with open(path, 'r') as f:
+            definition = json.load(f)
+        sources = [path.parent / p for p in definition['sources']]
+        return cls(sources, definition.get('overlap', 'first'), definition.get('resolution'),
+                   definition.get('nodata'), cache, definition.get('name', path.name[:-len(MOSAIC_EXTENSION)]))
+
+    def save(self, path):
+        """Write the mosaic definition (no pixel data) to a .mosaic.json file"""
+        path = Path(path)
+        definition = {
+            'name': self.name,
+            'sources': [os.path.relpath(p.resolve(), path.parent.resolve()) for p in self.paths],
+            'overlap': self.overlap,
+            'resolution': list(self.res),
+            'nodata': None if isinstance(self.nodata, float) and math.isnan(self.nodata) else self.nodata,
+        }
+        with open(path, 'w') as f:
+            json.dump(definition, f, indent=2)
+        return path
+
+    def __str__(self):
+        return f"{self.name} ({len(self.paths)} scenes)"
+
+    @property
+    def profile(self):
+        return {
+            'driver': 'GTiff',
+            'dtype': self.dtype.name,
+            'nodata': self.nodata,
+            'width': self.width,
+            'height': self.height,
+            'count': self.count,
+            'crs': self.crs,
+            'transform': self.transform,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles = {}
+
+    def __getstate__(self):
+        # Open dataset handles stay in the process that opened them
+        state = dict(self.__dict__)
+        state['_handles'] = {}
+        return state
+
+    def block_windows(self, bidx=1):
+        """((row, col), Window) tiles covering the mosaic, like rasterio's block_windows"""
+        block_height, block_width = self.block_shapes[0]
+        for i, row_off in enumerate(range(0, self.height, block_height)):
+            for j, col_off in enumerate(range(0, self.width, block_width)):
+                yield (i, j), Window(col_off, row_off, min(block_width, self.width - col_off),
+                                     min(block_height, self.height - row_off))
+
+    def _pixel_range(self, window, source):
+        """Mosaic rows/cols of `window` whose centers fall inside a source, and the source pixels they map to"""
+        left, bottom, right, top = source['bounds']
+        x0, y0 = self.transform.c, self.transform.f
+        res_x, res_y = self.res
+        col_start = max(int(window.col_off), math.ceil((left - x0) / res_x - 0.5))
+        col_stop = min(int(window.col_off + window.width), math.floor((right - x0) / res_x - 0.5 - 1e-9) + 1)
+        row_start = max(int(window.row_off), math.ceil((y0 - top) / res_y - 0.5))
+        row_stop = min(int(window.row_off + window.height), math.floor((y0 - bottom) / res_y - 0.5 - 1e-9) + 1)
+        if col_start >= col_stop or row_start >= row_stop:
+            return None
+
+        cols = np.arange(col_start, col_stop)
+        rows = np.arange(row_start, row_stop)
+        src_cols = np.floor((x0 + (cols + 0.5) * res_x - left) / source['res'][0]).astype(np.int64)
+        src_rows = np.floor((top - (y0 - (rows + 0.5) * res_y)) / source['res'][1]).astype(np.int64)
+        src_cols = np.clip(src_cols, 0, source['width'] - 1)
+        src_rows = np.clip(src_rows, 0, source['height'] - 1)
+        return rows, cols, src_rows, src_cols
+
+    def sources_for(self, window=None):
+        """Paths of the sources a read of `window` touches"""
+        window = window or Window(0, 0, self.width, self.height)
+        return [s['path'] for s in self._sources if self._pixel_range(window, s) is not None]
+
+    def _read_source(self, index, source, bands, src_rows, src_cols):
+        """Source pixels (bands x rows x cols) at the given source row/col indices"""
+        row_min, row_max = int(src_rows[0]), int(src_rows[-1]) + 1
+        col_min, col_max = int(src_cols[0]), int(src_cols[-1]) + 1
+        if self.cache is not None:
+            block = np.stack([self.cache.band(source['path'], b)[row_min:row_max, col_min:col_max]
+                              for b in bands])
+        else:
+            if index not in self._handles:
+                self._handles[index] = rasterio.open(source['path'])
+            block = self._handles[index].read(
+                bands, window=Window(col_min, row_min, col_max - col_min, row_max - row_min)
+            )
+        # Sources on the mosaic grid map one to one; others are sampled nearest-neighbour
+        if len(src_rows) != row_max - row_min or np.any(np.diff(src_rows) != 1):
+            block = block[:, src_rows - row_min, :]
+        if len(src_cols) != col_max - col_min or np.any(np.diff(src_cols) != 1):
+            block = block[:, :, src_cols - col_min]
+        return block
+
+    def read(self, indexes=None, window=None):
+        """
+        Read bands of the mosaic, like DatasetReader.read
+
+        Args:
+            indexes: Band number (returns 2D) or list of band numbers
+                (returns 3D); default all bands
+            window: rasterio Window in mosaic pixels (default: whole mosaic)
+        """
+        single = isinstance(indexes, (int, np.integer))
+        bands = [int(indexes)] if single else list(indexes or range(1, self.count + 1))
+        window = window or Window(0, 0, self.width, self.height)
+        row_off, col_off = int(window.row_off), int(window.col_off)
+        height, width = int(window.height), int(window.width)
+
+        out = np.full((len(bands), height, width), self.nodata, dtype=self.dtype)
+        filled = np.zeros(out.shape, dtype=bool)
+        if self.overlap == "mean":
+            total = np.zeros(out.shape, dtype=np.float64)
+            counts = np.zeros(out.shape, dtype=np.uint16)
+
+        for index, source in enumerate(self._sources):
+            pixel_range = self._pixel_range(window, source)
+            if pixel_range is None:
+                continue
+            rows, cols, src_rows, src_cols = pixel_range
+            values = self._read_source(index, source, bands, src_rows, src_cols)
+
+            valid = np.ones(values.shape, dtype=bool)
+            if np.issubdtype(values.dtype, np.floating):
+                valid &= ~np.isnan(values)
+            if source['nodata'] is not None and not np.isnan(source['nodata']):
+                valid &= values != source['nodata']
+
+            target = (slice(None), slice(rows[0] - row_off, rows[-1] + 1 - row_off),
+                      slice(cols[0] - col_off, cols[-1] + 1 - col_off))
+            current = out[target]
+            if self.overlap == "mean":
+                total[target] += np.where(valid, values, 0)
+                counts[target] += valid
+                filled[target] |= valid
+                continue
+            if self.overlap == "first":
+                write = valid & ~filled[target]
+            elif self.overlap == "last":
+                write = valid
+            elif self.overlap == "min":
+                write = valid & (~filled[target] | (values < current))
+            else:
+                write = valid & (~filled[target] | (values > current))
+            current[write] = values[write]
+            filled[target] |= write
+
+        if self.overlap == "mean":
+            out[filled] = (total[filled] / counts[filled]).astype(self.dtype)
+
+        return out[0] if single else out
+
+
+def is_raster_source(obj):
+    """True for a raster path, a list of raster paths or a VirtualMosaic"""
+    if isinstance(obj, (str, Path, VirtualMosaic)):
+        return True
+    return isinstance(obj, (list, tuple)) and len(obj) > 0 and all(isinstance(p, (str, Path)) for p in obj)
+
+
+def as_raster_source(source, cache=None, overlap="first"):
+    """
+    Normalize a raster argument to a Path or a VirtualMosaic
+
+    Lists of several paths and .mosaic.json definitions become mosaics; a
+    single path (or one-element list) stays a plain Path.
+    """
+    if isinstance(source, VirtualMosaic):
+        return source
+    if isinstance(source, (list, tuple)):
+        if len(source) == 1:
+            source = source[0]
+        else:
+            return VirtualMosaic(source, overlap, cache=cache)
+    source = Path(source)
+    if source.name.endswith(MOSAIC_EXTENSION):
+        return VirtualMosaic.load(source, cache)
+    return source
+
+
+def describe_source(source):
+    """JSON-friendly description of a raster argument: a path string, or a list for mosaics"""
+    source = source.paths if isinstance(source, VirtualMosaic) else source
+    if isinstance(source, (list, tuple)):
+        return [str(p) for p in source]
+    return str(source)
+
+
+def open_raster(source, cache=None):
+    """
+    Open a raster path or mosaic for reading (use as a context manager)
+
+    Like rasterio.open, every call returns a reader with its own dataset
+    handles, so readers can be used from different threads.
+    """
+    source = as_raster_source(source, cache)
+    if isinstance(source, VirtualMosaic):
+        return copy.copy(source)
+    return rasterio.open(source)
+
+
+def read_band(source, band=1, cache=None):
+    """
+    Read one band and its profile from a raster path or mosaic
+
+    Plain rasters go through the cache if given (memmapped, decoded once).
+    """
+    source = as_raster_source(source, cache)
+    if isinstance(source, VirtualMosaic):
+        with source:
+            return source.read(band), source.profile
+    if cache is not None:
+        return cache.read(source, band)
+    with rasterio.open(source) as src:
+        return src.read(band), src.profile
@@ -17,10 +17,27 @@ sys.path.append(str(Path(__file__).parent))
 
 from data_converter import DataConverter
 from index_calculator import IndexCalculator
+from manifest import ConversionManifest, MANIFEST_NAME
+from raster_cache import DEFAULT_MAX_BYTES as DEFAULT_RASTER_CACHE_BYTES, RasterCache
+from index_cache import DEFAULT_MAX_BYTES, IndexCache
+from cog import add_cog_arguments, configure_from_args
+from grid_export import CODECS, DTYPES, GRID_EXTENSION, export_grid
+from table_io import EXTENSIONS, FORMATS, read_table, table_format, write_table
+from mosaic import OVERLAP_METHODS, as_raster_source, describe_source, read_band
+from catalog import add_query_arguments, find_scenes
+
+# Fixed quantization ranges so grids of different runs are comparable
+GRID_VALUE_RANGES = {'ndvi': (-1.0, 1.0), 'ndci': (-1.0, 1.0), 'wqi': (0.0, 1.0)}
 
 class DataProcessingPipeline:
-    def __init__(self, base_dir="data-processing"):
+    def __init__(self, base_dir="data-processing", output_format="csv", use_raster_cache=True,
+                 grid_dtype="uint16", grid_codec="zstd", windowed_indices=False,
+                 index_workers=1, index_cache_bytes=DEFAULT_MAX_BYTES,
+                 raster_cache_bytes=DEFAULT_RASTER_CACHE_BYTES):
         self.base_dir = Path(base_dir)
+        self.output_format = output_format
+        self.grid_dtype = grid_dtype
+        self.grid_codec = grid_codec
         self.data_dir = self.base_dir / "data"
         self.output_dir = self.base_dir / "output"
         self.scripts_dir = self.base_dir / "scripts"
@@ -29,9 +46,20 @@ class DataProcessingPipeline:
         for dir_path in [self.data_dir, self.output_dir, self.scripts_dir]:
             dir_path.mkdir(exist_ok=True)
         
+        # Shared working cache: each input band is decoded once for all steps
+        # Bounded: least recently used decoded rasters are evicted beyond raster_cache_bytes
+        self.cache = (RasterCache(self.output_dir / ".raster_cache", raster_cache_bytes or None)
+                      if use_raster_cache else None)
+
         # Initialize converters
-        self.converter = DataConverter(self.data_dir, self.output_dir)
-        self.calculator = IndexCalculator(self.data_dir, self.output_dir)
+        self.converter = DataConverter(self.data_dir, self.output_dir, output_format, self.cache)
+        # Windowed indices: two streaming passes with memory bounded by the window size
+        # Index results are keyed by input content and parameters, so reruns
+        # on unchanged inputs link the previous rasters instead of recomputing
+        self.index_cache = (IndexCache(self.output_dir / ".index_cache", index_cache_bytes, self.cache)
+                            if index_cache_bytes else None)
+        self.calculator = IndexCalculator(self.data_dir, self.output_dir, self.cache, windowed_indices,
+                                          workers=index_workers, result_cache=self.index_cache)
         
     def setup_environment(self):
         """Set up Python environment and install dependencies"""
@@ -57,32 +85,41 @@ class DataProcessingPipeline:
         Complete SAR data processing pipeline
         
         Args:
-            sar_file: Path to SAR data file
+            sar_file: Path to SAR data file, list of scene paths or VirtualMosaic
             red_file: Path to red band (optional)
             nir_file: Path to NIR band (optional)
             green_file: Path to green band (optional)
-            sample_rate: Sampling rate for CSV conversion
+            sample_rate: Sampling rate for pixel table conversion
+
+        Several scenes are processed as one virtual mosaic: windows are read
+        from the intersecting scenes, without writing a merged GeoTIFF first.
         """
         print("🌍 Starting SAR data processing pipeline...")
+        sar_file, red_file, nir_file, green_file = (
+            as_raster_source(source, self.cache) if source else None
+            for source in (sar_file, red_file, nir_file, green_file)
+        )
         print(f"   📁 Input SAR file: {sar_file}")
         
         pipeline_results = {
             'timestamp': datetime.now().isoformat(),
             'input_files': {
-                'sar': str(sar_file),
-                'red': str(red_file) if red_file else None,
-                'nir': str(nir_file) if nir_file else None,
-                'green': str(green_file) if green_file else None
+                'sar': describe_source(sar_file),
+                'red': describe_source(red_file) if red_file else None,
+                'nir': describe_source(nir_file) if nir_file else None,
+                'green': describe_source(green_file) if green_file else None
             },
             'output_files': {},
             'statistics': {}
         }
         
-        # Step 1: Convert SAR data to CSV
-        print("\n📊 Step 1: Converting SAR data to CSV...")
+        table_key = self.output_format
+
+        # Step 1: Convert SAR data to a pixel table
+        print(f"\n📊 Step 1: Converting SAR data to {self.output_format.upper()}...")
         try:
-            sar_df, sar_csv = self.converter.tiff_to_csv(sar_file, sample_rate=sample_rate)
-            pipeline_results['output_files']['sar_csv'] = str(sar_csv)
+            sar_df, sar_table = self.converter.tiff_to_csv(sar_file, sample_rate=sample_rate)
+            pipeline_results['output_files'][f'sar_{table_key}'] = str(sar_table)
             pipeline_results['statistics']['sar_pixels'] = len(sar_df)
             print(f"   ✅ SAR data converted: {len(sar_df)} pixels")
         except Exception as e:
@@ -99,19 +136,19 @@ class DataProcessingPipeline:
             for index_name, index_data in indices_results.items():
                 pipeline_results['output_files'][f'{index_name}_raster'] = index_data['path']
                 
-                # Convert index raster to CSV
-                index_csv = self.output_dir / f"{index_name}_pixels.csv"
+                # Convert index raster to a pixel table
+                index_table = self.converter.table_path(f"{index_name}_pixels")
                 try:
                     index_df, _ = self.converter.tiff_to_csv(
                         index_data['path'], 
-                        output_csv=index_csv,
+                        output_csv=index_table,
                         sample_rate=sample_rate
                     )
-                    pipeline_results['output_files'][f'{index_name}_csv'] = str(index_csv)
+                    pipeline_results['output_files'][f'{index_name}_{table_key}'] = str(index_table)
                     pipeline_results['statistics'][f'{index_name}_pixels'] = len(index_df)
-                    print(f"   ✅ {index_name.upper()} converted to CSV: {len(index_df)} pixels")
+                    print(f"   ✅ {index_name.upper()} converted to {self.output_format.upper()}: {len(index_df)} pixels")
                 except Exception as e:
-                    print(f"   ⚠️  Warning: Could not convert {index_name} to CSV: {e}")
+                    print(f"   ⚠️  Warning: Could not convert {index_name} to {self.output_format.upper()}: {e}")
             
         except Exception as e:
             print(f"   ❌ Error calculating indices: {e}")
@@ -120,7 +157,7 @@ class DataProcessingPipeline:
         # Step 3: Generate Flutter-compatible data
         print("\n📱 Step 3: Preparing Flutter-compatible data...")
         try:
-            flutter_data = self.prepare_flutter_data(pipeline_results)
+            flutter_data = self.prepare_flutter_data(pipeline_results, sar_file)
             pipeline_results['flutter_data'] = flutter_data
             print("   ✅ Flutter data prepared")
         except Exception as e:
@@ -138,8 +175,15 @@ class DataProcessingPipeline:
         
         return pipeline_results
     
-    def prepare_flutter_data(self, pipeline_results):
-        """Prepare data in formats suitable for Flutter app"""
+    def prepare_flutter_data(self, pipeline_results, sar_source=None):
+        """
+        Prepare data in formats suitable for Flutter app
+
+        Args:
+            pipeline_results: Results of process_sar_data
+            sar_source: SAR raster or VirtualMosaic for the grid export
+                (default: the input listed in pipeline_results)
+        """
         flutter_data = {
             'metadata': {
                 'processing_date': pipeline_results['timestamp'],
@@ -149,14 +193,19 @@ class DataProcessingPipeline:
             'statistics': pipeline_results['statistics']
         }
         
-        # Create simplified CSV files for Flutter
+        # Create simplified pixel tables for Flutter
         for file_type, file_path in pipeline_results['output_files'].items():
-            if file_path.endswith('.csv'):
+            fmt = table_format(file_path)
+            if fmt is not None:
                 try:
-                    df = pd.read_csv(file_path)
+                    # Only the columns Flutter needs are read
+                    df = read_table(file_path, columns=['longitude', 'latitude', 'band_1'])
                     
                     # Create simplified version for Flutter
-                    simplified_path = self.output_dir / f"flutter_{file_type}"
+                    if fmt == 'csv':
+                        simplified_path = self.output_dir / f"flutter_{file_type}"
+                    else:
+                        simplified_path = self.output_dir / f"flutter_{file_type.rsplit('_', 1)[0]}{EXTENSIONS[fmt]}"
                     
                     if 'sar' in file_type:
                         # SAR data: keep coordinates and main band
@@ -175,68 +224,166 @@ class DataProcessingPipeline:
                         simplified_df = df[['longitude', 'latitude', 'band_1']].copy()
                         simplified_df.columns = ['lng', 'lat', 'wqi_value']
                     
-                    # Save simplified CSV
-                    simplified_df.to_csv(simplified_path, index=False)
+                    # Save simplified table in the same format
+                    write_table(simplified_df, simplified_path, fmt)
                     flutter_data['files'][file_type] = str(simplified_path)
                     
                 except Exception as e:
                     print(f"   ⚠️  Warning: Could not simplify {file_type}: {e}")
+
+        # Quantized grids: the app derives coordinates from the geotransform header
+        if self.grid_dtype:
+            rasters = {'sar': sar_source or pipeline_results['input_files']['sar']}
+            rasters.update({
+                file_type[:-len('_raster')]: file_path
+                for file_type, file_path in pipeline_results['output_files'].items()
+                if file_type.endswith('_raster')
+            })
+            flutter_data['grids'] = {}
+            for layer, raster_path in rasters.items():
+                try:
+                    data, profile = self._read_band(raster_path)
+                    grid_path = self.output_dir / f"flutter_{layer}{GRID_EXTENSION}"
+                    header = export_grid(
+                        data, profile, grid_path, layer, self.grid_dtype, self.grid_codec,
+                        value_range=GRID_VALUE_RANGES.get(layer)
+                    )
+                    flutter_data['grids'][layer] = str(grid_path)
+                    print(f"   ✅ {layer.upper()} grid: {header['width']}x{header['height']} {header['dtype']}, "
+                          f"{header['bytes'] / 1024:.1f} KB → {grid_path}")
+                except Exception as e:
+                    print(f"   ⚠️  Warning: Could not export {layer} grid: {e}")
         
         return flutter_data
+
+    def _read_band(self, raster_path, band=1):
+        return read_band(raster_path, band, self.cache)
     
-    def process_shapefiles(self, shapefile_pattern="*.shp"):
-        """Process shapefiles to GeoJSON format"""
+    def process_shapefiles(self, shapefile_pattern="*.shp", incremental=True, topojson_zooms=None):
+        """
+        Process shapefiles to GeoJSON format
+
+        Args:
+            shapefile_pattern: Glob pattern in the data directory
+            incremental: Skip shapefiles (including .dbf/.shx/.prj sidecars)
+                unchanged since the last run, per the conversion manifest
+            topojson_zooms: Also write multi-resolution TopoJSON tiers
+                starting at these zoom levels (e.g. [4, 6, 8, 10, 12])
+        """
         print("🗺️  Processing shapefiles...")
+
+        manifest = ConversionManifest(self.output_dir / MANIFEST_NAME) if incremental else None
+        if manifest is not None:
+            removed = manifest.collect_garbage()
+            if removed:
+                print(f"   🗑️  Removed outputs of {len(removed)} deleted inputs")
         
-        shapefiles = list(self.data_dir.glob(shapefile_pattern))
+        shapefiles = sorted(self.data_dir.glob(shapefile_pattern))
         if not shapefiles:
             print(f"   ⚠️  No shapefiles found matching pattern: {shapefile_pattern}")
+            if manifest is not None:
+                manifest.save()
             return
         
+        params = {'output_format': 'geojson', 'topojson_zooms': list(topojson_zooms or [])}
         results = []
         for shapefile in shapefiles:
+            if manifest is not None and not manifest.needs_update(shapefile, params):
+                results.append(manifest.result(shapefile))
+                print(f"   ⏭️  {shapefile.name} unchanged")
+                continue
             try:
                 gdf, geojson_path = self.converter.shapefile_to_geojson(shapefile)
-                results.append({
+                result = {
                     'input': str(shapefile),
                     'output': str(geojson_path),
                     'features': len(gdf)
-                })
+                }
+                outputs = [geojson_path]
+                if topojson_zooms:
+                    topo_manifest, topo_manifest_path = self.converter.shapefile_to_topojson(
+                        shapefile, zooms=topojson_zooms
+                    )
+                    result['topojson_manifest'] = str(topo_manifest_path)
+                    outputs.append(topo_manifest_path)
+                    outputs += [topo_manifest_path.parent / tier['file'] for tier in topo_manifest['tiers']]
+                results.append(result)
+                if manifest is not None:
+                    manifest.record(shapefile, params, outputs, result)
                 print(f"   ✅ Converted {shapefile.name}: {len(gdf)} features")
             except Exception as e:
                 print(f"   ❌ Error converting {shapefile}: {e}")
+
+        if manifest is not None:
+            manifest.save()
         
         return results
 
 def main():
     parser = argparse.ArgumentParser(description="NASA SAR Data Processing Pipeline")
     parser.add_argument("--setup", action="store_true", help="Set up environment")
-    parser.add_argument("--sar", help="SAR data file")
-    parser.add_argument("--red", help="Red band file")
-    parser.add_argument("--nir", help="NIR band file")
-    parser.add_argument("--green", help="Green band file")
+    parser.add_argument("--sar", nargs="+", help="SAR data file (several files are processed as one mosaic)")
+    parser.add_argument("--red", nargs="+", help="Red band file")
+    parser.add_argument("--nir", nargs="+", help="NIR band file")
+    parser.add_argument("--green", nargs="+", help="Green band file")
+    parser.add_argument("--overlap", default="first", choices=OVERLAP_METHODS, help="How overlapping scenes of a mosaic are resolved")
+    parser.add_argument("--mosaic", action="store_true", help="Merge catalog matches from different acquisition dates into one mosaic")
     parser.add_argument("--sample-rate", type=float, default=0.1, help="Sampling rate")
+    parser.add_argument("--format", default="csv", choices=FORMATS, help="Pixel table format (parquet/feather/npz are float32 and compressed)")
     parser.add_argument("--process-shapefiles", action="store_true", help="Process shapefiles")
     parser.add_argument("--base-dir", default="data-processing", help="Base directory")
+    parser.add_argument("--no-raster-cache", action="store_true", help="Decode rasters on every read instead of using the memmapped working cache")
+    parser.add_argument("--raster-cache-size", type=int, default=DEFAULT_RASTER_CACHE_BYTES // 2**20, help="Raster working cache size limit in MB (0 = unbounded)")
+    parser.add_argument("--grid-dtype", default="uint16", choices=list(DTYPES) + ["none"], help="Quantization of Flutter grid exports (none = skip grids)")
+    parser.add_argument("--grid-codec", default="zstd", choices=CODECS, help="Compression of Flutter grid exports")
+    parser.add_argument("--force", action="store_true", help="Reconvert all shapefiles, ignoring the conversion manifest")
+    parser.add_argument("--windowed", action="store_true", help="Compute indices window by window with bounded memory (for full scenes)")
+    parser.add_argument("--index-cache-size", type=int, default=DEFAULT_MAX_BYTES // 2**20, help="Index result cache size limit in MB (0 = no result cache)")
+    parser.add_argument("--index-workers", type=int, default=1, help="Threads for index computation (0 = one per CPU)")
+    parser.add_argument("--topojson-zooms", type=int, nargs="+", help="Also write TopoJSON tiers starting at these zooms (e.g. 4 6 8 10 12)")
+    add_query_arguments(parser)
+    add_cog_arguments(parser)
     
     args = parser.parse_args()
+    configure_from_args(args)
     
-    pipeline = DataProcessingPipeline(args.base_dir)
+    pipeline = DataProcessingPipeline(
+        args.base_dir, args.format, not args.no_raster_cache,
+        None if args.grid_dtype == "none" else args.grid_dtype, args.grid_codec, args.windowed,
+        args.index_workers, args.index_cache_size * 2**20, args.raster_cache_size * 2**20
+    )
     
+    if not args.setup and not args.sar and not args.process_shapefiles:
+        # Catalog query instead of --sar: matching scenes of one acquisition date
+        # (or any dates with --mosaic) are processed as one mosaic
+        try:
+            args.sar = find_scenes(args, pipeline.data_dir, single_date=True)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
+        if args.sar == []:
+            print("❌ No scenes match the catalog query")
+            return
+
     if args.setup:
         pipeline.setup_environment()
     elif args.sar:
-        pipeline.process_sar_data(
-            args.sar, args.red, args.nir, args.green, args.sample_rate
+        sar, red, nir, green = (
+            as_raster_source(paths, pipeline.cache, args.overlap) if paths else None
+            for paths in (args.sar, args.red, args.nir, args.green)
         )
+        pipeline.process_sar_data(sar, red, nir, green, args.sample_rate)
     elif args.process_shapefiles:
-        pipeline.process_shapefiles()
+        pipeline.process_shapefiles(incremental=not args.force, topojson_zooms=args.topojson_zooms)
     else:
         print("🌍 NASA SAR Data Processing Pipeline")
         print("=" * 50)
         print("Usage examples:")
         print("  python pipeline.py --setup")
         print("  python pipeline.py --sar data/sar_image.tif --red data/red.tif --nir data/nir.tif")
+        print("  python pipeline.py --sar data/sar_image.tif --format parquet")
+        print("  python pipeline.py --sar data/S1A_frame1.tif data/S1A_frame2.tif --overlap max")
+        print("  python pipeline.py --bbox -77.5 36.8 -75.5 39.7 --mode IW --polarisation VV VH --orbit ascending --start 2024-06-14 --end 2024-06-14")
         print("  python pipeline.py --process-shapefiles")
 
 if __name__ == "__main__":
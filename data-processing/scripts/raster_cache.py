@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Raster Working Cache for NASA SAR App
+Decodes each GeoTIFF band once into an uncompressed .npy file keyed by the
+file's content hash, and hands out read-only memory-mapped arrays.
+
+Later stages (converter, index calculator, pipeline steps, other processes)
+reading the same band get a zero-copy memmap: repeated and concurrent access
+costs page faults served from the OS page cache instead of another
+decompression of the GeoTIFF.
+
+Layout:
+    <cache_dir>/<sha256>/meta.json     raster profile (CRS as WKT, transform)
+    <cache_dir>/<sha256>/band_<n>.npy  decoded band n
+    <cache_dir>/paths/<hash of path>.json  size/mtime -> sha256, so files are
+                                           hashed once per version
+
+The cache is bounded by max_bytes (DEFAULT_MAX_BYTES unless given): after
+each newly decoded band, least recently used rasters are evicted.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+
+from manifest import file_sha256
+
+# Default size bound (about four full-scene float32 bands); least recently
+# used rasters are evicted beyond it
+DEFAULT_MAX_BYTES = 8 * 1024 ** 3
+
+
+class RasterCache:
+    def __init__(self, cache_dir="output/.raster_cache", max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            cache_dir: Cache directory
+            max_bytes: Size limit (None = unbounded); least recently used
+                rasters are evicted after each newly decoded band
+        """
+        self.cache_dir = Path(cache_dir)
+        (self.cache_dir / "paths").mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._keys = {}
+
+    def key(self, path):
+        """Content hash of a raster, recomputed only when size or mtime change"""
+        path = Path(path).resolve()
+        stat = path.stat()
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+        cached = self._keys.get(path)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        record_path = self.cache_dir / "paths" / f"{hashlib.sha1(str(path).encode()).hexdigest()}.json"
+        sha = None
+        if record_path.exists():
+            with open(record_path, 'r') as f:
+                record = json.load(f)
+            if (record['size'], record['mtime_ns']) == fingerprint:
+                sha = record['sha256']
+        if sha is None:
+            sha = file_sha256(path)
+            self._write_json(record_path, {'path': str(path), 'size': stat.st_size,
+                                           'mtime_ns': stat.st_mtime_ns, 'sha256': sha})
+        self._keys[path] = (fingerprint, sha)
+        return sha
+
+    def _write_json(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _entry(self, path):
+        entry = self.cache_dir / self.key(path)
+        entry.mkdir(exist_ok=True)
+        # Directory mtime doubles as the LRU timestamp
+        os.utime(entry)
+        return entry
+
+    def profile(self, path):
+        """Rasterio profile of a raster (from the cache after the first call)"""
+        meta_path = self._entry(path) / "meta.json"
+        if not meta_path.exists():
+            with rasterio.open(path) as src:
+                profile = dict(src.profile)
+            profile['crs'] = profile['crs'].to_wkt() if profile.get('crs') else None
+            profile['transform'] = list(profile['transform'])[:6]
+            self._write_json(meta_path, profile)
+        with open(meta_path, 'r') as f:
+            profile = json.load(f)
+        profile['crs'] = CRS.from_wkt(profile['crs']) if profile['crs'] else None
+        profile['transform'] = rasterio.Affine(*profile['transform'])
+        return profile
+
+    def band(self, path, band=1):
+        """
+        Read-only memmap of one band, decoding the GeoTIFF on first access
+
+        Decoding writes block by block into the .npy file, so even the first
+        access never holds more than one block in memory.
+        """
+        band_path = self._entry(path) / f"band_{band}.npy"
+        if not band_path.exists():
+            with rasterio.open(path) as src:
+                fd, tmp_path = tempfile.mkstemp(dir=band_path.parent, suffix='.npy.tmp')
+                os.close(fd)
+                out = np.lib.format.open_memmap(
+                    tmp_path, mode='w+', dtype=src.dtypes[band - 1], shape=(src.height, src.width)
+                )
+                for _, window in src.block_windows(band):
+                    out[window.row_off:window.row_off + window.height,
+                        window.col_off:window.col_off + window.width] = src.read(band, window=window)
+                out.flush()
+                del out
+            # Atomic publish: concurrent readers never see a partial file
+            os.replace(tmp_path, band_path)
+            band = np.load(band_path, mmap_mode='r')
+            # Evicting other rasters is safe even while they are mapped: the
+            # mappings stay valid until closed
+            self.prune(keep=(band_path.parent.name,))
+            return band
+        return np.load(band_path, mmap_mode='r')
+
+    def read(self, path, band=1):
+        """(read-only memmapped band, profile) — drop-in for src.read(band), src.profile"""
+        return self.band(path, band), self.profile(path)
+
+    def read_all(self, path):
+        """All bands as a list of read-only memmaps"""
+        count = self.profile(path)['count']
+        return [self.band(path, band) for band in range(1, count + 1)]
+
+    def size(self):
+        return sum(f.stat().st_size for f in self.cache_dir.glob("*/band_*.npy"))
+
+    def prune(self, max_bytes=None, keep=()):
+        """Evict least recently used rasters (except the keys in keep) until the cache fits in max_bytes"""
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        if max_bytes is None:
+            return []
+        entries = sorted(
+            (p for p in self.cache_dir.iterdir() if p.is_dir() and p.name != "paths" and p.name not in keep),
+            key=lambda p: p.stat().st_mtime
+        )
+        total = self.size()
+        evicted = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            total -= sum(f.stat().st_size for f in entry.glob("band_*.npy"))
+            shutil.rmtree(entry, ignore_errors=True)
+            evicted.append(entry.name)
+        return evicted
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Table I/O for NASA SAR App
+Writes and reads pixel tables as CSV, Parquet, Feather (Arrow IPC) or NPZ.
+
+Columnar formats store float32/int32 columns with compression, which is far
+smaller and faster to parse than CSV text of float64 values. Readers support
+column projection and simple row filters; Parquet filters are pushed down so
+row groups whose statistics cannot match are skipped without being decoded.
+"""
+
+import os
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+FORMATS = ("csv", "parquet", "feather", "npz")
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather", "npz": ".npz"}
+DEFAULT_COMPRESSION = {"csv": None, "parquet": "zstd", "feather": "zstd", "npz": "deflate"}
+PARQUET_ROW_GROUP_SIZE = 1_000_000
+
+FILTER_OPS = {
+    "==": lambda col, v: col == v,
+    "!=": lambda col, v: col != v,
+    "<": lambda col, v: col < v,
+    "<=": lambda col, v: col <= v,
+    ">": lambda col, v: col > v,
+    ">=": lambda col, v: col >= v,
+    "in": lambda col, v: np.isin(col, list(v)),
+    "not in": lambda col, v: ~np.isin(col, list(v)),
+}
+
+
+def _require_arrow(fmt):
+    if not ARROW_AVAILABLE:
+        raise ImportError(f"pyarrow is required for {fmt} output. Install with: pip install pyarrow")
+
+
+def table_format(path):
+    """Output format implied by a file suffix, or None if not a table file"""
+    suffix = Path(path).suffix.lower()
+    for fmt, ext in EXTENSIONS.items():
+        if suffix == ext:
+            return fmt
+    return None
+
+
+def downcast(df):
+    """Cast float64 columns to float32 and int64 columns to int32"""
+    casts = {}
+    for name, dtype in df.dtypes.items():
+        if dtype == np.float64:
+            casts[name] = np.float32
+        elif dtype == np.int64:
+            casts[name] = np.int32
+    return df.astype(casts) if casts else df
+
+
+def write_table(df, path, fmt=None, compression=None):
+    """
+    Write a DataFrame in one of FORMATS
+
+    Args:
+        df: Table to write
+        path: Output path
+        fmt: Output format (default: inferred from suffix, else csv)
+        compression: Codec override (parquet/feather: zstd, lz4, snappy...; npz: deflate or None)
+
+    Returns:
+        Output path
+    """
+    with TableWriter(path, fmt, compression) as writer:
+        writer.write(df)
+    return Path(path)
+
+
+class TableWriter:
+    """
+    Incremental table writer: each write() appends a chunk of rows
+
+    CSV appends text. Parquet and Feather buffer chunks and write them as
+    row groups / record batches of PARQUET_ROW_GROUP_SIZE rows (the rest on
+    close), so many small writes do not become many tiny row groups. NPZ
+    columns are spooled to temporary raw files and zipped on close, so
+    memory stays bounded by one chunk (one row group for Parquet/Feather).
+    """
+
+    def __init__(self, path, fmt=None, compression=None):
+        self.path = Path(path)
+        self.fmt = fmt or table_format(self.path) or "csv"
+        if self.fmt not in FORMATS:
+            raise ValueError(f"Unknown table format: {self.fmt} (choose from {', '.join(FORMATS)})")
+        if self.fmt in ("parquet", "feather"):
+            _require_arrow(self.fmt)
+        self.compression = compression or DEFAULT_COMPRESSION[self.fmt]
+        self.rows = 0
+        self._file = None
+        self._writer = None
+        self._schema = None
+        self._buffer = []
+        self._buffered = 0
+        self._spool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, df):
+        """Append a chunk of rows (column names and dtypes must stay the same)"""
+        if self.fmt != "csv":
+            df = downcast(df)
+
+        if self.fmt == "csv":
+            if self._file is None:
+                self._file = open(self.path, 'w', newline='')
+                df.to_csv(self._file, index=False)
+            else:
+                df.to_csv(self._file, header=False, index=False)
+        elif self.fmt in ("parquet", "feather"):
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                if self.fmt == "parquet":
+                    self._writer = pq.ParquetWriter(self.path, self._schema, compression=self.compression)
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression=self.compression)
+                    self._writer = pa.ipc.new_file(str(self.path), self._schema, options=options)
+            self._buffer.append(table)
+            self._buffered += len(table)
+            if self._buffered >= PARQUET_ROW_GROUP_SIZE:
+                self._flush()
+        else:
+            if self._spool is None:
+                self._spool_dir = tempfile.mkdtemp(prefix="npz_", dir=self.path.parent)
+                self._spool = {
+                    name: (open(os.path.join(self._spool_dir, f"{i}.raw"), 'wb'), df[name].dtype)
+                    for i, name in enumerate(df.columns)
+                }
+            for name, (raw, dtype) in self._spool.items():
+                raw.write(np.ascontiguousarray(df[name].to_numpy(dtype=dtype)).tobytes())
+
+        self.rows += len(df)
+
+    def _flush(self, final=False):
+        """Write buffered rows as full row groups / batches (and the remainder if final)"""
+        table = pa.concat_tables(self._buffer) if self._buffer else None
+        if table is None:
+            return
+        end = len(table) if final else len(table) // PARQUET_ROW_GROUP_SIZE * PARQUET_ROW_GROUP_SIZE
+        if end:
+            chunk = table.slice(0, end).combine_chunks()
+            if self.fmt == "parquet":
+                self._writer.write_table(chunk, row_group_size=PARQUET_ROW_GROUP_SIZE)
+            else:
+                self._writer.write_table(chunk, max_chunksize=PARQUET_ROW_GROUP_SIZE)
+        rest = table.slice(end)
+        self._buffer = [rest] if len(rest) else []
+        self._buffered = len(rest)
+
+    def _close_npz(self):
+        method = zipfile.ZIP_DEFLATED if self.compression == "deflate" else zipfile.ZIP_STORED
+        with zipfile.ZipFile(self.path, 'w', compression=method, allowZip64=True) as archive:
+            for name, (raw, dtype) in self._spool.items():
+                raw.close()
+                header = {'descr': np.lib.format.dtype_to_descr(dtype),
+                          'fortran_order': False, 'shape': (self.rows,)}
+                with archive.open(f"{name}.npy", 'w', force_zip64=True) as member:
+                    np.lib.format.write_array_header_2_0(member, header)
+                    with open(raw.name, 'rb') as data:
+                        shutil.copyfileobj(data, member, 16 * 1024 * 1024)
+        shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        elif self._writer is not None:
+            self._flush(final=True)
+            self._writer.close()
+        elif self._spool is not None:
+            self._close_npz()
+        self._file = self._writer = self._spool = None
+
+
+def _filter_mask(columns, filters):
+    mask = None
+    for name, op, value in filters:
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unknown filter operator: {op}")
+        condition = FILTER_OPS[op](np.asarray(columns[name]), value)
+        mask = condition if mask is None else mask & condition
+    return mask
+
+
+def read_table(path, columns=None, filters=None, fmt=None):
+    """
+    Read a pixel table with optional column projection and row filtering
+
+    Args:
+        path: Table file
+        columns: Columns to load (default: all)
+        filters: List of (column, op, value) tuples combined with AND, where op
+            is one of ==, !=, <, <=, >, >=, in, not in.
+            e.g. [('latitude', '>=', 38.5), ('band_1', '<', -20)]
+        fmt: Table format (default: inferred from suffix)
+
+    Returns:
+        DataFrame
+    """
+    path = Path(path)
+    fmt = fmt or table_format(path) or "csv"
+    filters = list(filters or [])
+    filter_columns = [name for name, _, _ in filters]
+
+    if fmt == "parquet":
+        _require_arrow(fmt)
+        # Pushed down: row groups are pruned using their min/max statistics
+        table = pq.read_table(path, columns=columns, filters=filters or None)
+        return table.to_pandas()
+
+    if fmt == "feather":
+        _require_arrow(fmt)
+        if not filters:
+            return feather.read_feather(path, columns=columns)
+        dataset = ds.dataset(path, format="feather")
+        expression = pq.filters_to_expression(filters)
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    if fmt == "npz":
+        with np.load(path) as archive:
+            names = columns or [name for name in archive.files]
+            # Members are decompressed individually, so projection skips unused columns
+            data = {name: archive[name] for name in dict.fromkeys(list(names) + filter_columns)}
+        mask = _filter_mask(data, filters) if filters else None
+        return pd.DataFrame({
+            name: data[name][mask] if mask is not None else data[name] for name in names
+        })
+
+    if fmt == "csv":
+        usecols = list(dict.fromkeys(list(columns) + filter_columns)) if columns else None
+        df = pd.read_csv(path, usecols=usecols)
+        if filters:
+            df = df[_filter_mask(df, filters)]
+        return df[list(columns)] if columns else df
+
+    raise ValueError(f"Unknown table format: {fmt} (choose from {', '.join(FORMATS)})")
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Temporal Compositing for NASA SAR App
+Exact per-month, per-year or whole-stack composites (median, mean, min, max,
+percentiles, count) of co-registered SAR scenes, computed locally like
+Earth Engine's ImageCollection.median() in GEEService.
+
+The stack is processed out of core in (time, y, x) chunks that hold every
+date of a period but only a tile of pixels. The tile side is chosen so that
+a chunk fits the memory budget (--chunk-mb), so memory is bounded by the
+budget and not by the number of dates: deeper stacks just mean smaller
+tiles. Median and percentiles are exact, from partial selection
+(np.partition) at only the ranks needed in each chunk, with the same linear
+interpolation as np.nanpercentile. All requested statistics of a period come
+from one read of each chunk.
+
+Unlike the MonthlyCube (temporal_cube.py), whose median is approximate and
+built from histograms, nothing is pre-aggregated: composites are exact but
+re-read the scenes.
+"""
+
+import rasterio
+import numpy as np
+from pathlib import Path
+import argparse
+import json
+import math
+from rasterio.windows import Window
+from tqdm import tqdm
+import warnings
+from temporal_cube import DATE_PATTERN, HIST_BINS, HIST_MAX, HIST_MIN
+from catalog import add_query_arguments, find_scenes
+from cog import COGWriter, add_cog_arguments, configure_from_args
+warnings.filterwarnings('ignore')
+
+STATS = ("median", "mean", "min", "max", "count")
+PERIODS = ("month", "year", "all")
+# Memory budget of one (time, y, x) chunk, including the selection copy
+CHUNK_MB = 256
+# Tile sides are multiples of this (GeoTIFF block alignment), between the bounds
+TILE_ALIGN = 16
+MAX_TILE = 1024
+
+
+def scene_period(path, period):
+    """Period label of a scene from its filename date: "YYYY-MM", "YYYY" or "all" """
+    if period == "all":
+        return "all"
+    match = DATE_PATTERN.search(Path(path).stem)
+    if not match:
+        raise ValueError(f"No acquisition date in filename: {path}")
+    return f"{match.group(1)}-{match.group(2)}" if period == "month" else match.group(1)
+
+
+def scene_date(path):
+    """"YYYYMMDD" from a scene filename, "" if it has no date"""
+    match = DATE_PATTERN.search(Path(path).stem)
+    return ''.join(match.groups()) if match else ''
+
+
+def parse_stat(stat):
+    """Validate a statistic name; percentiles are written "p<q>", e.g. "p90" or "p2.5" """
+    if stat in STATS:
+        return stat
+    if stat.startswith("p"):
+        try:
+            q = float(stat[1:])
+        except ValueError:
+            q = None
+        if q is not None and 0 <= q <= 100:
+            return stat
+    raise ValueError(f"Unknown composite statistic: {stat} (choose from {', '.join(STATS)} or p<0-100>)")
+
+
+def tile_size(depth, chunk_mb=CHUNK_MB):
+    """Side of square tiles so that a float32 chunk of `depth` dates fits chunk_mb"""
+    # Chunk, selection copy and validity mask: 4 + 4 + 1 bytes per value
+    pixels = chunk_mb * 1024 ** 2 / (9 * max(depth, 1))
+    side = int(math.sqrt(pixels)) // TILE_ALIGN * TILE_ALIGN
+    return max(TILE_ALIGN, min(MAX_TILE, side))
+
+
+def composite_chunk(stack, stats):
+    """
+    Composite statistics of one chunk
+
+    Args:
+        stack: float32 array (time, rows, cols), NaN where a scene has no data
+        stats: Statistic names (see parse_stat)
+
+    Returns:
+        {stat: float32 array (rows, cols)}, NaN where no scene has data
+    """
+    valid = ~np.isnan(stack)
+    count = valid.sum(axis=0)
+    empty = count == 0
+    results = {}
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for stat in stats:
+            if stat == "count":
+                results[stat] = count.astype(np.float32)
+            elif stat == "mean":
+                results[stat] = (np.nansum(stack, axis=0, dtype=np.float64) / count).astype(np.float32)
+            elif stat == "min":
+                results[stat] = np.fmin.reduce(stack, axis=0)
+            elif stat == "max":
+                results[stat] = np.fmax.reduce(stack, axis=0)
+
+        quantiles = {stat: 50.0 if stat == "median" else float(stat[1:])
+                     for stat in stats if stat == "median" or stat.startswith("p")}
+        if quantiles:
+            # Missing values sort last, so ranks 0..count-1 are the valid ones
+            ordered = np.where(valid, stack, np.inf)
+            last = np.maximum(count - 1, 0)
+            positions = {stat: q / 100.0 * last for stat, q in quantiles.items()}
+            ranks = {stat: (np.floor(pos).astype(np.intp), np.ceil(pos).astype(np.intp))
+                     for stat, pos in positions.items()}
+            # Partial selection at the distinct ranks needed anywhere in the chunk
+            kth = np.unique(np.concatenate([np.concatenate([lo[~empty], hi[~empty]]) for lo, hi in ranks.values()]))
+            if kth.size:
+                ordered.partition(kth, axis=0)
+            for stat, (lo, hi) in ranks.items():
+                lower = np.take_along_axis(ordered, lo[None], axis=0)[0]
+                upper = np.take_along_axis(ordered, hi[None], axis=0)[0]
+                fraction = (positions[stat] - lo).astype(np.float32)
+                results[stat] = np.where(fraction > 0, lower + (upper - lower) * fraction, lower).astype(np.float32)
+
+    for stat in results:
+        if stat != "count":
+            results[stat][empty] = np.nan
+    return results
+
+
+class TemporalCompositor:
+    def __init__(self, output_dir="output/composites", to_db=False, band=1, chunk_mb=CHUNK_MB, cache=None):
+        """
+        Args:
+            output_dir: Directory for composite GeoTIFFs
+            to_db: Convert linear backscatter to dB before compositing
+            band: Band of the scenes to composite (VV)
+            chunk_mb: Memory budget of one (time, y, x) chunk
+            cache: Optional RasterCache; scenes are then read as memmap
+                slices instead of decoding GeoTIFF windows
+        """
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.to_db = to_db
+        self.band = band
+        self.chunk_mb = chunk_mb
+        self.cache = cache
+
+    def group(self, scene_paths, period="month"):
+        """{period label: scene paths}, labels and scenes in date order"""
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period: {period} (choose from {', '.join(PERIODS)})")
+        groups = {}
+        for path in sorted(scene_paths, key=lambda p: (scene_date(p), str(p))):
+            groups.setdefault(scene_period(path, period), []).append(Path(path))
+        return dict(sorted(groups.items()))
+
+    def _prepare(self, block, nodata):
+        """float32 block with NoData as NaN, in dB if requested"""
+        block = block.astype(np.float32)
+        if nodata is not None and not np.isnan(nodata):
+            block[block == nodata] = np.nan
+        if self.to_db:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.log10(block, out=block)
+            block *= 10
+            block[~np.isfinite(block)] = np.nan
+        return block
+
+    def composite(self, scene_paths, stats=("median",), label="all"):
+        """
+        Composite a stack of co-registered scenes
+
+        Args:
+            scene_paths: Scene GeoTIFFs sharing grid and CRS
+            stats: Statistics to compute (see parse_stat), from one read of each chunk
+            label: Period label used in output names ("<stat>_<label>.tif")
+
+        Returns:
+            {stat: output path}
+        """
+        stats = [parse_stat(stat) for stat in stats]
+        scene_paths = [Path(p) for p in scene_paths]
+        if not scene_paths:
+            raise ValueError(f"No scenes to composite for {label}")
+
+        handles = [rasterio.open(path) for path in scene_paths]
+        writers = {}
+        try:
+            first = handles[0]
+            for path, src in zip(scene_paths[1:], handles[1:]):
+                if (src.width, src.height, src.transform, src.crs) != (first.width, first.height, first.transform, first.crs):
+                    raise ValueError(f"Scene {path.name} is not co-registered with {scene_paths[0].name}")
+
+            depth = len(handles)
+            side = tile_size(depth, self.chunk_mb)
+            print(f"🗓️  Compositing {label}: {depth} scenes, {', '.join(stats)} in {side}×{side} px chunks...")
+
+            profile = {
+                'driver': 'GTiff', 'width': first.width, 'height': first.height, 'count': 1,
+                'dtype': 'float32', 'crs': first.crs, 'transform': first.transform, 'nodata': np.nan,
+            }
+            outputs = {stat: self.output_dir / f"{stat}_{label}.tif" for stat in stats}
+            for stat, output_path in outputs.items():
+                # dB composites also get an exact histogram on the cube's bins
+                statistics = ({'histogram_range': (HIST_MIN, HIST_MAX), 'bins': HIST_BINS}
+                              if self.to_db and stat != "count" else True)
+                writers[stat] = COGWriter(output_path, profile, statistics=statistics)
+
+            stack = np.empty((depth, side, side), dtype=np.float32)
+            tiles = [Window(col, row, min(side, first.width - col), min(side, first.height - row))
+                     for row in range(0, first.height, side) for col in range(0, first.width, side)]
+            for window in tqdm(tiles, desc=label, leave=False):
+                rows, cols = int(window.height), int(window.width)
+                chunk = stack[:, :rows, :cols]
+                for t, (path, src) in enumerate(zip(scene_paths, handles)):
+                    if self.cache is not None:
+                        block = self.cache.band(path, self.band)[window.row_off:window.row_off + rows,
+                                                                 window.col_off:window.col_off + cols]
+                    else:
+                        block = src.read(self.band, window=window)
+                    chunk[t] = self._prepare(block, src.nodata)
+                for stat, values in composite_chunk(chunk, stats).items():
+                    writers[stat].write(values, 1, window=window)
+
+            for stat, writer in writers.items():
+                writer.set_band_description(1, f"{stat} {label} ({depth} scenes{', dB' if self.to_db else ''})")
+        except BaseException:
+            for writer in writers.values():
+                writer.discard()
+            raise
+        finally:
+            for handle in handles + list(writers.values()):
+                handle.close()
+
+        print(f"   ✅ Saved {', '.join(p.name for p in outputs.values())}")
+        return {stat: str(path) for stat, path in outputs.items()}
+
+    def build(self, scene_paths, period="month", stats=("median",)):
+        """
+        Composite every period of a scene collection
+
+        Returns:
+            {period label: {stat: output path}}; also written to composites.json
+        """
+        groups = self.group(scene_paths, period)
+        print(f"🗓️  {len(groups)} {period} period(s) from {sum(len(g) for g in groups.values())} scenes")
+        results = {label: self.composite(paths, stats, label) for label, paths in groups.items()}
+
+        summary = {
+            'period': period,
+            'stats': list(stats),
+            'to_db': self.to_db,
+            'band': self.band,
+            'periods': {label: {'scenes': [str(p) for p in groups[label]], 'outputs': outputs}
+                        for label, outputs in results.items()},
+        }
+        with open(self.output_dir / "composites.json", 'w') as f:
+            json.dump(summary, f, indent=2)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exact temporal composites of co-registered SAR scenes")
+    parser.add_argument("--scenes", nargs="+", help="Scene GeoTIFFs (dates parsed from filenames)")
+    parser.add_argument("--data-dir", default="data", help="Directory indexed by the scene catalog")
+    parser.add_argument("--output-dir", default="output/composites", help="Output directory")
+    parser.add_argument("--period", default="month", choices=PERIODS, help="Composite per month, per year or over all scenes")
+    parser.add_argument("--stat", nargs="+", default=["median"], help=f"Statistics: {', '.join(STATS)} or percentiles p<q> (e.g. p10 p90)")
+    parser.add_argument("--band", type=int, default=1, help="Band to composite")
+    parser.add_argument("--to-db", action="store_true", help="Convert linear backscatter to dB")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_MB, help="Memory budget of one (time, y, x) chunk in MB")
+    add_query_arguments(parser)
+    add_cog_arguments(parser)
+
+    args = parser.parse_args()
+    configure_from_args(args)
+    for stat in args.stat:
+        try:
+            parse_stat(stat)
+        except ValueError as e:
+            parser.error(str(e))
+
+    scenes = args.scenes or find_scenes(args, args.data_dir)
+    if not scenes:
+        print("🗓️  NASA SAR Temporal Compositing")
+        print("=" * 40)
+        print("Usage examples:")
+        print("  python temporal_composite.py --scenes data/S1A_*_VV.tif --period month --stat median p90 count --to-db")
+        print("  python temporal_composite.py --polarisation VV --orbit ascending --start 2020-01-01 --period year --stat median")
+        return
+
+    compositor = TemporalCompositor(args.output_dir, args.to_db, args.band, args.chunk_mb)
+    compositor.build(scenes, args.period, args.stat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Monthly Temporal Cube for NASA SAR App
+Pre-aggregates co-registered SAR scenes into per-month partial aggregates
+(count, sum, sum of squares, min, histogram) that combine into composites
+over any month-aligned date range without re-reading the raw scenes.
+
+Scenes are aggregated in blocks of BLOCK_SIZE² pixels, and each month's file
+stores the aggregates block by block, so neither building nor combining
+months ever holds a whole scene's histograms in memory.
+
+Histogram bins match the Earth Engine cube in nasa-sar-backend/temporal_cube.py
+(80 bins of 0.5 dB from -35 dB) so both paths give the same approximate median.
+The bins are in dB, so scenes are converted from linear backscatter by
+default; scenes passed as dB (to_db=False) that look linear are rejected.
+"""
+
+import rasterio
+import numpy as np
+from pathlib import Path
+import argparse
+import json
+import os
+import re
+import zipfile
+from datetime import datetime
+from rasterio.windows import Window
+import warnings
+from catalog import add_query_arguments, find_scenes
+from cog import COGWriter, add_cog_arguments, configure_from_args
+warnings.filterwarnings('ignore')
+
+HIST_MIN = -35.0
+HIST_MAX = 5.0
+HIST_BINS = 80
+HIST_WIDTH = (HIST_MAX - HIST_MIN) / HIST_BINS
+STATS = ("median", "mean", "std", "min", "count")
+# Aggregates are built and stored per block of BLOCK_SIZE² pixels; the
+# histogram bincount of a block takes 8 bytes per bin and pixel (~170 MB)
+BLOCK_SIZE = 512
+
+DATE_PATTERN = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})')
+
+
+def block_windows(width, height, block_size=BLOCK_SIZE):
+    """Windows of block_size × block_size pixels covering a width × height grid"""
+    return [Window(col, row, min(block_size, width - col), min(block_size, height - row))
+            for row in range(0, height, block_size) for col in range(0, width, block_size)]
+
+
+def block_key(name, window):
+    """Archive key of one block of an aggregate ("<name>_<row>_<col>")"""
+    return f"{name}_{int(window.row_off)}_{int(window.col_off)}"
+
+
+def _write_array(archive, name, array):
+    """Add an array to an open .npz archive (as np.savez_compressed stores it)"""
+    with archive.open(f"{name}.npy", 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def scene_month(path):
+    """Extract "YYYY-MM" from a scene filename (e.g. S1A_..._20240115T..._VV.tif)"""
+    match = DATE_PATTERN.search(Path(path).stem)
+    if not match:
+        raise ValueError(f"No acquisition date in filename: {path}")
+    return f"{match.group(1)}-{match.group(2)}"
+
+
+def month_list(start_month, end_month):
+    """All "YYYY-MM" months from start_month to end_month inclusive"""
+    start = datetime.strptime(start_month, '%Y-%m')
+    end = datetime.strptime(end_month, '%Y-%m')
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class MonthlyCube:
+    def __init__(self, cube_dir="output/cube", to_db=True):
+        """
+        Args:
+            cube_dir: Directory holding one `<YYYY-MM>.npz` aggregate per month
+            to_db: Convert linear backscatter to dB before aggregating; set
+                False only for scenes already in dB (the histogram bins are dB)
+        """
+        self.cube_dir = Path(cube_dir)
+        self.cube_dir.mkdir(parents=True, exist_ok=True)
+        self.to_db = to_db
+
+    def _prepare(self, block, nodata):
+        """float32 block with NoData as NaN, in dB if requested"""
+        block = block.astype(np.float32)
+        if nodata is not None and not np.isnan(nodata):
+            block[block == nodata] = np.nan
+        if self.to_db:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                np.log10(block, out=block)
+            block *= 10
+            block[~np.isfinite(block)] = np.nan
+        return block
+
+    def build_month(self, month, scene_paths, band=1):
+        """
+        Aggregate all scenes of one month into a partial-aggregate file
+
+        The scenes are read and aggregated one BLOCK_SIZE block at a time,
+        and each block's aggregates are written to the archive before the
+        next is read, so memory is bounded by the block size and not by the
+        scene size.
+
+        Args:
+            month: Month as "YYYY-MM"
+            scene_paths: Co-registered GeoTIFFs acquired in that month
+            band: Band index to aggregate (VV)
+        """
+        print(f"🧊 Building cube month {month} from {len(scene_paths)} scenes...")
+
+        month_path = self.cube_dir / f"{month}.npz"
+        # Not matched by available_months until complete
+        tmp_path = self.cube_dir / f".{month}.npz.tmp"
+        handles = [rasterio.open(path) for path in scene_paths]
+        try:
+            first = handles[0]
+            for path, src in zip(scene_paths[1:], handles[1:]):
+                if src.shape != first.shape:
+                    raise ValueError(f"Scene {path} is not co-registered: {src.shape} != {first.shape}")
+            profile = first.profile
+            # Per scene: any valid value, any negative value (dB check)
+            finite = [False] * len(handles)
+            negative = [False] * len(handles)
+
+            with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for window in block_windows(first.width, first.height):
+                    rows, cols = int(window.height), int(window.width)
+                    pixels = rows * cols
+                    count = np.zeros((rows, cols), dtype=np.uint16)
+                    total = np.zeros((rows, cols), dtype=np.float64)
+                    total_sq = np.zeros((rows, cols), dtype=np.float64)
+                    minimum = np.full((rows, cols), np.inf, dtype=np.float32)
+                    # Flat (bin, pixel) index of every valid value of the block
+                    indices = []
+                    for i, src in enumerate(handles):
+                        data = self._prepare(src.read(band, window=window), src.nodata)
+                        valid = np.isfinite(data)
+                        values = np.where(valid, data, 0)
+                        finite[i] |= bool(valid.any())
+                        negative[i] |= bool((values < 0).any())
+                        count += valid
+                        total += values
+                        total_sq += values * values
+                        np.fmin(minimum, data, out=minimum)
+
+                        bins = np.clip(((values - HIST_MIN) / HIST_WIDTH).astype(np.int64), 0, HIST_BINS - 1)
+                        indices.append((bins * pixels + np.arange(pixels).reshape(rows, cols))[valid])
+                    hist = np.bincount(np.concatenate(indices), minlength=HIST_BINS * pixels)
+                    hist = hist.reshape(HIST_BINS, rows, cols).astype(np.uint16)
+
+                    for name, values in (('count', count), ('sum', total), ('sum_sq', total_sq),
+                                         ('min', minimum), ('hist', hist)):
+                        _write_array(archive, block_key(name, window), values)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            for handle in handles:
+                handle.close()
+
+        if not self.to_db:
+            for path, has_values, has_negative in zip(scene_paths, finite, negative):
+                if has_values and not has_negative:
+                    tmp_path.unlink(missing_ok=True)
+                    # dB backscatter is mostly negative; all-positive values
+                    # would all fall into the lowest bins
+                    raise ValueError(f"Scene {path} has no negative values and looks like linear backscatter; "
+                                     f"build the cube with dB conversion (to_db=True)")
+        os.replace(tmp_path, month_path)
+
+        meta = {
+            'month': month,
+            'scenes': [str(p) for p in scene_paths],
+            'crs': str(profile['crs']),
+            'transform': list(profile['transform'])[:6],
+            'width': profile['width'],
+            'height': profile['height'],
+            'block_size': BLOCK_SIZE,
+            'hist_min': HIST_MIN,
+            'hist_width': HIST_WIDTH,
+            'hist_bins': HIST_BINS,
+            'to_db': self.to_db,
+        }
+        with open(self.cube_dir / f"{month}.json", 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        print(f"   ✅ Saved {month_path}")
+        return month_path
+
+    def build(self, scene_paths, band=1):
+        """Group scenes by acquisition month (from filename) and build each month"""
+        by_month = {}
+        for path in sorted(scene_paths):
+            by_month.setdefault(scene_month(path), []).append(path)
+        return {month: self.build_month(month, paths, band) for month, paths in sorted(by_month.items())}
+
+    def available_months(self):
+        return sorted(p.stem for p in self.cube_dir.glob("*.npz"))
+
+    def _combine_block(self, parts, key, window, stat):
+        """Composite of one block from the months' partial aggregates"""
+        count = total = total_sq = minimum = hist = None
+        for part in parts:
+            if count is None:
+                count = part[key('count', window)].astype(np.int64)
+                if stat in ('mean', 'std'):
+                    total = part[key('sum', window)]
+                    total_sq = part[key('sum_sq', window)]
+                elif stat == 'min':
+                    minimum = part[key('min', window)]
+                elif stat == 'median':
+                    hist = part[key('hist', window)].astype(np.int32)
+                continue
+            count += part[key('count', window)]
+            if stat in ('mean', 'std'):
+                total += part[key('sum', window)]
+                total_sq += part[key('sum_sq', window)]
+            elif stat == 'min':
+                np.fmin(minimum, part[key('min', window)], out=minimum)
+            elif stat == 'median':
+                hist += part[key('hist', window)]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if stat == 'count':
+                result = count.astype(np.float32)
+            elif stat == 'min':
+                result = minimum
+            elif stat in ('mean', 'std'):
+                mean = total / count
+                result = mean
+                if stat == 'std':
+                    result = np.sqrt(np.maximum(total_sq / count - mean * mean, 0))
+            else:
+                # Approximate median: average the bins holding the two middle ranks
+                cumulative = np.cumsum(hist, axis=0)
+                lower = np.argmax(cumulative >= ((count + 1) // 2)[None], axis=0)
+                upper = np.argmax(cumulative >= (count // 2 + 1)[None], axis=0)
+                result = HIST_MIN + ((lower + upper) / 2.0 + 0.5) * HIST_WIDTH
+
+        return np.where(count > 0, result, np.nan).astype(np.float32)
+
+    def composite(self, start_month, end_month, stat="median", output_path=None):
+        """
+        Combine monthly aggregates into a composite over a month range
+
+        The months are combined one block at a time; with output_path the
+        composite is written block by block and never held in memory.
+
+        Args:
+            start_month: First month ("YYYY-MM")
+            end_month: Last month ("YYYY-MM"), inclusive
+            stat: One of "median" (approximate, from histograms), "mean", "std", "min", "count"
+            output_path: Optional GeoTIFF path for the composite
+
+        Returns:
+            The composite array, or output_path if given
+        """
+        if stat not in STATS:
+            raise ValueError(f"Unknown composite statistic: {stat}")
+        months = month_list(start_month, end_month)
+        missing = sorted(set(months) - set(self.available_months()))
+        if missing:
+            raise FileNotFoundError(f"Cube months not built: {', '.join(missing)}")
+
+        print(f"🧊 Combining {len(months)} cube months ({start_month} to {end_month}) into {stat}...")
+
+        metas = []
+        for month in months:
+            with open(self.cube_dir / f"{month}.json", 'r') as f:
+                metas.append(json.load(f))
+        meta = metas[0]
+        width, height = meta['width'], meta['height']
+        # Cubes built before block-wise aggregation hold each array whole
+        block_size = meta.get('block_size')
+        if any(m.get('block_size') != block_size or (m['width'], m['height']) != (width, height) for m in metas):
+            raise ValueError("Cube months differ in grid or block layout; rebuild them")
+        windows = block_windows(width, height, block_size or max(width, height))
+        key = block_key if block_size else (lambda name, window: name)
+
+        writer = None
+        result = None
+        if output_path:
+            profile = {
+                'driver': 'GTiff',
+                'width': width,
+                'height': height,
+                'count': 1,
+                'dtype': 'float32',
+                'crs': meta['crs'],
+                'transform': rasterio.Affine(*meta['transform']),
+                'nodata': np.nan,
+            }
+            # dB composites also get an exact histogram on the cube's bins
+            statistics = ({'histogram_range': (HIST_MIN, HIST_MAX), 'bins': HIST_BINS}
+                          if stat in ('median', 'mean', 'min') else True)
+            writer = COGWriter(output_path, profile, statistics=statistics)
+        else:
+            result = np.full((height, width), np.nan, dtype=np.float32)
+
+        parts = [np.load(self.cube_dir / f"{month}.npz") for month in months]
+        try:
+            for window in windows:
+                values = self._combine_block(parts, key, window, stat)
+                if writer is not None:
+                    writer.write(values, 1, window=window)
+                else:
+                    result[window.toslices()] = values
+            if writer is not None:
+                writer.set_band_description(1, f"VV {stat} {start_month}..{end_month}")
+        except BaseException:
+            if writer is not None:
+                writer.discard()
+            raise
+        finally:
+            for part in parts:
+                part.close()
+            if writer is not None:
+                writer.close()
+
+        if writer is not None:
+            print(f"   ✅ Composite saved to {output_path}")
+            return output_path
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query monthly SAR temporal cubes")
+    parser.add_argument("--cube-dir", default="output/cube", help="Cube directory")
+    parser.add_argument("--build", nargs="+", help="Scene GeoTIFFs to aggregate (dates parsed from filenames)")
+    parser.add_argument("--to-db", action=argparse.BooleanOptionalAction, default=True,
+                        help="Convert linear backscatter to dB (default; --no-to-db for scenes already in dB)")
+    parser.add_argument("--start-month", help="First month of composite (YYYY-MM)")
+    parser.add_argument("--end-month", help="Last month of composite (YYYY-MM)")
+    parser.add_argument("--stat", default="median", choices=STATS, help="Composite statistic")
+    parser.add_argument("--output", help="Output GeoTIFF for composite")
+    parser.add_argument("--data-dir", default="data", help="Directory indexed by the scene catalog")
+    add_query_arguments(parser)
+    add_cog_arguments(parser)
+
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    cube = MonthlyCube(args.cube_dir, to_db=args.to_db)
+
+    scenes = None if args.build else find_scenes(args, args.data_dir)
+
+    if args.build or scenes:
+        cube.build(args.build or scenes)
+    elif args.start_month and args.end_month:
+        cube.composite(args.start_month, args.end_month, args.stat, args.output)
+    else:
+        print("🧊 NASA SAR Monthly Temporal Cube")
+        print("=" * 40)
+        print("Usage examples:")
+        print("  python temporal_cube.py --build data/S1A_*_VV.tif")
+        print("  python temporal_cube.py --polarisation VV --mode IW --orbit ascending --start 2015-01-01")
+        print("  python temporal_cube.py --start-month 2015-01 --end-month 2024-12 --output output/vv_median.tif")
+
+if __name__ == "__main__":
+    main()
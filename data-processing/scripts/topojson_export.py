@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+TopoJSON Export for NASA SAR App
+Writes vector layers (watershed, fish habitat, SAV zones) as multi-resolution
+TopoJSON for the mobile map.
+
+Shared boundaries are stored once as arcs, so adjacent polygons are simplified
+identically and no gaps or overlaps open up between them. For each zoom tier
+every arc is simplified (Douglas-Peucker) at a tolerance of a fraction of a
+screen pixel, quantized to integers at sub-pixel precision and delta-encoded.
+A manifest lists which file to load for which zoom range.
+"""
+
+import json
+import math
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString
+
+DEFAULT_ZOOMS = (4, 6, 8, 10, 12)
+TILE_SIZE = 256
+# Arc coordinates are snapped to this grid (degrees, ~1 cm) before topology is
+# built so shared boundaries match exactly despite float noise
+SNAP_PRECISION = 1e-7
+MIN_QUANTIZATION = 1_000
+MAX_QUANTIZATION = 100_000_000
+
+
+def pixel_degrees(zoom, latitude=0.0):
+    """Size of one Web Mercator screen pixel in degrees at a zoom and latitude"""
+    return 360.0 / (TILE_SIZE * 2 ** zoom) * math.cos(math.radians(latitude))
+
+
+class Topology:
+    """Lines and rings cut at junctions into deduplicated shared arcs"""
+
+    def __init__(self, precision=SNAP_PRECISION):
+        self.precision = precision
+        self.lines = []
+        self.arcs = []
+        self.line_arcs = []
+
+    def add_line(self, coords, closed):
+        """Register a ring (closed) or linestring; returns its line id"""
+        points = [
+            (round(x / self.precision) * self.precision, round(y / self.precision) * self.precision)
+            for x, y in coords
+        ]
+        # Drop repeated vertices so neighbor sets stay meaningful
+        points = [p for i, p in enumerate(points) if i == 0 or p != points[i - 1]]
+        if closed and points[0] == points[-1]:
+            points = points[:-1]
+        self.lines.append((points, closed))
+        return len(self.lines) - 1
+
+    def _junctions(self):
+        # A vertex is a junction where lines meet or part ways: it is seen
+        # with more than one distinct pair of neighbors, or ends a linestring
+        neighbors = defaultdict(set)
+        junctions = set()
+        for points, closed in self.lines:
+            n = len(points)
+            for i, point in enumerate(points):
+                if closed:
+                    prev, nxt = points[i - 1], points[(i + 1) % n]
+                elif i == 0 or i == n - 1:
+                    junctions.add(point)
+                    continue
+                else:
+                    prev, nxt = points[i - 1], points[i + 1]
+                neighbors[point].add(frozenset((prev, nxt)))
+        junctions.update(p for p, pairs in neighbors.items() if len(pairs) > 1)
+        return junctions
+
+    def build(self):
+        """Cut every line into arcs and deduplicate arcs (reversed arcs are ~index)"""
+        junctions = self._junctions()
+        index = {}
+
+        def reference(arc):
+            key = tuple(arc)
+            if key in index:
+                return index[key]
+            reversed_key = key[::-1]
+            if reversed_key in index:
+                return ~index[reversed_key]
+            index[key] = len(self.arcs)
+            self.arcs.append(arc)
+            return index[key]
+
+        for points, closed in self.lines:
+            if closed:
+                cuts = [i for i, p in enumerate(points) if p in junctions]
+                # Rotate so the ring starts at a junction, or at its smallest
+                # vertex if it shares nothing, so equal rings give equal arcs
+                start = cuts[0] if cuts else points.index(min(points))
+                points = points[start:] + points[:start]
+                positions = [i for i, p in enumerate(points) if p in junctions] or [0]
+                points = points + [points[0]]
+                positions.append(len(points) - 1)
+            else:
+                positions = [i for i, p in enumerate(points) if p in junctions]
+            self.line_arcs.append([
+                reference(points[a:b + 1]) for a, b in zip(positions[:-1], positions[1:])
+            ])
+        return self
+
+
+class TopoJSONExporter:
+    def __init__(self, zooms=DEFAULT_ZOOMS, tolerance_pixels=0.5, quantization_pixels=0.25):
+        """
+        Args:
+            zooms: Zoom levels at which a new tier starts (ascending)
+            tolerance_pixels: Simplification tolerance in screen pixels at the
+                most detailed zoom of each tier
+            quantization_pixels: Coordinate grid step in screen pixels
+        """
+        self.zooms = sorted(zooms)
+        self.tolerance_pixels = tolerance_pixels
+        self.quantization_pixels = quantization_pixels
+
+    def _geometry_spec(self, geometry, topology):
+        """Register a geometry's lines; returns (type, nested line ids/points)"""
+        if geometry is None or geometry.is_empty:
+            return None
+        kind = geometry.geom_type
+        if kind == 'Polygon':
+            return kind, [topology.add_line(ring.coords, True)
+                          for ring in [geometry.exterior, *geometry.interiors]]
+        if kind == 'MultiPolygon':
+            return kind, [self._geometry_spec(part, topology)[1] for part in geometry.geoms]
+        if kind == 'LineString':
+            return kind, topology.add_line(geometry.coords, False)
+        if kind == 'MultiLineString':
+            return kind, [topology.add_line(part.coords, False) for part in geometry.geoms]
+        if kind == 'Point':
+            return kind, geometry.coords[0]
+        if kind == 'MultiPoint':
+            return kind, [part.coords[0] for part in geometry.geoms]
+        raise ValueError(f"Unsupported geometry type for TopoJSON: {kind}")
+
+    def _encode_arcs(self, arcs, tolerance, translate, scale):
+        """Simplify, quantize and delta-encode arcs; returns (encoded arcs, point counts)"""
+        encoded = []
+        counts = []
+        for arc in arcs:
+            coords = np.asarray(arc, dtype=np.float64)
+            if tolerance > 0 and len(coords) > 2:
+                coords = shapely.get_coordinates(shapely.simplify(LineString(coords), tolerance))
+            quantized = np.round((coords - translate) / scale).astype(np.int64)
+            keep = np.ones(len(quantized), dtype=bool)
+            keep[1:] = np.any(quantized[1:] != quantized[:-1], axis=1)
+            quantized = quantized[keep]
+            if len(quantized) < 2:
+                quantized = np.vstack([quantized[:1], quantized[:1]])
+            delta = np.vstack([quantized[:1], np.diff(quantized, axis=0)])
+            encoded.append(delta.tolist())
+            counts.append(len(quantized))
+        return encoded, counts
+
+    def _tier(self, specs, properties, topology, bbox, max_zoom, name):
+        """Build the TopoJSON document for one zoom tier"""
+        west, south, east, north = bbox
+        center_lat = (south + north) / 2
+        pixel = pixel_degrees(max_zoom, center_lat)
+        tolerance = pixel * self.tolerance_pixels
+        step = pixel * self.quantization_pixels
+        quantization = int(min(max(math.ceil(max(east - west, north - south) / step) + 1,
+                                   MIN_QUANTIZATION), MAX_QUANTIZATION))
+        translate = np.array([west, south])
+        scale = np.array([(east - west) / (quantization - 1) or 1.0,
+                          (north - south) / (quantization - 1) or 1.0])
+
+        encoded, counts = self._encode_arcs(topology.arcs, tolerance, translate, scale)
+        used = {}
+
+        def arc_ref(ref):
+            i = ref if ref >= 0 else ~ref
+            if i not in used:
+                used[i] = len(used)
+            return used[i] if ref >= 0 else ~used[i]
+
+        def ring_points(line_id):
+            return sum(counts[r if r >= 0 else ~r] - 1 for r in topology.line_arcs[line_id])
+
+        def polygon(rings):
+            # Rings collapsed below 3 distinct points vanish at this zoom;
+            # without its exterior the whole polygon does
+            if ring_points(rings[0]) < 3:
+                return None
+            return [[arc_ref(r) for r in topology.line_arcs[line_id]]
+                    for line_id in rings if ring_points(line_id) >= 3]
+
+        def point(coord):
+            return np.round((np.asarray(coord) - translate) / scale).astype(np.int64).tolist()
+
+        geometries = []
+        for spec, props in zip(specs, properties):
+            geometry = {'type': None}
+            if spec is not None:
+                kind, parts = spec
+                if kind == 'Polygon':
+                    arcs = polygon(parts)
+                    if arcs:
+                        geometry = {'type': kind, 'arcs': arcs}
+                elif kind == 'MultiPolygon':
+                    arcs = [p for p in (polygon(rings) for rings in parts) if p]
+                    if arcs:
+                        geometry = {'type': kind, 'arcs': arcs}
+                elif kind == 'LineString':
+                    geometry = {'type': kind, 'arcs': [arc_ref(r) for r in topology.line_arcs[parts]]}
+                elif kind == 'MultiLineString':
+                    geometry = {'type': kind, 'arcs': [[arc_ref(r) for r in topology.line_arcs[line_id]]
+                                                       for line_id in parts]}
+                elif kind == 'Point':
+                    geometry = {'type': kind, 'coordinates': point(parts)}
+                elif kind == 'MultiPoint':
+                    geometry = {'type': kind, 'coordinates': [point(c) for c in parts]}
+            if props:
+                geometry['properties'] = props
+            geometries.append(geometry)
+
+        arcs = [None] * len(used)
+        for original, new in used.items():
+            arcs[new] = encoded[original]
+
+        document = {
+            'type': 'Topology',
+            'bbox': [west, south, east, north],
+            'transform': {'scale': scale.tolist(), 'translate': translate.tolist()},
+            'objects': {name: {'type': 'GeometryCollection', 'geometries': geometries}},
+            'arcs': arcs,
+        }
+        return document, tolerance, quantization
+
+    def export(self, gdf, output_dir, name):
+        """
+        Export a GeoDataFrame (EPSG:4326) as one TopoJSON file per zoom tier
+
+        Args:
+            gdf: Features in WGS84
+            output_dir: Directory for `<name>_z<zoom>.topojson` files
+            name: Layer name (TopoJSON object name and file prefix)
+
+        Returns:
+            (manifest dict, manifest path)
+        """
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        topology = Topology()
+        specs = [self._geometry_spec(geometry, topology) for geometry in gdf.geometry]
+        topology.build()
+        properties = json.loads(gdf.drop(columns=gdf.geometry.name).to_json(orient='records', date_format='iso'))
+        bbox = [float(v) for v in gdf.total_bounds]
+
+        print(f"   🧩 Topology: {len(topology.lines)} lines → {len(topology.arcs)} shared arcs")
+
+        tiers = []
+        for i, zoom in enumerate(self.zooms):
+            max_zoom = self.zooms[i + 1] - 1 if i + 1 < len(self.zooms) else zoom
+            document, tolerance, quantization = self._tier(specs, properties, topology, bbox, max_zoom, name)
+            path = output_dir / f"{name}_z{zoom}.topojson"
+            with open(path, 'w') as f:
+                json.dump(document, f, separators=(',', ':'))
+            size = path.stat().st_size
+            tiers.append({
+                'min_zoom': zoom,
+                'max_zoom': max_zoom if i + 1 < len(self.zooms) else None,
+                'file': path.name,
+                'tolerance_degrees': tolerance,
+                'quantization': quantization,
+                'arcs': len(document['arcs']),
+                'bytes': size,
+            })
+            print(f"   ✅ z{zoom}+: {len(document['arcs'])} arcs, {size / 1024:.1f} KB → {path}")
+
+        manifest = {
+            'name': name,
+            'object': name,
+            'format': 'topojson',
+            'bbox': bbox,
+            'features': len(gdf),
+            'tiers': tiers,
+        }
+        manifest_path = output_dir / f"{name}_topojson_manifest.json"
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest, manifest_path
@@ -0,0 +1,200 @@
+"""Spatial publish/subscribe alerts for new oil detections
+
+Clients (e.g. harbor authorities) register an AOI polygon and thresholds and
+receive pushes over WebSocket or Server-Sent Events whenever newly ingested
+detections fall inside their zone.
+
+Subscription geometries are held in an STR-packed R-tree (shapely STRtree).
+A burst of detections is matched in one vectorized bulk query, which returns
+(detection, subscription) candidate pairs from bounding-box pruning followed
+by an exact point-in-polygon test. Threshold filters then run only on those
+pairs, so fan-out cost grows with the number of actual matches rather than
+with the number of subscribers. The tree is immutable and is rebuilt lazily
+on the first match after subscriptions change.
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import threading
+from datetime import datetime
+
+import numpy as np
+import shapely
+from shapely.geometry import shape, box, mapping
+from shapely.strtree import STRtree
+
+ALERT_SUBSCRIPTIONS_FILE = os.getenv("ALERT_SUBSCRIPTIONS_FILE", "alert_subscriptions.json")
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "1000"))
+
+
+class Subscription:
+    """An AOI polygon with detection thresholds"""
+
+    def __init__(self, geometry, max_vv=-22, min_confidence=0.0, oil_only=True,
+                 name=None, id=None, created_at=None):
+        """
+        Args:
+            geometry: GeoJSON Polygon/MultiPolygon dict or "west,south,east,north"
+            max_vv: Only alert on detections with VV backscatter at or below this (dB)
+            min_confidence: Only alert on detections with at least this confidence
+            oil_only: Only alert on oil candidates
+            name: Optional label (e.g. "Port of Baltimore")
+        """
+        if isinstance(geometry, str):
+            geometry = mapping(box(*[float(x) for x in geometry.split(',')]))
+        self.geometry = shape(geometry)
+        if self.geometry.geom_type not in ("Polygon", "MultiPolygon") or not self.geometry.is_valid:
+            raise ValueError("Subscription geometry must be a valid Polygon or MultiPolygon")
+        shapely.prepare(self.geometry)
+        self.id = id or uuid.uuid4().hex
+        self.name = name
+        self.max_vv = max_vv
+        self.min_confidence = min_confidence
+        self.oil_only = oil_only
+        self.created_at = created_at or datetime.now().isoformat()
+
+    def accepts(self, detection):
+        """Check a detection that lies inside the AOI against the thresholds"""
+        if self.oil_only and not detection.get("oil_candidate", True):
+            return False
+        vv = detection.get("vv")
+        if self.max_vv is not None and vv is not None and vv > self.max_vv:
+            return False
+        return detection.get("confidence", 1.0) >= self.min_confidence
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "geometry": mapping(self.geometry),
+            "max_vv": self.max_vv,
+            "min_confidence": self.min_confidence,
+            "oil_only": self.oil_only,
+            "created_at": self.created_at,
+        }
+
+
+class SubscriptionIndex:
+    """Subscriptions with an R-tree over their geometries"""
+
+    def __init__(self, path=ALERT_SUBSCRIPTIONS_FILE):
+        self.path = path
+        self.subscriptions = {}
+        self.lock = threading.Lock()
+        self._tree = None
+        self._tree_subscriptions = []
+        if path and os.path.exists(path):
+            with open(path, 'r') as f:
+                for data in json.load(f):
+                    subscription = Subscription(**data)
+                    self.subscriptions[subscription.id] = subscription
+            print(f"✓ Loaded {len(self.subscriptions)} alert subscriptions from {path}")
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump([s.to_dict() for s in self.subscriptions.values()], f)
+        os.replace(tmp_path, self.path)
+
+    def add(self, subscription):
+        with self.lock:
+            self.subscriptions[subscription.id] = subscription
+            self._tree = None
+            self._save()
+        return subscription
+
+    def remove(self, subscription_id):
+        with self.lock:
+            removed = self.subscriptions.pop(subscription_id, None)
+            if removed is not None:
+                self._tree = None
+                self._save()
+        return removed
+
+    def get(self, subscription_id):
+        return self.subscriptions.get(subscription_id)
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def _snapshot(self):
+        """Current (tree, subscriptions) pair, rebuilding the tree if stale"""
+        with self.lock:
+            if self._tree is None and self.subscriptions:
+                self._tree_subscriptions = list(self.subscriptions.values())
+                self._tree = STRtree([s.geometry for s in self._tree_subscriptions])
+            return self._tree, self._tree_subscriptions
+
+    def match(self, detections):
+        """Match a batch of detections against all subscriptions
+
+        Args:
+            detections: List of dicts with lon, lat and optional vv, confidence,
+                oil_candidate, date
+
+        Returns:
+            Dict mapping subscription id to its list of matching detections
+        """
+        tree, subscriptions = self._snapshot()
+        if tree is None or not detections:
+            return {}
+
+        points = shapely.points(
+            np.array([d["lon"] for d in detections], dtype=np.float64),
+            np.array([d["lat"] for d in detections], dtype=np.float64),
+        )
+        # Bulk R-tree query: bbox pruning then exact containment per candidate pair
+        detection_idx, subscription_idx = tree.query(points, predicate="within")
+
+        matches = {}
+        for d, s in zip(detection_idx, subscription_idx):
+            subscription = subscriptions[s]
+            if subscription.accepts(detections[d]):
+                matches.setdefault(subscription.id, []).append(detections[d])
+        return matches
+
+
+class AlertBroker:
+    """Fans matched detections out to connected WebSocket/SSE clients"""
+
+    def __init__(self, queue_size=ALERT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.listeners = {}
+
+    def connect(self, subscription_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.listeners.setdefault(subscription_id, set()).add(queue)
+        return queue
+
+    def disconnect(self, subscription_id, queue):
+        queues = self.listeners.get(subscription_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.listeners[subscription_id]
+
+    def publish(self, matches):
+        """Queue one alert per subscription; must run on the event loop
+
+        Returns:
+            Number of client connections notified
+        """
+        notified = 0
+        for subscription_id, detections in matches.items():
+            event = {
+                "subscription_id": subscription_id,
+                "detections": detections,
+                "count": len(detections),
+                "published_at": datetime.now().isoformat(),
+            }
+            for queue in self.listeners.get(subscription_id, ()):
+                if queue.full():
+                    # Slow consumer: drop its oldest alert rather than block ingestion
+                    queue.get_nowait()
+                queue.put_nowait(event)
+                notified += 1
+        return notified
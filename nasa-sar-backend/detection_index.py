@@ -0,0 +1,350 @@
+"""Detection point index backed by memory-mapped binary snapshots
+
+The oil detection CSVs in assets/data are parsed once into a set of flat
+numpy arrays:
+
+- point columns (lon, lat, vv, vh, oil flag) sorted by acquisition date
+- date index: unique dates and offsets into the sorted point arrays
+- per-date aggregates (points, oil candidates, VV mean/min/max)
+- KD-tree node arrays (point ranges, children, bounding boxes) over lon/lat
+
+The arrays are written as a versioned snapshot directory of `.npy` files
+named after the format version and the hash of the source CSVs. On startup
+the snapshot is opened with `mmap_mode='r'`, so a fresh worker is ready
+without parsing any CSV and all workers on a host share the same pages
+through the OS page cache. The snapshot is rebuilt only when the source
+data hash (or the format version) changes.
+"""
+
+import os
+import csv
+import json
+import heapq
+import shutil
+import hashlib
+from datetime import date, datetime
+
+import numpy as np
+
+DETECTIONS_CSV = os.getenv(
+    "DETECTIONS_CSV",
+    os.path.join(os.path.dirname(__file__), "..", "assets", "data", "SAR_with_NASA_POWER_full.csv")
+)
+INDEX_SNAPSHOT_DIR = os.getenv("INDEX_SNAPSHOT_DIR", "index_snapshot")
+
+FORMAT_VERSION = 1
+KD_LEAF_SIZE = 32
+EPOCH = date(1970, 1, 1)
+
+POINT_ARRAYS = ("days", "lon", "lat", "vv", "vh", "oil")
+ARRAYS = POINT_ARRAYS + (
+    "date_values", "date_offsets",
+    "agg_points", "agg_oil", "agg_vv_mean", "agg_vv_min", "agg_vv_max",
+    "kd_perm", "kd_start", "kd_end", "kd_left", "kd_right", "kd_bbox",
+)
+
+
+def source_hash(paths):
+    """SHA-256 over the contents of the source CSVs"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def to_days(date_string):
+    return (datetime.strptime(date_string[:10], '%Y-%m-%d').date() - EPOCH).days
+
+
+def from_days(days):
+    return date.fromordinal(EPOCH.toordinal() + int(days)).isoformat()
+
+
+def _parse_csvs(paths):
+    """Read detection points from the CSVs (column names are case-insensitive)"""
+    columns = {name: [] for name in POINT_ARRAYS}
+    for path in paths:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                row = {k.lower(): v for k, v in row.items() if k}
+                try:
+                    columns["days"].append(to_days(row["date"]))
+                    columns["lon"].append(float(row["longitude"]))
+                    columns["lat"].append(float(row["latitude"]))
+                    columns["vv"].append(float(row.get("vv") or "nan"))
+                    columns["vh"].append(float(row.get("vh") or "nan"))
+                    columns["oil"].append(int(float(row.get("oil_candidate") or 0)))
+                except (KeyError, ValueError):
+                    continue
+
+    return {
+        "days": np.array(columns["days"], dtype=np.int32),
+        "lon": np.array(columns["lon"], dtype=np.float64),
+        "lat": np.array(columns["lat"], dtype=np.float64),
+        "vv": np.array(columns["vv"], dtype=np.float32),
+        "vh": np.array(columns["vh"], dtype=np.float32),
+        "oil": np.array(columns["oil"], dtype=np.uint8),
+    }
+
+
+def _build_kdtree(lon, lat, leaf_size=KD_LEAF_SIZE):
+    """Build KD-tree node arrays; points of node i are kd_perm[start[i]:end[i]]"""
+    perm = np.arange(len(lon), dtype=np.int32)
+    starts, ends, lefts, rights, bboxes = [], [], [], [], []
+
+    def new_node(start, end):
+        idx = perm[start:end]
+        starts.append(start)
+        ends.append(end)
+        lefts.append(-1)
+        rights.append(-1)
+        if len(idx):
+            bboxes.append((lon[idx].min(), lat[idx].min(), lon[idx].max(), lat[idx].max()))
+        else:
+            bboxes.append((np.inf, np.inf, -np.inf, -np.inf))
+        return len(starts) - 1
+
+    stack = [new_node(0, len(perm))]
+    while stack:
+        node = stack.pop()
+        start, end = starts[node], ends[node]
+        if end - start <= leaf_size:
+            continue
+        west, south, east, north = bboxes[node]
+        coords = lon if (east - west) >= (north - south) else lat
+        idx = perm[start:end]
+        order = np.argsort(coords[idx], kind='stable')
+        perm[start:end] = idx[order]
+        mid = (start + end) // 2
+        lefts[node] = new_node(start, mid)
+        rights[node] = new_node(mid, end)
+        stack.extend((lefts[node], rights[node]))
+
+    return {
+        "kd_perm": perm,
+        "kd_start": np.array(starts, dtype=np.int32),
+        "kd_end": np.array(ends, dtype=np.int32),
+        "kd_left": np.array(lefts, dtype=np.int32),
+        "kd_right": np.array(rights, dtype=np.int32),
+        "kd_bbox": np.array(bboxes, dtype=np.float64).reshape(-1, 4),
+    }
+
+
+def build_arrays(paths):
+    """Parse the CSVs and build every index array"""
+    points = _parse_csvs(paths)
+    order = np.lexsort((points["lat"], points["lon"], points["days"]))
+    arrays = {name: values[order] for name, values in points.items()}
+
+    date_values, date_offsets = np.unique(arrays["days"], return_index=True)
+    date_offsets = np.append(date_offsets, len(arrays["days"])).astype(np.int64)
+    arrays["date_values"] = date_values.astype(np.int32)
+    arrays["date_offsets"] = date_offsets
+
+    starts = date_offsets[:-1]
+    counts = np.diff(date_offsets)
+    vv = arrays["vv"].astype(np.float64)
+    finite = np.isfinite(vv)
+    vv_count = np.add.reduceat(finite.astype(np.int64), starts) if len(starts) else np.array([])
+    vv_sum = np.add.reduceat(np.where(finite, vv, 0), starts) if len(starts) else np.array([])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        arrays["agg_vv_mean"] = (vv_sum / vv_count).astype(np.float32)
+    arrays["agg_points"] = counts.astype(np.int32)
+    arrays["agg_oil"] = (np.add.reduceat(arrays["oil"].astype(np.int32), starts)
+                         if len(starts) else np.array([], dtype=np.int32)).astype(np.int32)
+    arrays["agg_vv_min"] = (np.fmin.reduceat(arrays["vv"], starts)
+                            if len(starts) else np.array([], dtype=np.float32))
+    arrays["agg_vv_max"] = (np.fmax.reduceat(arrays["vv"], starts)
+                            if len(starts) else np.array([], dtype=np.float32))
+
+    arrays.update(_build_kdtree(arrays["lon"], arrays["lat"]))
+    return arrays
+
+
+class DetectionIndex:
+    """Read-only detection index over memory-mapped snapshot arrays"""
+
+    def __init__(self, arrays, meta):
+        self.arrays = arrays
+        self.meta = meta
+        for name, values in arrays.items():
+            setattr(self, name, values)
+
+    @classmethod
+    def load(cls, source_paths=None, snapshot_dir=INDEX_SNAPSHOT_DIR):
+        """Open the snapshot for the current source data, building it if needed
+
+        Args:
+            source_paths: Detection CSV paths (default: DETECTIONS_CSV, comma-separated)
+            snapshot_dir: Directory holding versioned snapshots
+        """
+        if source_paths is None:
+            source_paths = [p for p in DETECTIONS_CSV.split(',') if p]
+        source_paths = [os.path.abspath(p) for p in source_paths]
+        missing = [p for p in source_paths if not os.path.exists(p)]
+        if missing:
+            raise FileNotFoundError(f"Detection CSV not found: {', '.join(missing)}")
+
+        digest = source_hash(source_paths)
+        name = f"v{FORMAT_VERSION}-{digest[:16]}"
+        path = os.path.join(snapshot_dir, name)
+
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            cls.build_snapshot(source_paths, snapshot_dir, name, digest)
+
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+            for name in ARRAYS
+        }
+        print(f"✓ Detection index mapped from {path}: {meta['points']} points, {meta['dates']} dates")
+        return cls(arrays, meta)
+
+    @staticmethod
+    def build_snapshot(source_paths, snapshot_dir, name, digest):
+        """Write a snapshot atomically and remove snapshots of older data"""
+        print(f"🔨 Building detection index snapshot {name}...")
+        os.makedirs(snapshot_dir, exist_ok=True)
+        arrays = build_arrays(source_paths)
+
+        tmp_path = os.path.join(snapshot_dir, f".{name}.{os.getpid()}.tmp")
+        os.makedirs(tmp_path, exist_ok=True)
+        for array_name in ARRAYS:
+            np.save(os.path.join(tmp_path, f"{array_name}.npy"), np.ascontiguousarray(arrays[array_name]))
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "source_hash": digest,
+            "sources": source_paths,
+            "points": int(len(arrays["days"])),
+            "dates": int(len(arrays["date_values"])),
+            "kd_nodes": int(len(arrays["kd_start"])),
+            "built_at": datetime.now().isoformat(),
+        }
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        final_path = os.path.join(snapshot_dir, name)
+        try:
+            os.rename(tmp_path, final_path)
+        except OSError:
+            # Another worker published the same snapshot first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        for entry in os.listdir(snapshot_dir):
+            if entry != name and entry.startswith("v") and not entry.startswith(f".{name}"):
+                shutil.rmtree(os.path.join(snapshot_dir, entry), ignore_errors=True)
+        print(f"   ✅ Snapshot written: {meta['points']} points, {meta['kd_nodes']} KD-tree nodes")
+
+    def _date_slice(self, start_date=None, end_date=None):
+        """Point range [lo, hi) covering start_date..end_date inclusive"""
+        lo_date = 0
+        hi_date = len(self.date_values)
+        if start_date:
+            lo_date = int(np.searchsorted(self.date_values, to_days(start_date), side='left'))
+        if end_date:
+            hi_date = int(np.searchsorted(self.date_values, to_days(end_date), side='right'))
+        if hi_date <= lo_date:
+            return 0, 0, lo_date, lo_date
+        return int(self.date_offsets[lo_date]), int(self.date_offsets[hi_date]), lo_date, hi_date
+
+    def _point(self, i):
+        return {
+            "date": from_days(self.days[i]),
+            "lon": float(self.lon[i]),
+            "lat": float(self.lat[i]),
+            "vv": None if np.isnan(self.vv[i]) else float(self.vv[i]),
+            "vh": None if np.isnan(self.vh[i]) else float(self.vh[i]),
+            "oil_candidate": bool(self.oil[i]),
+        }
+
+    def query(self, bounds=None, start_date=None, end_date=None, oil_only=False, limit=1000):
+        """Points within a bounding box and date range
+
+        Args:
+            bounds: "west,south,east,north" (None = everywhere)
+            start_date: First date (YYYY-MM-DD), inclusive
+            end_date: Last date (YYYY-MM-DD), inclusive
+            oil_only: Only return oil candidates
+            limit: Maximum number of points returned
+
+        Returns:
+            (total matching points, list of up to `limit` points ordered by date)
+        """
+        lo, hi, _, _ = self._date_slice(start_date, end_date)
+        if bounds is None:
+            idx = np.arange(lo, hi)
+        else:
+            west, south, east, north = [float(x) for x in bounds.split(',')]
+            idx = self._bbox_indices(west, south, east, north)
+            idx = idx[(idx >= lo) & (idx < hi)]
+        if oil_only:
+            idx = idx[self.oil[idx] == 1]
+        idx = np.sort(idx)
+        return len(idx), [self._point(i) for i in idx[:max(limit, 0)]]
+
+    def _bbox_indices(self, west, south, east, north):
+        """Point indices inside a bounding box, pruning KD-tree nodes by bbox"""
+        found = []
+        stack = [0] if len(self.kd_start) else []
+        while stack:
+            node = stack.pop()
+            n_west, n_south, n_east, n_north = self.kd_bbox[node]
+            if n_west > east or n_east < west or n_south > north or n_north < south:
+                continue
+            idx = self.kd_perm[self.kd_start[node]:self.kd_end[node]]
+            if n_west >= west and n_east <= east and n_south >= south and n_north <= north:
+                found.append(np.asarray(idx))
+            elif self.kd_left[node] < 0:
+                inside = ((self.lon[idx] >= west) & (self.lon[idx] <= east) &
+                          (self.lat[idx] >= south) & (self.lat[idx] <= north))
+                found.append(np.asarray(idx[inside]))
+            else:
+                stack.extend((int(self.kd_left[node]), int(self.kd_right[node])))
+        return np.concatenate(found) if found else np.array([], dtype=np.int32)
+
+    def nearest(self, lon, lat, k=10):
+        """The k points nearest to (lon, lat), in degrees, closest first"""
+        if k < 1:
+            return []
+        results = []  # max-heap of (-distance², index)
+        queue = [(0.0, 0)] if len(self.kd_start) else []
+        while queue:
+            bound, node = heapq.heappop(queue)
+            if len(results) == k and bound > -results[0][0]:
+                break
+            if self.kd_left[node] < 0:
+                idx = self.kd_perm[self.kd_start[node]:self.kd_end[node]]
+                dist = (self.lon[idx] - lon) ** 2 + (self.lat[idx] - lat) ** 2
+                for d, i in zip(dist, idx):
+                    if len(results) < k:
+                        heapq.heappush(results, (-d, int(i)))
+                    elif d < -results[0][0]:
+                        heapq.heapreplace(results, (-d, int(i)))
+                continue
+            for child in (int(self.kd_left[node]), int(self.kd_right[node])):
+                west, south, east, north = self.kd_bbox[child]
+                dx = max(west - lon, 0, lon - east)
+                dy = max(south - lat, 0, lat - north)
+                heapq.heappush(queue, (dx * dx + dy * dy, child))
+
+        ordered = sorted((-d, i) for d, i in results)
+        return [{**self._point(i), "distance_deg": float(np.sqrt(d))} for d, i in ordered]
+
+    def timeseries(self, start_date=None, end_date=None):
+        """Precomputed per-date aggregates between two dates (inclusive)"""
+        _, _, lo_date, hi_date = self._date_slice(start_date, end_date)
+        return [
+            {
+                "date": from_days(self.date_values[i]),
+                "points": int(self.agg_points[i]),
+                "oil_candidates": int(self.agg_oil[i]),
+                "vv_mean": None if np.isnan(self.agg_vv_mean[i]) else float(self.agg_vv_mean[i]),
+                "vv_min": None if np.isnan(self.agg_vv_min[i]) else float(self.agg_vv_min[i]),
+                "vv_max": None if np.isnan(self.agg_vv_max[i]) else float(self.agg_vv_max[i]),
+            }
+            for i in range(lo_date, hi_date)
+        ]
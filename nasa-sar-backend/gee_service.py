@@ -2,11 +2,22 @@ import ee
 import json
 from datetime import datetime
 import os
+from profiling import traced, tag
+from query_planner import ee_call
+from temporal_cube import TemporalCube
+
+# VV display range (dB) used when no percentile stretch can be computed
+SAR_VIS_RANGE = (-25, 0)
+# Percentiles mapped to the ends of the SAR palette
+STRETCH_PERCENTILES = (2, 98)
+# Reduction scale (m) of the stretch; coarse is enough for a display range
+STRETCH_SCALE = 200
 
 class GEEService:
     def __init__(self):
         """Initialize Earth Engine with service account"""
         self.initialized = False
+        self.cube = TemporalCube()
         try:
             # Check if running in service account mode or local development
             service_account_file = 'gee-service-account.json'
@@ -40,13 +51,64 @@ class GEEService:
         """Check if GEE is properly initialized"""
         return self.initialized
 
-    def get_sar_tiles(self, start_date, end_date, bounds):
+    def _cube_median(self, region_id, start_date, end_date, coords=None, region_bounds=None):
+        """VV median from the region's monthly cube, or None to use raw scenes
+
+        Cube assets are clipped to the region's bounds, so a request reaching
+        outside them (given as `coords` [west, south, east, north]) is
+        answered from the raw scenes instead.
+        """
+        if not region_id or not self.cube.enabled():
+            return None
+        if coords is not None and region_bounds:
+            west, south, east, north = (float(x) for x in region_bounds.split(','))
+            if not (west <= coords[0] and south <= coords[1] and coords[2] <= east and coords[3] <= north):
+                tag(composite='outside_cube')
+                return None
+        composite = self.cube.composite(region_id, start_date, end_date, 'median')
+        tag(composite='cube' if composite is not None else 'raw')
+        return composite
+
+    def _stretch(self, image, band, roi, percentiles=STRETCH_PERCENTILES, default=SAR_VIS_RANGE):
+        """(low, high) percentile display range of a band over a region
+
+        Earth Engine's percentile reducer is histogram based, so this is a
+        single server-side pass at a coarse scale (bestEffort coarsens it
+        further for large regions). Falls back to `default` if the region
+        has no data or the reduction fails.
+        """
+        low, high = percentiles
+        try:
+            values = image.select(band).reduceRegion(
+                reducer=ee.Reducer.percentile([low, high]), geometry=roi, scale=STRETCH_SCALE,
+                bestEffort=True, maxPixels=1e7, tileScale=4
+            ).getInfo()
+        except ee.EEException as e:
+            print(f"⚠️  Percentile stretch failed, using {default}: {e}")
+            tag(stretch='default')
+            return default
+        lower, upper = values.get(f"{band}_p{low:g}"), values.get(f"{band}_p{high:g}")
+        if lower is None or upper is None or not upper > lower:
+            tag(stretch='default')
+            return default
+        tag(stretch='percentile')
+        return lower, upper
+
+    @traced
+    @ee_call
+    def get_sar_tiles(self, start_date, end_date, bounds, region_id=None, stretch=False,
+                      region_bounds=None):
         """Generate Sentinel-1 SAR tile URL
 
         Args:
             start_date: Start date string (YYYY-MM-DD)
             end_date: End date string (YYYY-MM-DD)
             bounds: Comma-separated bounds "west,south,east,north"
+            region_id: Region whose monthly cube may answer month-aligned ranges
+            region_bounds: The region's bounds; the cube is only used for
+                requests inside them
+            stretch: Map the 2nd-98th VV percentile of the area to the palette
+                instead of the fixed SAR_VIS_RANGE
 
         Returns:
             Tile URL string for use in mapping applications
@@ -55,21 +117,24 @@ class GEEService:
         coords = [float(x) for x in bounds.split(',')]
         roi = ee.Geometry.Rectangle(coords)
 
-        # Load Sentinel-1 SAR data
-        sar = (ee.ImageCollection('COPERNICUS/S1_GRD')
-            .filterBounds(roi)
-            .filterDate(start_date, end_date)
-            .filter(ee.Filter.eq('instrumentMode', 'IW'))
-            .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-            .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH'))
-            .select(['VV', 'VH'])
-            .median())  # Median composite to reduce noise
+        # Load Sentinel-1 SAR data (pre-aggregated cube when available)
+        sar = self._cube_median(region_id, start_date, end_date, coords, region_bounds)
+        if sar is None:
+            sar = (ee.ImageCollection('COPERNICUS/S1_GRD')
+                .filterBounds(roi)
+                .filterDate(start_date, end_date)
+                .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH'))
+                .select(['VV', 'VH'])
+                .median())  # Median composite to reduce noise
 
         # Visualization parameters for SAR backscatter
+        vis_min, vis_max = self._stretch(sar, 'VV', roi) if stretch else SAR_VIS_RANGE
         vis_params = {
             'bands': ['VV'],
-            'min': -25,
-            'max': 0,
+            'min': vis_min,
+            'max': vis_max,
             'palette': ['000000', '0000FF', '00FFFF', 'FFFF00', 'FF0000']  # Black to red
         }
 
@@ -77,7 +142,10 @@ class GEEService:
         map_id = sar.getMapId(vis_params)
         return map_id['tile_fetcher'].url_format
 
-    def get_oil_detection_tiles(self, start_date, end_date, bounds):
+    @traced
+    @ee_call
+    def get_oil_detection_tiles(self, start_date, end_date, bounds, oil_threshold=-22,
+                                region_id=None, region_bounds=None):
         """Generate oil detection overlay tiles
 
         Uses VV backscatter threshold method:
@@ -88,6 +156,10 @@ class GEEService:
             start_date: Start date string (YYYY-MM-DD)
             end_date: End date string (YYYY-MM-DD)
             bounds: Comma-separated bounds "west,south,east,north"
+            oil_threshold: VV backscatter threshold in dB
+            region_id: Region whose monthly cube may answer month-aligned ranges
+            region_bounds: The region's bounds; the cube is only used for
+                requests inside them
 
         Returns:
             Tile URL for oil detection overlay
@@ -96,16 +168,17 @@ class GEEService:
         roi = ee.Geometry.Rectangle(coords)
 
         # Load SAR and detect oil (VV < -22 dB threshold)
-        sar = (ee.ImageCollection('COPERNICUS/S1_GRD')
-            .filterBounds(roi)
-            .filterDate(start_date, end_date)
-            .filter(ee.Filter.eq('instrumentMode', 'IW'))
-            .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-            .select('VV')
-            .median())
+        sar = self._cube_median(region_id, start_date, end_date, coords, region_bounds)
+        if sar is None:
+            sar = (ee.ImageCollection('COPERNICUS/S1_GRD')
+                .filterBounds(roi)
+                .filterDate(start_date, end_date)
+                .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                .select('VV')
+                .median())
 
         # Oil detection mask (low backscatter = potential oil)
-        oil_threshold = -22  # dB
         oil_mask = sar.lt(oil_threshold)
 
         # Visualization: Red for detected oil
@@ -118,11 +191,15 @@ class GEEService:
         map_id = oil_mask.selfMask().getMapId(vis_params)
         return map_id['tile_fetcher'].url_format
 
-    def get_available_dates(self, bounds):
+    @traced
+    @ee_call
+    def get_available_dates(self, bounds, start_date=None, end_date=None):
         """Get list of available Sentinel-1 acquisition dates
 
         Args:
             bounds: Comma-separated bounds "west,south,east,north"
+            start_date: Optional start date string (YYYY-MM-DD)
+            end_date: Optional end date string (YYYY-MM-DD, exclusive)
 
         Returns:
             List of date strings (YYYY-MM-DD) sorted chronologically
@@ -134,6 +211,8 @@ class GEEService:
         collection = (ee.ImageCollection('COPERNICUS/S1_GRD')
             .filterBounds(roi)
             .filter(ee.Filter.eq('instrumentMode', 'IW')))
+        if start_date and end_date:
+            collection = collection.filterDate(start_date, end_date)
 
         # Get acquisition dates
         dates = collection.aggregate_array('system:time_start').getInfo()
@@ -146,7 +225,57 @@ class GEEService:
 
         return date_strings
 
-    def get_teammate_oil_detection_tiles(self, start_date, end_date, bounds):
+    @traced
+    @ee_call
+    def get_sar_statistics(self, start_date, end_date, bounds, scale=100):
+        """Get mergeable VV backscatter statistics over all scenes in a range
+
+        Args:
+            start_date: Start date string (YYYY-MM-DD)
+            end_date: End date string (YYYY-MM-DD, exclusive)
+            bounds: Comma-separated bounds "west,south,east,north"
+            scale: Reduction scale in meters
+
+        Returns:
+            Dict with pixel-observation count, sum, sum_sq, min and max (dB)
+        """
+        coords = [float(x) for x in bounds.split(',')]
+        roi = ee.Geometry.Rectangle(coords)
+
+        vv = (ee.ImageCollection('COPERNICUS/S1_GRD')
+            .filterBounds(roi)
+            .filterDate(start_date, end_date)
+            .filter(ee.Filter.eq('instrumentMode', 'IW'))
+            .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+            .select('VV'))
+
+        # Per-pixel partial aggregates over time, then summed over the region
+        partials = ee.Image.cat([
+            vv.count().rename('count'),
+            vv.sum().rename('sum'),
+            vv.map(lambda image: image.pow(2)).sum().rename('sum_sq'),
+        ])
+        totals = partials.reduceRegion(
+            reducer=ee.Reducer.sum(), geometry=roi, scale=scale, maxPixels=1e10, tileScale=4
+        )
+        extremes = ee.Image.cat([vv.min().rename('min'), vv.max().rename('max')]).reduceRegion(
+            reducer=ee.Reducer.minMax(), geometry=roi, scale=scale, maxPixels=1e10, tileScale=4
+        )
+        result = ee.Dictionary(totals).combine(extremes).getInfo()
+
+        return {
+            'count': result.get('count') or 0,
+            'sum': result.get('sum') or 0.0,
+            'sum_sq': result.get('sum_sq') or 0.0,
+            'min': result.get('min_min'),
+            'max': result.get('max_max'),
+        }
+
+    @traced
+    @ee_call
+    def get_teammate_oil_detection_tiles(self, start_date, end_date, bounds,
+                                         oil_threshold=-22, water_mask=None, region_id=None,
+                                         region_bounds=None):
         """Generate oil detection tiles using teammate's JRC Water Mask method
 
         This implementation uses:
@@ -158,6 +287,12 @@ class GEEService:
             start_date: Start date string (YYYY-MM-DD)
             end_date: End date string (YYYY-MM-DD)
             bounds: Comma-separated bounds "west,south,east,north"
+            oil_threshold: VV backscatter threshold in dB
+            water_mask: Water mask source {"asset", "band", "year", "min_class"}
+                (defaults to JRC yearly history, 2021, waterClass >= 3)
+            region_id: Region whose monthly cube may answer month-aligned ranges
+            region_bounds: The region's bounds; the cube is only used for
+                requests inside them
 
         Returns:
             Tile URL for oil detection with JRC water masking
@@ -165,29 +300,32 @@ class GEEService:
         coords = [float(x) for x in bounds.split(',')]
         roi = ee.Geometry.Rectangle(coords)
 
+        water_mask = water_mask or {}
+        year = water_mask.get('year', 2021)
+
         # Load JRC Global Surface Water (2021 as baseline year)
         # waterClass >= 3 means permanent/seasonal water
-        jrc_water = (ee.ImageCollection('JRC/GSW1_4/YearlyHistory')
-            .filterDate('2021-01-01', '2021-12-31')
-            .select('waterClass')
+        jrc_water = (ee.ImageCollection(water_mask.get('asset', 'JRC/GSW1_4/YearlyHistory'))
+            .filterDate(f'{year}-01-01', f'{year}-12-31')
+            .select(water_mask.get('band', 'waterClass'))
             .mosaic()
             .clip(roi)
-            .gte(3))  # Permanent/seasonal water areas
-
-        # Load Sentinel-1 SAR data
-        sar_col = (ee.ImageCollection('COPERNICUS/S1_GRD')
-            .filterBounds(roi)
-            .filterDate(start_date, end_date)
-            .filter(ee.Filter.eq('instrumentMode', 'IW'))
-            .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-            .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')))
-
-        # Get median composite
-        sar = sar_col.select('VV').median()
+            .gte(water_mask.get('min_class', 3)))  # Permanent/seasonal water areas
+
+        # Get median composite (pre-aggregated cube when available)
+        sar = self._cube_median(region_id, start_date, end_date, coords, region_bounds)
+        if sar is None:
+            # Load Sentinel-1 SAR data
+            sar_col = (ee.ImageCollection('COPERNICUS/S1_GRD')
+                .filterBounds(roi)
+                .filterDate(start_date, end_date)
+                .filter(ee.Filter.eq('instrumentMode', 'IW'))
+                .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+                .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')))
+            sar = sar_col.select('VV').median()
 
         # Oil detection: VV < -22 dB AND in water areas
         # This reduces false positives on land
-        oil_threshold = -22  # dB
         oil_mask = sar.lt(oil_threshold).And(jrc_water)
 
         # Visualization: Red for detected oil
@@ -1,8 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from typing import List, Optional, Union
 from datetime import datetime
 from gee_service import GEEService
+from regions import RegionRegistry
+from detection_index import DetectionIndex
+from query_planner import QueryPlanner
+from alerts import Subscription, SubscriptionIndex, AlertBroker
+import json
+import asyncio
 import os
+import profiling
 
 app = FastAPI(title="NASA SAR Tile Server")
 
@@ -14,7 +25,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+profiling.install(app)
+
 gee = GEEService()
+regions = RegionRegistry()
+planner = QueryPlanner(gee)
+subscriptions = SubscriptionIndex()
+alert_broker = AlertBroker()
+
+try:
+    detections = DetectionIndex.load()
+except Exception as e:
+    detections = None
+    print(f"⚠️  Detection index unavailable: {str(e)}")
+
+REGION_PRELOAD = os.getenv("REGION_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+
+def get_region(region_id):
+    """Look up a region or fail with 404"""
+    try:
+        return regions.get(region_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.on_event("startup")
+async def preload_regions():
+    """Build each region's date index and stats in the background"""
+    if REGION_PRELOAD:
+        for region in regions:
+            region.schedule_refresh(planner)
+
+
+@app.on_event("shutdown")
+def shutdown_regions():
+    regions.shutdown()
+    planner.shutdown()
+
 
 @app.get("/")
 def root():
@@ -24,98 +72,396 @@ def root():
         "endpoints": [
             "/tiles/sar",
             "/tiles/oil-detection",
-            "/dates/available"
+            "/dates/available",
+            "/statistics/sar",
+            "/regions",
+            "/detections",
+            "/alerts/subscriptions"
         ]
     }
 
+@app.get("/regions")
+def list_regions():
+    """List configured regions with their defaults and precomputed stats"""
+    return {"regions": [region.to_dict() for region in regions]}
+
+@app.get("/regions/{region_id}")
+def get_region_info(region_id: str):
+    """Get a region's configuration, precomputed stats and cache usage"""
+    return get_region(region_id).to_dict()
+
+@app.post("/regions/{region_id}/refresh")
+async def refresh_region(region_id: str, request: Request):
+    """Rebuild a region's date index and stats on its own refresh worker"""
+    profiling.check_admin(request)
+    region = get_region(region_id)
+    try:
+        stats = await region.schedule_refresh(planner)
+        return {"region": region.id, "refreshed_at": region.refreshed_at, "stats": stats}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error refreshing region: {str(e)}")
+
+@app.get("/regions/{region_id}/cube")
+def get_region_cube(region_id: str):
+    """List months with pre-aggregated temporal cube assets for a region"""
+    region = get_region(region_id)
+    if not gee.cube.enabled():
+        return {"region": region.id, "enabled": False, "months": []}
+    try:
+        months = gee.cube.available_months(region.id)
+        return {"region": region.id, "enabled": True, "months": months, "count": len(months)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing temporal cube: {str(e)}")
+
+@app.post("/regions/{region_id}/cube")
+async def build_region_cube(region_id: str, start_month: str, end_month: str, request: Request):
+    """Start exports of monthly aggregates (YYYY-MM range) not built yet"""
+    profiling.check_admin(request)
+    region = get_region(region_id)
+    if not gee.cube.enabled():
+        raise HTTPException(status_code=400, detail="Set CUBE_ASSET_ROOT to enable temporal cubes")
+    try:
+        tasks = await region.background(
+            gee.cube.build, region.id, region.bounds, start_month, end_month
+        )
+        return {"region": region.id, "started": tasks, "count": len(tasks)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error building temporal cube: {str(e)}")
+
 @app.get("/tiles/sar")
-def get_sar_tiles(
-    start_date: str = "2024-01-01",
-    end_date: str = "2024-12-31",
-    bounds: str = "-76.5,37.5,-75.5,39.5"  # Chesapeake Bay default
+async def get_sar_tiles(
+    start_date: str = None,
+    end_date: str = None,
+    bounds: str = None,
+    region: str = None,
+    stretch: bool = False
 ):
     """Get SAR imagery tile URL from Earth Engine
 
     Args:
-        start_date: Start date in YYYY-MM-DD format
-        end_date: End date in YYYY-MM-DD format
-        bounds: Bounding box as "west,south,east,north"
+        start_date: Start date in YYYY-MM-DD format (default: region default)
+        end_date: End date in YYYY-MM-DD format (default: region default)
+        bounds: Bounding box as "west,south,east,north" (default: region AOI)
+        region: Region id (default: chesapeake)
+        stretch: Color range from the 2nd-98th VV percentile of the area instead
+            of the fixed -25..0 dB (one extra blocking Earth Engine reduction)
 
     Returns:
         Tile URL for Sentinel-1 SAR imagery
     """
-    print(f"🛰️  SAR Tile Request: {start_date} to {end_date}, bounds={bounds}")
+    aoi = get_region(region)
+    start_date = start_date or aoi.default_start_date
+    end_date = end_date or aoi.default_end_date
+    bounds = bounds or aoi.bounds
+    print(f"🛰️  SAR Tile Request [{aoi.id}]: {start_date} to {end_date}, bounds={bounds}")
     try:
-        tile_url = gee.get_sar_tiles(start_date, end_date, bounds)
+        tile_url = await aoi.run(
+            aoi.cached,
+            ('sar', start_date, end_date, bounds, stretch),
+            lambda: gee.get_sar_tiles(start_date, end_date, bounds, region_id=aoi.id, stretch=stretch,
+                                      region_bounds=aoi.bounds)
+        )
         print(f"✅ Generated SAR tile URL: {tile_url[:100]}...")
         return {
             "tile_url": tile_url,
             "start_date": start_date,
             "end_date": end_date,
-            "bounds": bounds
+            "bounds": bounds,
+            "region": aoi.id
         }
     except Exception as e:
         print(f"❌ Error generating SAR tiles: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating SAR tiles: {str(e)}")
 
 @app.get("/tiles/oil-detection")
-def get_oil_detection_tiles(
-    start_date: str = "2024-01-01",
-    end_date: str = "2024-12-31",
-    bounds: str = "-76.5,37.5,-75.5,39.5"
+async def get_oil_detection_tiles(
+    start_date: str = None,
+    end_date: str = None,
+    bounds: str = None,
+    region: str = None
 ):
     """Get oil spill detection overlay from Earth Engine
 
-    Uses VV backscatter threshold (< -22 dB) to detect potential oil spills
+    Uses the region's VV backscatter threshold (< -22 dB for Chesapeake Bay)
+    to detect potential oil spills
     """
+    aoi = get_region(region)
+    start_date = start_date or aoi.default_start_date
+    end_date = end_date or aoi.default_end_date
+    bounds = bounds or aoi.bounds
     try:
-        tile_url = gee.get_oil_detection_tiles(start_date, end_date, bounds)
+        tile_url = await aoi.run(
+            aoi.cached,
+            ('oil', start_date, end_date, bounds),
+            lambda: gee.get_oil_detection_tiles(
+                start_date, end_date, bounds,
+                oil_threshold=aoi.oil_threshold, region_id=aoi.id, region_bounds=aoi.bounds
+            )
+        )
         return {
             "tile_url": tile_url,
             "start_date": start_date,
-            "end_date": end_date
+            "end_date": end_date,
+            "region": aoi.id
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating oil detection tiles: {str(e)}")
 
 @app.get("/tiles/teammate-oil-detection")
-def get_teammate_oil_tiles(
-    start_date: str = "2024-01-01",
-    end_date: str = "2024-12-31",
-    bounds: str = "-77.3,36.8,-75,39.7"  # Teammate's ROI
+async def get_teammate_oil_tiles(
+    start_date: str = None,
+    end_date: str = None,
+    bounds: str = None,
+    region: str = None
 ):
     """Get oil detection overlay using teammate's JRC Water Mask method
 
     Uses JRC Global Surface Water dataset to only detect oil in
     historically water-covered areas, reducing false positives on land.
+    Defaults to the region's detection ROI (teammate's ROI for Chesapeake Bay).
     """
-    print(f"🌊 Teammate Oil Detection Request: {start_date} to {end_date}")
+    aoi = get_region(region)
+    start_date = start_date or aoi.default_start_date
+    end_date = end_date or aoi.default_end_date
+    bounds = bounds or aoi.detection_bounds
+    print(f"🌊 Teammate Oil Detection Request [{aoi.id}]: {start_date} to {end_date}")
     try:
-        tile_url = gee.get_teammate_oil_detection_tiles(start_date, end_date, bounds)
+        tile_url = await aoi.run(
+            aoi.cached,
+            ('teammate-oil', start_date, end_date, bounds),
+            lambda: gee.get_teammate_oil_detection_tiles(
+                start_date, end_date, bounds,
+                oil_threshold=aoi.oil_threshold, water_mask=aoi.water_mask,
+                region_id=aoi.id, region_bounds=aoi.bounds
+            )
+        )
         print(f"✅ Generated teammate oil detection tile URL")
         return {
             "tile_url": tile_url,
             "start_date": start_date,
             "end_date": end_date,
-            "method": "JRC Water Mask + VV < -22 dB"
+            "region": aoi.id,
+            "method": f"JRC Water Mask + VV < {aoi.oil_threshold} dB"
         }
     except Exception as e:
         print(f"❌ Error generating teammate oil detection: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating teammate oil detection: {str(e)}")
 
 @app.get("/dates/available")
-def get_available_dates(bounds: str = "-76.5,37.5,-75.5,39.5"):
-    """Get list of available SAR image dates for the region"""
+async def get_available_dates(
+    bounds: str = None,
+    region: str = None,
+    start_date: str = None,
+    end_date: str = None
+):
+    """Get list of available SAR image dates for the region
+
+    Served from the region's date index unless custom bounds or dates are
+    given; those are split into cached time-slice/tile sub-queries.
+    """
+    aoi = get_region(region)
     try:
-        dates = gee.get_available_dates(bounds)
+        custom = bounds not in (None, aoi.bounds) or start_date or end_date
+        if not custom and aoi.refreshed_at is not None:
+            profiling.tag(cache="hit")
+            dates = aoi.dates
+        else:
+            dates = await aoi.run(
+                planner.available_dates, bounds or aoi.bounds, start_date, end_date
+            )
         return {
             "dates": dates,
-            "count": len(dates)
+            "count": len(dates),
+            "region": aoi.id
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching available dates: {str(e)}")
 
+@app.get("/statistics/sar")
+async def get_sar_statistics(
+    start_date: str = None,
+    end_date: str = None,
+    bounds: str = None,
+    region: str = None,
+    scale: int = 100
+):
+    """Get VV backscatter statistics (count, mean, std, min, max) over all scenes
+
+    Large areas and long ranges are split into parallel sub-queries whose
+    results are cached individually and merged.
+    """
+    aoi = get_region(region)
+    start_date = start_date or aoi.default_start_date
+    end_date = end_date or aoi.default_end_date
+    bounds = bounds or aoi.bounds
+    try:
+        stats = await aoi.run(planner.statistics, start_date, end_date, bounds, scale)
+        return {
+            **stats,
+            "start_date": start_date,
+            "end_date": end_date,
+            "bounds": bounds,
+            "region": aoi.id
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing SAR statistics: {str(e)}")
+
+def get_detections_index():
+    if detections is None:
+        raise HTTPException(status_code=503, detail="Detection index not loaded")
+    return detections
+
+@app.get("/detections")
+def get_detections(
+    bounds: str = None,
+    start_date: str = None,
+    end_date: str = None,
+    oil_only: bool = False,
+    limit: int = Query(1000, ge=1, le=10000)
+):
+    """Get pre-processed detection points within a bounding box and date range
+
+    Args:
+        bounds: Bounding box as "west,south,east,north" (default: everywhere)
+        start_date: First date in YYYY-MM-DD format, inclusive
+        end_date: Last date in YYYY-MM-DD format, inclusive
+        oil_only: Only return oil candidates
+        limit: Maximum number of points returned
+    """
+    index = get_detections_index()
+    try:
+        total, points = index.query(bounds, start_date, end_date, oil_only, limit)
+        return {"total": total, "count": len(points), "points": points}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid query: {str(e)}")
+
+@app.get("/detections/nearest")
+def get_nearest_detections(lat: float, lon: float, k: int = Query(10, ge=1, le=1000)):
+    """Get the k detection points nearest to a location"""
+    index = get_detections_index()
+    points = index.nearest(lon, lat, k)
+    return {"count": len(points), "points": points}
+
+@app.get("/detections/timeseries")
+def get_detection_timeseries(start_date: str = None, end_date: str = None):
+    """Get per-date detection counts and VV statistics"""
+    index = get_detections_index()
+    try:
+        series = index.timeseries(start_date, end_date)
+        return {"count": len(series), "series": series}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid query: {str(e)}")
+
+class SubscriptionRequest(BaseModel):
+    geometry: Union[dict, str]  # GeoJSON Polygon or "west,south,east,north"
+    name: Optional[str] = None
+    max_vv: Optional[float] = -22
+    min_confidence: float = 0.0
+    oil_only: bool = True
+
+class Detection(BaseModel):
+    lon: float
+    lat: float
+    date: Optional[str] = None
+    vv: Optional[float] = None
+    vh: Optional[float] = None
+    confidence: float = 1.0
+    oil_candidate: bool = True
+
+class DetectionBatch(BaseModel):
+    detections: List[Detection]
+
+@app.post("/alerts/subscriptions")
+def create_subscription(body: SubscriptionRequest):
+    """Register an AOI polygon and thresholds for new-detection alerts"""
+    try:
+        subscription = subscriptions.add(Subscription(**body.dict()))
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid subscription: {str(e)}")
+    return {
+        **subscription.to_dict(),
+        "websocket": f"/alerts/ws/{subscription.id}",
+        "stream": f"/alerts/stream/{subscription.id}"
+    }
+
+@app.get("/alerts/subscriptions/{subscription_id}")
+def get_subscription(subscription_id: str):
+    subscription = subscriptions.get(subscription_id)
+    if subscription is None:
+        raise HTTPException(status_code=404, detail="Unknown subscription")
+    return subscription.to_dict()
+
+@app.delete("/alerts/subscriptions/{subscription_id}")
+def delete_subscription(subscription_id: str):
+    if subscriptions.remove(subscription_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown subscription")
+    return {"status": "deleted", "id": subscription_id}
+
+@app.post("/alerts/detections")
+async def ingest_detections(body: DetectionBatch, request: Request):
+    """Ingest new detections and push alerts to matching subscribers"""
+    profiling.check_admin(request)
+    detections = [d.dict() for d in body.detections]
+    matches = await run_in_threadpool(subscriptions.match, detections)
+    notified = alert_broker.publish(matches)
+    print(f"🚨 Ingested {len(detections)} detections: "
+          f"{len(matches)} subscriptions matched, {notified} clients notified")
+    return {
+        "ingested": len(detections),
+        "matched_subscriptions": len(matches),
+        "notified_connections": notified
+    }
+
+@app.websocket("/alerts/ws/{subscription_id}")
+async def alerts_websocket(websocket: WebSocket, subscription_id: str):
+    """Push alerts for one subscription over a WebSocket"""
+    if subscriptions.get(subscription_id) is None:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    queue = alert_broker.connect(subscription_id)
+
+    async def forward():
+        while True:
+            await websocket.send_json(await queue.get())
+
+    sender = asyncio.create_task(forward())
+    try:
+        # Clients don't send anything; receiving only detects the disconnect
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        alert_broker.disconnect(subscription_id, queue)
+
+@app.get("/alerts/stream/{subscription_id}")
+async def alerts_stream(subscription_id: str, request: Request):
+    """Push alerts for one subscription as Server-Sent Events"""
+    if subscriptions.get(subscription_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown subscription")
+    queue = alert_broker.connect(subscription_id)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                    yield f"event: detection\ndata: {json.dumps(event)}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            alert_broker.disconnect(subscription_id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 @app.get("/health")
 def health_check():
     """Health check endpoint for monitoring"""
-    return {"status": "healthy", "gee_initialized": gee.is_initialized()}
+    return {
+        "status": "healthy",
+        "gee_initialized": gee.is_initialized(),
+        "detection_index": detections.meta["source_hash"][:16] if detections else None,
+        "regions": {region.id: region.refreshed_at is not None for region in regions}
+    }
@@ -0,0 +1,277 @@
+"""Opt-in sampling profiler for live backend requests.
+
+Profiling is controlled by environment variables and is completely inert
+unless PROFILING_ENABLED is set: no middleware is installed, no sampler
+thread is started and `traced` returns the wrapped function untouched.
+
+When enabled, a fraction of requests (PROFILE_SAMPLE_RATE) - or any request
+carrying the `X-Profile: 1` header - is sampled by a background thread that
+walks the stacks of the threads serving that request. Samples are stored as
+folded stacks (the input format of flamegraph.pl / speedscope / inferno),
+keyed by route and tagged with the `GEEService` method and cache status.
+"""
+
+import hmac
+import os
+import sys
+import time
+import random
+import threading
+import functools
+import contextvars
+from collections import Counter, defaultdict
+
+from fastapi import Request, HTTPException
+from fastapi.responses import PlainTextResponse
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "5000"))
+PROFILE_HEADER = "x-profile"
+
+_active_profile = contextvars.ContextVar("active_profile", default=None)
+
+
+class RequestProfile:
+    """Samples collected for a single request"""
+
+    def __init__(self, route):
+        self.route = route
+        self.tags = {"method": "none", "cache": "none"}
+        self.thread_ids = set()
+        self.stacks = Counter()
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    def tag_prefix(self):
+        return ";".join([self.route] + [f"{k}={v}" for k, v in self.tags.items()])
+
+
+class StackSampler:
+    """Background thread sampling the stacks of threads serving profiled requests"""
+
+    def __init__(self, interval_ms=PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.profiles = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.add(profile)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self.thread.start()
+
+    def remove(self, profile):
+        with self.lock:
+            self.profiles.discard(profile)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                profiles = list(self.profiles)
+            if not profiles:
+                # Nothing to sample - let the thread exit, `add` restarts it
+                with self.lock:
+                    if not self.profiles:
+                        self.thread = None
+                        return
+                continue
+
+            frames = sys._current_frames()
+            for profile in profiles:
+                for thread_id in list(profile.thread_ids):
+                    if thread_id == own_id or thread_id not in frames:
+                        continue
+                    frame = frames[thread_id]
+                    if frame.f_code.co_filename.endswith("selectors.py"):
+                        # Idle event loop waiting on sockets
+                        continue
+                    profile.stacks[_fold(frame)] += 1
+            del frames
+
+
+def _fold(frame):
+    """Render a frame chain as a root-first `;`-separated folded stack"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        names.append(f"{module}:{code.co_name}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class ProfileStore:
+    """Aggregated folded stacks per route, bounded by PROFILE_MAX_STACKS"""
+
+    def __init__(self, max_stacks=PROFILE_MAX_STACKS):
+        self.max_stacks = max_stacks
+        self.routes = defaultdict(Counter)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        prefix = profile.tag_prefix()
+        with self.lock:
+            stacks = self.routes[profile.route]
+            self.requests[profile.route] += 1
+            for stack, count in profile.stacks.items():
+                key = f"{prefix};{stack}"
+                if key in stacks or len(stacks) < self.max_stacks:
+                    stacks[key] += count
+
+    def folded(self, route=None):
+        with self.lock:
+            routes = [route] if route else sorted(self.routes)
+            lines = []
+            for name in routes:
+                for stack, count in self.routes.get(name, {}).items():
+                    lines.append(f"{stack} {count}")
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def summary(self):
+        with self.lock:
+            return {
+                route: {
+                    "requests": self.requests[route],
+                    "samples": sum(stacks.values()),
+                    "unique_stacks": len(stacks),
+                }
+                for route, stacks in self.routes.items()
+            }
+
+    def clear(self):
+        with self.lock:
+            self.routes.clear()
+            self.requests.clear()
+
+
+sampler = StackSampler()
+store = ProfileStore()
+
+
+def traced(func):
+    """Tag the active profile with a `GEEService` method and sample its thread
+
+    Returns `func` unchanged when profiling is disabled.
+    """
+    if not PROFILING_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _active_profile.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        profile.tags["method"] = func.__name__
+        profile.thread_ids.add(threading.get_ident())
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.timings[func.__name__] = time.perf_counter() - start
+
+    return wrapper
+
+
+def tag(**tags):
+    """Attach tags (e.g. cache="hit") to the request being profiled, if any"""
+    if not PROFILING_ENABLED:
+        return
+    profile = _active_profile.get()
+    if profile is None:
+        return
+    profile.tags.update(tags)
+
+
+def _should_profile(request):
+    if request.url.path.startswith("/admin/"):
+        return False
+    if request.headers.get(PROFILE_HEADER) == "1":
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def check_admin(request):
+    """Fail with 403 unless ADMIN_TOKEN is set and sent as X-Admin-Token
+
+    Shared by every admin route. Without a configured token the admin
+    routes are closed, not open.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled (ADMIN_TOKEN is not set)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def install(app):
+    """Register the profiling middleware and admin routes on `app`
+
+    Does nothing unless PROFILING_ENABLED is set.
+    """
+    if not PROFILING_ENABLED:
+        return
+
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        if not _should_profile(request):
+            return await call_next(request)
+
+        profile = RequestProfile(request.url.path)
+        # The event loop thread covers routing, validation and JSON serialization
+        profile.thread_ids.add(threading.get_ident())
+        token = _active_profile.set(profile)
+        sampler.add(profile)
+        try:
+            response = await call_next(request)
+        finally:
+            sampler.remove(profile)
+            _active_profile.reset(token)
+            # Bucket by the matched route template ("/regions/{region_id}"),
+            # not the raw path, once routing has run
+            route = request.scope.get("route")
+            if route is not None and getattr(route, "path", None):
+                profile.route = route.path
+            profile.timings["total"] = time.perf_counter() - profile.started
+            store.add(profile)
+
+        response.headers["X-Profile-Samples"] = str(sum(profile.stacks.values()))
+        response.headers["X-Profile-Timings"] = ",".join(
+            f"{name}={seconds * 1000:.1f}ms" for name, seconds in profile.timings.items()
+        )
+        return response
+
+    @app.get("/admin/profiles")
+    def list_profiles(request: Request):
+        """Per-route sample counts collected so far"""
+        check_admin(request)
+        return {
+            "sample_rate": PROFILE_SAMPLE_RATE,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "routes": store.summary(),
+        }
+
+    @app.get("/admin/profiles/folded", response_class=PlainTextResponse)
+    def folded_profiles(request: Request, route: str = None):
+        """Folded stacks (flamegraph.pl / speedscope input), optionally for one route"""
+        check_admin(request)
+        return store.folded(route)
+
+    @app.delete("/admin/profiles")
+    def clear_profiles(request: Request):
+        """Discard all collected samples"""
+        check_admin(request)
+        store.clear()
+        return {"status": "cleared"}
+
+    print(f"🔬 Request profiling enabled (sample rate {PROFILE_SAMPLE_RATE}, "
+          f"interval {PROFILE_INTERVAL_MS} ms)")
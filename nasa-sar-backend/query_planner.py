@@ -0,0 +1,224 @@
+"""Query planner splitting large AOI/date-range requests into sub-queries
+
+Whole-bay, decade-long requests issued as one Earth Engine computation hit
+computation timeouts and memory limits. The planner splits a request into
+time slices and spatial tiles on a fixed grid, runs the sub-queries on a
+shared pool sized to the EE concurrency budget, and merges the partial
+results.
+
+The grid is aligned to calendar months and to multiples of the tile size
+in degrees rather than to the request, so overlapping requests produce the
+same interior sub-queries. Each sub-result is cached on its own: slices
+that ended before EE_INGEST_LAG_DAYS ago no longer change and are kept for
+PLANNER_IMMUTABLE_TTL, while recent slices expire after PLANNER_RECENT_TTL.
+If a sub-query fails, the others still finish and are cached before the
+error is raised, so a retry only recomputes what failed.
+
+Every Earth Engine call (planner sub-queries, tiles, region refreshes, cube
+listing and exports) is wrapped with `ee_call`, which holds one of
+EE_MAX_CONCURRENCY process-wide slots for the duration of the call.
+"""
+
+import os
+import math
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from cache import TTLCache
+
+EE_MAX_CONCURRENCY = int(os.getenv("EE_MAX_CONCURRENCY", "8"))
+PLANNER_SLICE_MONTHS = int(os.getenv("PLANNER_SLICE_MONTHS", "12"))
+PLANNER_TILE_DEGREES = float(os.getenv("PLANNER_TILE_DEGREES", "0.5"))
+PLANNER_CACHE_SIZE = int(os.getenv("PLANNER_CACHE_SIZE", "4096"))
+PLANNER_IMMUTABLE_TTL = float(os.getenv("PLANNER_IMMUTABLE_TTL", str(7 * 24 * 3600)))
+PLANNER_RECENT_TTL = float(os.getenv("PLANNER_RECENT_TTL", "3600"))
+EE_INGEST_LAG_DAYS = int(os.getenv("EE_INGEST_LAG_DAYS", "7"))
+
+SENTINEL1_START = "2014-10-01"
+
+_ee_slots = threading.BoundedSemaphore(EE_MAX_CONCURRENCY)
+_ee_held = threading.local()
+
+
+def ee_call(func):
+    """Run `func` holding one of the EE_MAX_CONCURRENCY shared Earth Engine slots
+
+    Reentrant: an EE call made while the thread already holds a slot uses it.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        depth = getattr(_ee_held, "depth", 0)
+        if not depth:
+            _ee_slots.acquire()
+        _ee_held.depth = depth + 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _ee_held.depth = depth
+            if not depth:
+                _ee_slots.release()
+    return wrapper
+
+
+def _parse(date_string):
+    return datetime.strptime(date_string, '%Y-%m-%d').date()
+
+
+def time_slices(start_date, end_date, slice_months=PLANNER_SLICE_MONTHS):
+    """Split [start_date, end_date) into slices aligned to a fixed month grid
+
+    Returns:
+        List of (start, end) date strings; end is exclusive like filterDate
+    """
+    start, end = _parse(start_date), _parse(end_date)
+    slices = []
+    cursor = start
+    while cursor < end:
+        # Next grid boundary: first month whose index is a multiple of slice_months
+        month_index = cursor.year * 12 + cursor.month - 1
+        boundary_index = (month_index // slice_months + 1) * slice_months
+        boundary = date(boundary_index // 12, boundary_index % 12 + 1, 1)
+        slice_end = min(boundary, end)
+        slices.append((cursor.isoformat(), slice_end.isoformat()))
+        cursor = slice_end
+    return slices
+
+
+def spatial_tiles(bounds, tile_degrees=PLANNER_TILE_DEGREES):
+    """Split "west,south,east,north" into tiles on a global degree grid
+
+    Returns:
+        List of tile bounds strings, clipped to the request bounds
+    """
+    west, south, east, north = [float(x) for x in bounds.split(',')]
+    tiles = []
+    # Integer grid indices avoid accumulating float error across tiles
+    for i in range(math.floor(west / tile_degrees), math.ceil(east / tile_degrees)):
+        for j in range(math.floor(south / tile_degrees), math.ceil(north / tile_degrees)):
+            x, y = i * tile_degrees, j * tile_degrees
+            tile = (max(x, west), max(y, south),
+                    min(x + tile_degrees, east), min(y + tile_degrees, north))
+            if tile[0] < tile[2] and tile[1] < tile[3]:
+                tiles.append(",".join(f"{v:.6f}".rstrip('0').rstrip('.') for v in tile))
+    return tiles
+
+
+def merge_statistics(parts):
+    """Merge partial {count, sum, sum_sq, min, max} into summary statistics"""
+    count = sum(p["count"] for p in parts)
+    total = sum(p["sum"] for p in parts)
+    total_sq = sum(p["sum_sq"] for p in parts)
+    minima = [p["min"] for p in parts if p["min"] is not None]
+    maxima = [p["max"] for p in parts if p["max"] is not None]
+    mean = total / count if count else None
+    std = math.sqrt(max(total_sq / count - mean * mean, 0)) if count else None
+    return {
+        "count": count,
+        "mean": mean,
+        "std": std,
+        "min": min(minima) if minima else None,
+        "max": max(maxima) if maxima else None,
+    }
+
+
+class QueryPlanner:
+    """Splits, schedules, caches and merges Earth Engine sub-queries"""
+
+    def __init__(self, gee, max_concurrency=EE_MAX_CONCURRENCY,
+                 slice_months=PLANNER_SLICE_MONTHS, tile_degrees=PLANNER_TILE_DEGREES):
+        self.gee = gee
+        self.slice_months = slice_months
+        self.tile_degrees = tile_degrees
+        self.cache = TTLCache(max_entries=PLANNER_CACHE_SIZE)
+        # One pool for all regions; the EE calls themselves also take ee_call slots
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="ee-subquery"
+        )
+
+    def plan(self, start_date, end_date, bounds):
+        """List the (slice_start, slice_end, tile_bounds) sub-queries of a request"""
+        return [
+            (slice_start, slice_end, tile)
+            for slice_start, slice_end in time_slices(start_date, end_date, self.slice_months)
+            for tile in spatial_tiles(bounds, self.tile_degrees)
+        ]
+
+    def _ttl(self, slice_end):
+        settled = date.today() - timedelta(days=EE_INGEST_LAG_DAYS)
+        return PLANNER_IMMUTABLE_TTL if _parse(slice_end) <= settled else PLANNER_RECENT_TTL
+
+    def _execute(self, operation, func, subqueries):
+        """Run sub-queries concurrently, serving cached sub-results first
+
+        Every sub-query runs to completion and successful ones are cached
+        even if another fails; the first failure is then raised.
+
+        Returns:
+            (list of sub-results in plan order, number of cache hits)
+        """
+        results = [None] * len(subqueries)
+        pending = {}
+        for i, subquery in enumerate(subqueries):
+            cached = self.cache.get((operation,) + subquery)
+            if cached is not None:
+                results[i] = cached
+            else:
+                ctx = contextvars.copy_context()
+                pending[i] = self.executor.submit(ctx.run, func, *subquery)
+
+        error = None
+        for i, future in pending.items():
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                error = error or e
+                continue
+            subquery = subqueries[i]
+            self.cache.set((operation,) + subquery, results[i], ttl=self._ttl(subquery[1]))
+        if error is not None:
+            raise error
+
+        return results, len(subqueries) - len(pending)
+
+    def available_dates(self, bounds, start_date=None, end_date=None):
+        """Sorted unique acquisition dates, merged from per-slice/tile sub-queries
+
+        Args:
+            bounds: Comma-separated bounds "west,south,east,north"
+            start_date: Start date (YYYY-MM-DD), default Sentinel-1 launch
+            end_date: End date (YYYY-MM-DD, exclusive), default tomorrow
+        """
+        start_date = start_date or SENTINEL1_START
+        end_date = end_date or (date.today() + timedelta(days=1)).isoformat()
+        subqueries = self.plan(start_date, end_date, bounds)
+
+        def run(slice_start, slice_end, tile):
+            return self.gee.get_available_dates(tile, slice_start, slice_end)
+
+        parts, hits = self._execute('dates', run, subqueries)
+        dates = sorted(set(d for part in parts for d in part))
+        print(f"🧩 Planned dates query: {len(subqueries)} sub-queries, {hits} cached, {len(dates)} dates")
+        return dates
+
+    def statistics(self, start_date, end_date, bounds, scale=100):
+        """VV backscatter statistics over all scenes, merged from sub-queries
+
+        Returns:
+            Dict with count, mean, std, min, max and planning details
+        """
+        subqueries = self.plan(start_date, end_date, bounds)
+
+        def run(slice_start, slice_end, tile):
+            return self.gee.get_sar_statistics(slice_start, slice_end, tile, scale)
+
+        parts, hits = self._execute(('stats', scale), run, subqueries)
+        stats = merge_statistics(parts)
+        stats.update({"subqueries": len(subqueries), "cached_subqueries": hits})
+        print(f"🧩 Planned statistics query: {len(subqueries)} sub-queries, {hits} cached")
+        return stats
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
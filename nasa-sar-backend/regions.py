@@ -0,0 +1,192 @@
+"""Region registry for the SAR tile server
+
+Each region bundles its AOI, default date range, detection thresholds and
+water mask source with its own tile cache, date index, precomputed stats and
+worker pools. Work for a region only ever runs on that region's executors, so
+a heavy refresh or burst of requests for one estuary can neither evict nor
+starve another region's hot data.
+
+Regions are built in (Chesapeake Bay) or loaded from the JSON file named by
+REGIONS_FILE, a list of objects with the same keys as `Region.__init__`.
+"""
+
+import os
+import json
+import asyncio
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import profiling
+from cache import TTLCache
+
+REGIONS_FILE = os.getenv("REGIONS_FILE", "regions.json")
+REGION_CACHE_SIZE = int(os.getenv("REGION_CACHE_SIZE", "256"))
+REGION_CACHE_TTL = float(os.getenv("REGION_CACHE_TTL", "3600"))
+REGION_WORKERS = int(os.getenv("REGION_WORKERS", "4"))
+DEFAULT_REGION = os.getenv("DEFAULT_REGION", "chesapeake")
+
+DEFAULT_WATER_MASK = {
+    "asset": "JRC/GSW1_4/YearlyHistory",
+    "band": "waterClass",
+    "year": 2021,
+    "min_class": 3,  # Permanent/seasonal water
+}
+
+BUILTIN_REGIONS = [
+    {
+        "id": "chesapeake",
+        "name": "Chesapeake Bay",
+        "bounds": "-76.5,37.5,-75.5,39.5",
+        "detection_bounds": "-77.3,36.8,-75,39.7",  # Teammate's ROI
+        "default_start_date": "2024-01-01",
+        "default_end_date": "2024-12-31",
+        "oil_threshold": -22,
+        "water_mask": DEFAULT_WATER_MASK,
+    },
+]
+
+
+class Region:
+    """An area of interest with its own caches and worker pools"""
+
+    def __init__(self, id, name, bounds, detection_bounds=None,
+                 default_start_date="2024-01-01", default_end_date="2024-12-31",
+                 oil_threshold=-22, water_mask=None, workers=REGION_WORKERS,
+                 cache_size=REGION_CACHE_SIZE, cache_ttl=REGION_CACHE_TTL):
+        self.id = id
+        self.name = name
+        self.bounds = bounds
+        self.detection_bounds = detection_bounds or bounds
+        self.default_start_date = default_start_date
+        self.default_end_date = default_end_date
+        self.oil_threshold = oil_threshold
+        self.water_mask = {**DEFAULT_WATER_MASK, **(water_mask or {})}
+        self.workers = workers
+
+        self.cache = TTLCache(max_entries=cache_size, ttl=cache_ttl)
+        self.dates = []
+        self.stats = {}
+        self.refreshed_at = None
+
+        # Request work and background refreshes use separate pools so a
+        # refresh never queues ahead of interactive tile requests
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"region-{id}"
+        )
+        self.refresh_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"region-{id}-refresh"
+        )
+
+    def run(self, func, *args, **kwargs):
+        """Run `func` on this region's workers and return an awaitable"""
+        ctx = contextvars.copy_context()
+        future = self.executor.submit(ctx.run, func, *args, **kwargs)
+        return asyncio.wrap_future(future)
+
+    def cached(self, key, compute):
+        """Return the cached value for `key`, computing and storing it on a miss"""
+        value = self.cache.get(key)
+        if value is not None:
+            profiling.tag(cache="hit")
+            return value
+        profiling.tag(cache="miss")
+        value = compute()
+        self.cache.set(key, value)
+        return value
+
+    def refresh(self, planner):
+        """Rebuild the date index and precomputed stats from Earth Engine
+
+        Args:
+            planner: QueryPlanner used to split the full-history date query
+        """
+        dates = planner.available_dates(self.bounds)
+        per_year = Counter(d[:4] for d in dates)
+        per_month = Counter(d[:7] for d in dates)
+
+        self.dates = dates
+        self.stats = {
+            "scene_dates": len(dates),
+            "first_date": dates[0] if dates else None,
+            "last_date": dates[-1] if dates else None,
+            "dates_per_year": dict(sorted(per_year.items())),
+            "dates_per_month": dict(sorted(per_month.items())),
+        }
+        self.refreshed_at = datetime.now().isoformat()
+        # Cached tiles may predate newly ingested scenes
+        self.cache.clear()
+        print(f"🗺️  Region {self.id} refreshed: {len(dates)} scene dates")
+        return self.stats
+
+    def background(self, func, *args, **kwargs):
+        """Queue `func` on the region's dedicated refresh worker"""
+        ctx = contextvars.copy_context()
+        future = self.refresh_executor.submit(ctx.run, func, *args, **kwargs)
+
+        def report(f):
+            if f.exception() is not None:
+                print(f"❌ Region {self.id} background task failed: {f.exception()}")
+
+        future.add_done_callback(report)
+        return asyncio.wrap_future(future)
+
+    def schedule_refresh(self, planner):
+        """Queue a date index and stats refresh on the region's refresh worker"""
+        return self.background(self.refresh, planner)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "bounds": self.bounds,
+            "detection_bounds": self.detection_bounds,
+            "default_start_date": self.default_start_date,
+            "default_end_date": self.default_end_date,
+            "oil_threshold": self.oil_threshold,
+            "water_mask": self.water_mask,
+            "workers": self.workers,
+            "refreshed_at": self.refreshed_at,
+            "stats": self.stats,
+            "cache": self.cache.stats(),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        self.refresh_executor.shutdown(wait=False)
+
+
+class RegionRegistry:
+    """Lookup of configured regions by id"""
+
+    def __init__(self, definitions=None, regions_file=REGIONS_FILE):
+        if definitions is None:
+            definitions = list(BUILTIN_REGIONS)
+            if regions_file and os.path.exists(regions_file):
+                with open(regions_file, 'r') as f:
+                    definitions.extend(json.load(f))
+                print(f"✓ Loaded regions from {regions_file}")
+
+        self.regions = {}
+        for definition in definitions:
+            region = Region(**definition)
+            self.regions[region.id] = region
+
+    def get(self, region_id=None):
+        """Return the region with `region_id` (default region if None)
+
+        Raises:
+            KeyError: If no region with that id is registered
+        """
+        region_id = region_id or DEFAULT_REGION
+        if region_id not in self.regions:
+            raise KeyError(f"Unknown region: {region_id}")
+        return self.regions[region_id]
+
+    def __iter__(self):
+        return iter(self.regions.values())
+
+    def shutdown(self):
+        for region in self:
+            region.shutdown()
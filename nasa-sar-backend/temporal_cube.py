@@ -0,0 +1,221 @@
+"""Pre-aggregated monthly temporal cubes for Sentinel-1 VV composites
+
+Instead of running `.median()` over every scene in a requested date range,
+each region gets one exported Earth Engine asset per month holding mergeable
+partial aggregates of VV backscatter:
+
+    count, sum, sum_sq, min, hist_00 .. hist_NN
+
+Any month-aligned range is answered by combining those monthly images:
+counts, sums and histograms add, minima take the minimum, and an approximate
+median is read off the cumulative histogram. A decade-long composite then
+reads ~120 small pre-reduced images instead of thousands of raw scenes.
+
+Histogram bins are fixed so partial aggregates from any month (and from the
+local-raster cube in data-processing/scripts/temporal_cube.py) are
+compatible: HIST_BINS bins of HIST_WIDTH dB starting at HIST_MIN.
+"""
+
+import os
+import re
+import calendar
+from datetime import date, datetime, timedelta
+
+import ee
+
+from cache import TTLCache
+from query_planner import ee_call
+
+CUBE_ASSET_ROOT = os.getenv("CUBE_ASSET_ROOT")
+CUBE_SCALE = int(os.getenv("CUBE_SCALE", "100"))  # meters
+
+HIST_MIN = -35.0
+HIST_MAX = 5.0
+HIST_BINS = 80
+HIST_WIDTH = (HIST_MAX - HIST_MIN) / HIST_BINS
+HIST_BANDS = [f"hist_{i:02d}" for i in range(HIST_BINS)]
+STATS = ("median", "mean", "std", "min", "count")
+
+
+def month_range(start_date, end_date):
+    """Return the months covered by a month-aligned date range, else None
+
+    `start_date` must be the first day of a month. `end_date` may be either the
+    last day of a month or the first day of the following month (Earth Engine's
+    filterDate end is exclusive).
+
+    Returns:
+        List of "YYYY-MM" strings, or None if the range is not month-aligned
+    """
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    if start.day != 1:
+        return None
+    if end.day == 1:
+        end = end - timedelta(days=1)
+    if end.day != calendar.monthrange(end.year, end.month)[1] or end < start:
+        return None
+
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+class TemporalCube:
+    """Builds and combines per-month partial aggregates stored as EE assets"""
+
+    def __init__(self, asset_root=CUBE_ASSET_ROOT, scale=CUBE_SCALE):
+        self.asset_root = asset_root
+        self.scale = scale
+        self.listing = TTLCache(max_entries=64, ttl=600)
+
+    def enabled(self):
+        return bool(self.asset_root)
+
+    def asset_id(self, region_id, month):
+        return f"{self.asset_root}/{region_id}_{month.replace('-', '_')}"
+
+    def monthly_aggregate(self, bounds, month):
+        """Build the partial-aggregate image for one month of VV scenes
+
+        Args:
+            bounds: Comma-separated bounds "west,south,east,north"
+            month: Month as "YYYY-MM"
+
+        Returns:
+            ee.Image with count, sum, sum_sq, min and histogram bands
+        """
+        coords = [float(x) for x in bounds.split(',')]
+        roi = ee.Geometry.Rectangle(coords)
+        year, mon = [int(x) for x in month.split('-')]
+        start = date(year, mon, 1)
+        end = date(year + (mon == 12), mon % 12 + 1, 1)
+
+        vv = (ee.ImageCollection('COPERNICUS/S1_GRD')
+            .filterBounds(roi)
+            .filterDate(start.isoformat(), end.isoformat())
+            .filter(ee.Filter.eq('instrumentMode', 'IW'))
+            .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+            .select('VV'))
+
+        bins = ee.Image.constant(list(range(HIST_BINS)))
+
+        def one_hot(image):
+            # One band per histogram bin, 1 where the pixel falls in that bin
+            index = image.subtract(HIST_MIN).divide(HIST_WIDTH).floor().clamp(0, HIST_BINS - 1)
+            return bins.eq(index).rename(HIST_BANDS)
+
+        aggregate = ee.Image.cat([
+            vv.count().rename('count'),
+            vv.sum().rename('sum'),
+            vv.map(lambda image: image.pow(2)).sum().rename('sum_sq'),
+            vv.min().rename('min'),
+            vv.map(one_hot).sum(),
+        ])
+        # Exported bands must share a data type
+        return (aggregate.toFloat()
+            .clip(roi)
+            .set({'month': month, 'system:time_start': ee.Date(start.isoformat()).millis()}))
+
+    @ee_call
+    def export_month(self, region_id, bounds, month):
+        """Start an export task writing one month's aggregates to an asset
+
+        Returns:
+            Earth Engine task id
+        """
+        coords = [float(x) for x in bounds.split(',')]
+        task = ee.batch.Export.image.toAsset(
+            image=self.monthly_aggregate(bounds, month),
+            description=f"cube_{region_id}_{month.replace('-', '_')}",
+            assetId=self.asset_id(region_id, month),
+            region=ee.Geometry.Rectangle(coords),
+            scale=self.scale,
+            maxPixels=1e13,
+        )
+        task.start()
+        self.listing.clear()
+        return task.id
+
+    @ee_call
+    def available_months(self, region_id):
+        """List months with an exported aggregate asset for a region"""
+        if not self.enabled():
+            return []
+        months = self.listing.get(region_id)
+        if months is None:
+            # Exactly "<region_id>_YYYY_MM": a plain prefix match would also
+            # pick up regions whose id starts with this one
+            pattern = re.compile(rf"{re.escape(region_id)}_(\d{{4}})_(\d{{2}})")
+            try:
+                assets = ee.data.listAssets({'parent': self.asset_root}).get('assets', [])
+            except ee.EEException as e:
+                print(f"⚠️  Could not list cube assets under {self.asset_root}: {e}")
+                return []
+            months = sorted(
+                f"{match.group(1)}-{match.group(2)}"
+                for match in (pattern.fullmatch(a['id'].rsplit('/', 1)[-1]) for a in assets)
+                if match
+            )
+            self.listing.set(region_id, months)
+        return months
+
+    def build(self, region_id, bounds, start_month, end_month):
+        """Export aggregates for every month in range that is not built yet
+
+        Returns:
+            Dict mapping month to started task id
+        """
+        start = f"{start_month}-01"
+        year, mon = [int(x) for x in end_month.split('-')]
+        end = f"{end_month}-{calendar.monthrange(year, mon)[1]:02d}"
+        existing = set(self.available_months(region_id))
+        return {
+            month: self.export_month(region_id, bounds, month)
+            for month in month_range(start, end)
+            if month not in existing
+        }
+
+    def composite(self, region_id, start_date, end_date, stat='median'):
+        """Combine monthly aggregates into a composite over a date range
+
+        Args:
+            region_id: Region whose cube to read
+            start_date: Start date string (YYYY-MM-DD), first day of a month
+            end_date: End date string (YYYY-MM-DD), end of a month
+            stat: One of "median" (approximate), "mean", "std", "min", "count"
+
+        Returns:
+            Single-band ee.Image named "VV", or None if the range is not
+            month-aligned or any month has not been built
+        """
+        if stat not in STATS:
+            raise ValueError(f"Unknown composite statistic: {stat}")
+        months = month_range(start_date, end_date)
+        if not months or not set(months) <= set(self.available_months(region_id)):
+            return None
+
+        cube = ee.ImageCollection([ee.Image(self.asset_id(region_id, m)) for m in months])
+        count = cube.select('count').sum()
+
+        if stat == 'count':
+            result = count
+        elif stat == 'min':
+            result = cube.select('min').min()
+        elif stat in ('mean', 'std'):
+            mean = cube.select('sum').sum().divide(count)
+            result = mean
+            if stat == 'std':
+                mean_sq = cube.select('sum_sq').sum().divide(count)
+                result = mean_sq.subtract(mean.pow(2)).max(0).sqrt()
+        else:
+            # Approximate median: average the bins holding the two middle ranks
+            cumulative = cube.select(HIST_BANDS).sum().toArray().arrayAccum(0)
+            lower = cumulative.gte(count.divide(2).ceil()).arrayArgmax().arrayGet([0])
+            upper = cumulative.gte(count.divide(2).floor().add(1)).arrayArgmax().arrayGet([0])
+            result = lower.add(upper).divide(2).add(0.5).multiply(HIST_WIDTH).add(HIST_MIN)
+
+        return result.updateMask(count.gt(0)).rename('VV')